@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""Gene-cluster bootstrap confidence intervals for AUROC and ensemble gains.
+
+Works on the out-of-fold predictions written by ``cv_model_control.py`` (one
+held-out score per variant and model spec). Each replicate resamples genes
+with replacement, so variants of a gene stay together. A replicate's AUROC
+is the Mann-Whitney statistic with every variant weighted by how often its
+gene was drawn, which equals the AUROC of the physically resampled table.
+The scores of each model are sorted once, together with their tie groups,
+so one replicate costs a cumulative sum over the sorted weights instead of a
+sort, and all models and replicates in a block are computed together.
+
+Replicate ``b`` draws from its own child of ``SeedSequence(seed)``, so results
+depend only on the seed and the replicate count, not on ``--workers`` or
+the block size. Reported per model and per ``ΔAUROC`` comparison: the
+pooled out-of-fold estimate, bootstrap SE, percentile and BCa intervals and
+a two-sided bootstrap p-value for the gains. The BCa acceleration comes from
+the delete-one-gene jackknife, computed exactly from per-gene sorted score
+blocks (within-gene pair counts) rather than by refitting each gene.
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+from eval_runner import add_worker_args, run_cells
+from score_table import load_score_table
+
+
+MODEL_DIR = Path("Results/Revision/len1022_model_control")
+OOF_PREDICTIONS = MODEL_DIR / "model_control_oof_predictions.parquet"
+ID_COLUMNS = ["Gene_prot", "label", "repeat", "fold"]
+BLOCK_ELEMENTS = 1 << 22
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Gene-cluster bootstrap CIs for model-control AUROCs.")
+    parser.add_argument("--oof", type=Path, default=OOF_PREDICTIONS)
+    parser.add_argument("--out", type=Path, default=MODEL_DIR / "model_control_bootstrap_ci.csv")
+    parser.add_argument("--n-boot", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=16)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Cross-validation repeat whose predictions are resampled (1 = the --seed split).",
+    )
+    add_worker_args(parser)
+    return parser.parse_args()
+
+
+def tie_bounds(sorted_scores: np.ndarray, sorted_groups: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """First and last position of the tie group of every element of a sorted array (ties never span groups)."""
+    n = len(sorted_scores)
+    position = np.arange(n)
+    starts = np.ones(n, dtype=bool)
+    starts[1:] = sorted_scores[1:] != sorted_scores[:-1]
+    if sorted_groups is not None:
+        starts[1:] |= sorted_groups[1:] != sorted_groups[:-1]
+    ends = np.ones(n, dtype=bool)
+    ends[:-1] = starts[1:]
+    first = np.maximum.accumulate(np.where(starts, position, 0))
+    last = np.minimum.accumulate(np.where(ends, position, n - 1)[::-1])[::-1]
+    return first, last
+
+
+def sorted_blocks(scores: np.ndarray, y: np.ndarray, genes: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Per-model gene codes of the negatives and positives in score order, as (m, n_neg) / (m, n_pos) arrays.
+
+    ``below``/``upto`` hold, for each positive, the number of negatives
+    scoring strictly lower / lower or tied, as offsets into the cumulative
+    negative weights.
+    """
+    m = scores.shape[1]
+    n_pos, n_neg = int(y.sum()), int((~y).sum())
+    blocks = {
+        "neg_genes": np.empty((m, n_neg), dtype=np.int32),
+        "pos_genes": np.empty((m, n_pos), dtype=np.int32),
+        "below": np.empty((m, n_pos), dtype=np.int64),
+        "upto": np.empty((m, n_pos), dtype=np.int64),
+    }
+    for k in range(m):
+        order = np.argsort(scores[:, k], kind="stable")
+        positive = y[order]
+        first, last = tie_bounds(scores[order, k])
+        neg_cum = np.concatenate([[0], np.cumsum(~positive)])
+        blocks["neg_genes"][k] = genes[order][~positive]
+        blocks["pos_genes"][k] = genes[order][positive]
+        blocks["below"][k] = neg_cum[first][positive]
+        blocks["upto"][k] = neg_cum[last + 1][positive]
+    return blocks
+
+
+def weighted_aucs(blocks: dict[str, np.ndarray], weights: np.ndarray) -> np.ndarray:
+    """
+    AUROC of every model for each row of per-gene ``weights`` (b, n_genes).
+
+    Returns:
+        (b, m) weighted Mann-Whitney AUROCs.
+    """
+    m = blocks["neg_genes"].shape[0]
+    out = np.empty((weights.shape[0], m))
+    negative_total = weights[:, blocks["neg_genes"][0]].sum(axis=1)
+    positive_total = weights[:, blocks["pos_genes"][0]].sum(axis=1)
+    for k in range(m):
+        negative_cum = np.zeros((weights.shape[0], blocks["neg_genes"].shape[1] + 1))
+        np.cumsum(weights[:, blocks["neg_genes"][k]], axis=1, out=negative_cum[:, 1:])
+        ordered = negative_cum[:, blocks["below"][k]] + negative_cum[:, blocks["upto"][k]]
+        pairs = (weights[:, blocks["pos_genes"][k]] * ordered).sum(axis=1) / 2.0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out[:, k] = pairs / (positive_total * negative_total)
+    return out
+
+
+def bootstrap_cell(arrays: dict[str, np.ndarray], cell: tuple) -> np.ndarray:
+    """AUROCs (b, m) of the replicates seeded by the ``SeedSequence`` children in ``cell``."""
+    n_genes = int(arrays["n_genes"][0])
+    counts = np.empty((len(cell), n_genes))
+    for row, seed in enumerate(cell):
+        draws = np.random.default_rng(seed).integers(0, n_genes, size=n_genes)
+        counts[row] = np.bincount(draws, minlength=n_genes)
+    return weighted_aucs(arrays, counts)
+
+
+def bootstrap_aucs(
+    scores: np.ndarray,
+    y: np.ndarray,
+    genes: np.ndarray,
+    n_boot: int = 2000,
+    seed: int = 16,
+    workers: int = 1,
+) -> np.ndarray:
+    """
+    Gene-resampled AUROC replicates for every model.
+
+    Args:
+        scores: (n, m) scores, higher = more pathogenic; no NaN.
+        y: Binary labels (n,).
+        genes: Gene of each variant (any hashable values).
+        n_boot: Number of replicates.
+        seed: Root of the per-replicate ``SeedSequence`` streams.
+        workers: Processes for ``eval_runner.run_cells``.
+
+    Returns:
+        (n_boot, m) AUROCs; replicate ``b`` is the same for any ``workers``.
+    """
+    gene_codes, gene_names = pd.factorize(pd.Series(genes).astype(str))
+    arrays = sorted_blocks(np.asarray(scores, dtype=np.float64), np.asarray(y).astype(bool), gene_codes)
+    arrays["n_genes"] = np.array([len(gene_names)])
+    seeds = np.random.SeedSequence(seed).spawn(n_boot)
+    block = max(1, BLOCK_ELEMENTS // max(len(y), 1))
+    cells = [seeds[start : start + block] for start in range(0, n_boot, block)]
+    results = run_cells(bootstrap_cell, cells, arrays, workers)
+    return np.vstack(results) if results else np.empty((0, scores.shape[1]))
+
+
+def point_aucs(scores: np.ndarray, y: np.ndarray) -> np.ndarray:
+    single_gene = np.zeros(len(y), dtype=np.int32)
+    blocks = sorted_blocks(np.asarray(scores, dtype=np.float64), np.asarray(y).astype(bool), single_gene)
+    return weighted_aucs(blocks, np.ones((1, 1)))[0]
+
+
+def jackknife_aucs(scores: np.ndarray, y: np.ndarray, genes: np.ndarray) -> np.ndarray:
+    """
+    Delete-one-gene AUROCs (n_genes, m), exactly and without refitting.
+
+    With ``V10``/``V01`` the per-positive/per-negative Mann-Whitney counts on
+    the full data and ``K_g`` the pair count within gene ``g`` (from a
+    (gene, score) sort), dropping gene ``g`` leaves
+    ``U - sum_{g, pos} V10 - sum_{g, neg} V01 + K_g`` correctly ordered pairs.
+    """
+    y = np.asarray(y).astype(bool)
+    gene_codes = pd.factorize(pd.Series(genes).astype(str))[0]
+    n_genes = gene_codes.max() + 1
+    n_pos, n_neg = int(y.sum()), int((~y).sum())
+    pos_g = np.bincount(gene_codes[y], minlength=n_genes)
+    neg_g = np.bincount(gene_codes[~y], minlength=n_genes)
+    out = np.empty((n_genes, scores.shape[1]))
+    for k in range(scores.shape[1]):
+        score = np.asarray(scores[:, k], dtype=np.float64)
+        order = np.argsort(score, kind="stable")
+        positive, code = y[order], gene_codes[order]
+        first, last = tie_bounds(score[order])
+        neg_cum = np.cumsum(~positive)
+        pos_cum = np.cumsum(positive)
+        neg_below = np.where(first > 0, neg_cum[np.maximum(first - 1, 0)], 0)
+        pos_below = np.where(first > 0, pos_cum[np.maximum(first - 1, 0)], 0)
+        v10 = (neg_below + neg_cum[last]) / 2.0
+        v01 = n_pos - (pos_below + pos_cum[last]) / 2.0
+        total = v10[positive].sum()
+        drop = np.bincount(code[positive], v10[positive], n_genes) + np.bincount(code[~positive], v01[~positive], n_genes)
+
+        order = np.lexsort((score, gene_codes))
+        positive, code = y[order], gene_codes[order]
+        first, last = tie_bounds(score[order], code)
+        neg_cum = np.cumsum(~positive)
+        gene_start = np.searchsorted(code, code)
+        before_gene = np.where(gene_start > 0, neg_cum[np.maximum(gene_start - 1, 0)], 0)
+        below = np.where(first > 0, neg_cum[np.maximum(first - 1, 0)], 0) - before_gene
+        within = np.bincount(code[positive], ((below + neg_cum[last] - before_gene) / 2.0)[positive], n_genes)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out[:, k] = (total - drop + within) / ((n_pos - pos_g) * (n_neg - neg_g))
+    return out
+
+
+def bca_interval(estimate: float, replicates: np.ndarray, jackknife: np.ndarray, alpha: float) -> tuple[float, float]:
+    """Bias-corrected and accelerated interval; NaN when the bias correction is undefined."""
+    replicates = replicates[np.isfinite(replicates)]
+    jackknife = jackknife[np.isfinite(jackknife)]
+    if len(replicates) == 0:
+        return np.nan, np.nan
+    below = np.mean(replicates < estimate) + 0.5 * np.mean(replicates == estimate)
+    if below in (0.0, 1.0):
+        return np.nan, np.nan
+    z0 = norm.ppf(below)
+    spread = jackknife.mean() - jackknife
+    denom = 6.0 * (spread**2).sum() ** 1.5
+    accel = (spread**3).sum() / denom if denom > 0 else 0.0
+    bounds = []
+    for z in norm.ppf([alpha / 2.0, 1.0 - alpha / 2.0]):
+        bounds.append(float(np.quantile(replicates, norm.cdf(z0 + (z0 + z) / (1.0 - accel * (z0 + z))))))
+    return bounds[0], bounds[1]
+
+
+def summarize(
+    name: str,
+    estimate: float,
+    replicates: np.ndarray,
+    jackknife: np.ndarray,
+    alpha: float,
+    gain: bool,
+) -> dict[str, object]:
+    finite = replicates[np.isfinite(replicates)]
+    low, high = np.quantile(finite, [alpha / 2.0, 1.0 - alpha / 2.0]) if len(finite) else (np.nan, np.nan)
+    bca_low, bca_high = bca_interval(estimate, replicates, jackknife, alpha)
+    row = {
+        "quantity": "delta_auc" if gain else "auc",
+        "name": name,
+        "estimate": estimate,
+        "boot_se": float(finite.std(ddof=1)) if len(finite) > 1 else np.nan,
+        "pct_low": float(low),
+        "pct_high": float(high),
+        "bca_low": bca_low,
+        "bca_high": bca_high,
+        "n_boot": len(finite),
+    }
+    if gain:
+        row["boot_p"] = float(min(1.0, 2.0 * min(np.mean(finite <= 0), np.mean(finite >= 0)))) if len(finite) else np.nan
+    return row
+
+
+def bootstrap_table(
+    oof: pd.DataFrame,
+    models: list[str],
+    comparisons: list[tuple[str, str]],
+    n_boot: int = 2000,
+    seed: int = 16,
+    alpha: float = 0.05,
+    workers: int = 1,
+    gene_col: str = "Gene_prot",
+) -> pd.DataFrame:
+    """Percentile and BCa intervals for each model's AUROC and each ``(a, b)`` gain ``AUROC(a) - AUROC(b)``."""
+    oof = oof.dropna(subset=models)
+    scores = oof[models].to_numpy(dtype=np.float64)
+    y = oof["label"].to_numpy(dtype=int)
+    genes = oof[gene_col].astype(str).to_numpy()
+    estimate = point_aucs(scores, y)
+    replicates = bootstrap_aucs(scores, y, genes, n_boot, seed, workers)
+    jackknife = jackknife_aucs(scores, y, genes)
+    column = {model: k for k, model in enumerate(models)}
+
+    rows = [
+        summarize(model, float(estimate[k]), replicates[:, k], jackknife[:, k], alpha, gain=False)
+        for model, k in column.items()
+    ]
+    for a, b in comparisons:
+        i, j = column[a], column[b]
+        row = summarize(
+            f"{a} - {b}",
+            float(estimate[i] - estimate[j]),
+            replicates[:, i] - replicates[:, j],
+            jackknife[:, i] - jackknife[:, j],
+            alpha,
+            gain=True,
+        )
+        rows.append({**row, "a": a, "b": b})
+    table = pd.DataFrame(rows)
+    table["alpha"] = alpha
+    table["seed"] = seed
+    table["n_genes"] = len(np.unique(genes))
+    table["n_variants"] = len(y)
+    return table
+
+
+def main() -> None:
+    from cv_model_control import COMPARISONS
+
+    args = parse_args()
+    oof = load_score_table(args.oof)
+    if "repeat" in oof.columns:
+        oof = oof[oof["repeat"] == args.repeat]
+        if oof.empty:
+            raise ValueError(f"No predictions for repeat {args.repeat} in {args.oof}")
+    models = [col for col in oof.columns if col not in ID_COLUMNS]
+    comparisons = [(a, b) for a, b in COMPARISONS if a in models and b in models]
+    table = bootstrap_table(oof, models, comparisons, args.n_boot, args.seed, args.alpha, args.workers)
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    table.to_csv(args.out, index=False)
+    print(table.to_string(index=False, float_format=lambda value: f"{value:.4f}"))
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,10 @@ import numpy as np
 import pandas as pd
 from scipy.stats import ttest_rel
 from sklearn.metrics import roc_auc_score
-from sklearn.model_selection import StratifiedGroupKFold
+
+from eval_runner import add_worker_args, fold_view, run_cells
+from fast_auc import best_candidate
+from split_registry import add_repeat_args, corrected_ttest, repeated_fold_ids
 
 
 BASE = Path("Results/ClinMAVE")
@@ -29,6 +32,9 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--base", type=Path, default=BASE)
     parser.add_argument("--outdir", type=Path, default=OUTDIR)
     parser.add_argument("--folds", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    add_repeat_args(parser)
+    add_worker_args(parser)
     parser.add_argument(
         "--drop-global-conflicts",
         action="store_true",
@@ -63,9 +69,7 @@ def drop_ambiguous_and_duplicate_variants(df: pd.DataFrame) -> tuple[pd.DataFram
     }
 
 
-def standardize_train_test(train: pd.DataFrame, test: pd.DataFrame, cols: list[str]) -> tuple[np.ndarray, np.ndarray]:
-    train_x = train[cols].to_numpy(float)
-    test_x = test[cols].to_numpy(float)
+def standardize_train_test(train_x: np.ndarray, test_x: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
     mean = train_x.mean(axis=0)
     sd = train_x.std(axis=0)
     sd[sd == 0] = 1.0
@@ -73,15 +77,8 @@ def standardize_train_test(train: pd.DataFrame, test: pd.DataFrame, cols: list[s
 
 
 def best_weight(y: np.ndarray, esm: np.ndarray, calm: np.ndarray) -> float:
-    best_w = 0.0
-    best_auc = -np.inf
-    for w in WEIGHTS:
-        score = w * calm + (1.0 - w) * esm
-        auc = roc_auc_score(y, score)
-        if auc > best_auc:
-            best_auc = auc
-            best_w = float(w)
-    return best_w
+    best, _ = best_candidate(y, [calm, esm], np.column_stack([WEIGHTS, 1.0 - WEIGHTS]))
+    return float(WEIGHTS[best])
 
 
 def safe_roc_auc(y: np.ndarray, score: np.ndarray) -> float:
@@ -100,55 +97,75 @@ def paired_t_p(a: pd.Series, b: pd.Series) -> float:
     return float(ttest_rel(pairs.iloc[:, 0], pairs.iloc[:, 1]).pvalue)
 
 
-def make_splits(df: pd.DataFrame, folds: int):
+def make_splits(df: pd.DataFrame, folds: int, seed: int, repeats: int):
     y = df["label"].to_numpy()
     groups = df["Gene"].astype(str).to_numpy()
     n_splits = min(folds, int(np.bincount(y).min()), int(pd.Series(groups).nunique()))
     if n_splits < 2:
         raise ValueError("Not enough data for cross-validation")
-    splitter = StratifiedGroupKFold(n_splits=n_splits, shuffle=True, random_state=7)
-    return list(splitter.split(df, y, groups=groups)), "stratified_gene"
-
-
-def evaluate_dataset(df: pd.DataFrame, assay: str, case_class: str, folds: int) -> tuple[pd.DataFrame, dict]:
-    splits, split_type = make_splits(df, folds)
-    rows = []
-    for fold, (train_idx, test_idx) in enumerate(splits, start=1):
-        train = df.iloc[train_idx].copy()
-        test = df.iloc[test_idx].copy()
-        y_train = train["label"].to_numpy()
-        y_test = test["label"].to_numpy()
-
-        train_scaled, test_scaled = standardize_train_test(train, test, ["esm1b_650m_score", "calm_score"])
-        esm_train, calm_train = train_scaled[:, 0], train_scaled[:, 1]
-        esm_test, calm_test = test_scaled[:, 0], test_scaled[:, 1]
-        w = best_weight(y_train, esm_train, calm_train)
-
-        esm_auc = safe_roc_auc(y_test, esm_test)
-        calm_auc = safe_roc_auc(y_test, calm_test)
-        combo_auc = safe_roc_auc(y_test, w * calm_test + (1.0 - w) * esm_test)
-
-        fold_row = {
-            "assay": assay,
-            "case_class": case_class,
-            "fold": fold,
-            "split_type": split_type,
-            "n_train": len(train),
-            "n_test": len(test),
-            "n_test_genes": test["Gene"].nunique(),
-            "n_test_cases": int(y_test.sum()),
-            "n_test_controls": int((1 - y_test).sum()),
-            "calm_weight": w,
-            "esm1b_650m_weight": 1.0 - w,
-            "auroc_esm1b_650m": esm_auc,
-            "auroc_calm": calm_auc,
-            "auroc_esm1b_650m_calm": combo_auc,
-        }
-        fold_row["delta_combo_vs_esm1b_650m"] = fold_row["auroc_esm1b_650m_calm"] - fold_row["auroc_esm1b_650m"]
-        fold_row["delta_combo_vs_calm"] = fold_row["auroc_esm1b_650m_calm"] - fold_row["auroc_calm"]
-        rows.append(fold_row)
-
-    fold_df = pd.DataFrame(rows)
+    fold_ids = repeated_fold_ids(y, groups, n_splits, seed, repeats, group_col="Gene")
+    return fold_ids, n_splits, "stratified_gene"
+
+
+def evaluate_fold(arrays: dict[str, np.ndarray], cell: tuple) -> dict[str, object]:
+    repeat, fold, assay, case_class, split_type = cell
+    view = fold_view(arrays, fold, repeat)
+    y_train = view["y_train"]
+    y_test = view["y_test"]
+
+    train_scaled, test_scaled = standardize_train_test(view["train_scores"], view["test_scores"])
+    esm_train, calm_train = train_scaled[:, 0], train_scaled[:, 1]
+    esm_test, calm_test = test_scaled[:, 0], test_scaled[:, 1]
+    w = best_weight(y_train, esm_train, calm_train)
+
+    esm_auc = safe_roc_auc(y_test, esm_test)
+    calm_auc = safe_roc_auc(y_test, calm_test)
+    combo_auc = safe_roc_auc(y_test, w * calm_test + (1.0 - w) * esm_test)
+
+    fold_row = {
+        "assay": assay,
+        "case_class": case_class,
+        "repeat": repeat,
+        "fold": fold,
+        "split_type": split_type,
+        "n_train": len(y_train),
+        "n_test": len(y_test),
+        "n_test_genes": view["n_test_genes"],
+        "n_test_cases": int(y_test.sum()),
+        "n_test_controls": int((1 - y_test).sum()),
+        "calm_weight": w,
+        "esm1b_650m_weight": 1.0 - w,
+        "auroc_esm1b_650m": esm_auc,
+        "auroc_calm": calm_auc,
+        "auroc_esm1b_650m_calm": combo_auc,
+    }
+    fold_row["delta_combo_vs_esm1b_650m"] = fold_row["auroc_esm1b_650m_calm"] - fold_row["auroc_esm1b_650m"]
+    fold_row["delta_combo_vs_calm"] = fold_row["auroc_esm1b_650m_calm"] - fold_row["auroc_calm"]
+    return fold_row
+
+
+def evaluate_dataset(
+    df: pd.DataFrame,
+    assay: str,
+    case_class: str,
+    folds: int,
+    seed: int = 7,
+    repeats: int = 1,
+    workers: int = 1,
+) -> tuple[pd.DataFrame, dict]:
+    fold_ids, n_splits, split_type = make_splits(df, folds, seed, repeats)
+    arrays = {
+        "scores": df[["esm1b_650m_score", "calm_score"]].to_numpy(float),
+        "y": df["label"].to_numpy(),
+        "fold_ids": fold_ids,
+        "gene_codes": pd.factorize(df["Gene"].astype(str))[0],
+    }
+    cells = [
+        (repeat, fold, assay, case_class, split_type)
+        for repeat in range(1, repeats + 1)
+        for fold in range(1, n_splits + 1)
+    ]
+    fold_df = pd.DataFrame(run_cells(evaluate_fold, cells, arrays, workers))
     summary = {
         "assay": assay,
         "case_class": case_class,
@@ -158,6 +175,7 @@ def evaluate_dataset(df: pd.DataFrame, assay: str, case_class: str, folds: int)
         "n_controls": int((1 - df["label"]).sum()),
         "n_genes": df["Gene"].nunique(),
         "n_folds": fold_df["fold"].nunique(),
+        "n_repeats": fold_df["repeat"].nunique(),
         "n_evaluable_folds": int(fold_df["auroc_esm1b_650m_calm"].notna().sum()),
         "mean_calm_weight": fold_df["calm_weight"].mean(),
         "sd_calm_weight": fold_df["calm_weight"].std(ddof=1),
@@ -165,12 +183,17 @@ def evaluate_dataset(df: pd.DataFrame, assay: str, case_class: str, folds: int)
     for col in ["auroc_esm1b_650m", "auroc_calm", "auroc_esm1b_650m_calm", "delta_combo_vs_esm1b_650m", "delta_combo_vs_calm"]:
         summary[f"{col}_mean"] = fold_df[col].mean()
         summary[f"{col}_sd"] = fold_df[col].std(ddof=1)
+    # The uncorrected paired t-tests treat folds as independent, so they use the first
+    # repeat (the --seed split); the corrected t-tests pool every repeat x fold.
+    first = fold_df[fold_df["repeat"] == 1]
     summary["p_delta_combo_vs_esm1b_650m_paired_t"] = paired_t_p(
-        fold_df["auroc_esm1b_650m_calm"], fold_df["auroc_esm1b_650m"]
+        first["auroc_esm1b_650m_calm"], first["auroc_esm1b_650m"]
     )
     summary["p_delta_combo_vs_calm_paired_t"] = paired_t_p(
-        fold_df["auroc_esm1b_650m_calm"], fold_df["auroc_calm"]
+        first["auroc_esm1b_650m_calm"], first["auroc_calm"]
     )
+    for col in ["delta_combo_vs_esm1b_650m", "delta_combo_vs_calm"]:
+        summary[f"p_{col}_corrected_t"] = corrected_ttest(fold_df[col], n_splits)[1]
     return fold_df, summary
 
 
@@ -224,7 +247,9 @@ def main() -> None:
             audits.append(dup_audit)
             merged_outputs.append(df)
 
-            fold_df, summary = evaluate_dataset(df, assay, case_class, args.folds)
+            fold_df, summary = evaluate_dataset(
+                df, assay, case_class, args.folds, args.seed, args.repeats, args.workers
+            )
             all_folds.append(fold_df)
             summaries.append(summary)
 
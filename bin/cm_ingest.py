@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Ingest the raw ClinMAVE variant JSONL into a partitioned Parquet dataset.
+
+``cm_fetch_pairs.py`` dumps one JSON record per ClinMAVE variant. This script
+parses the dump once, derives the typed columns the analyses use (``platform``
+as DMS/CBGE/other, ``label`` as int8 with nulls for classes other than
+functionally normal / loss-of-function) and writes a hive-partitioned dataset
+``Gene=<gene>/platform=<platform>/``. Readers filter on gene, datasetId,
+platform, label and consequence with predicate pushdown instead of
+re-parsing JSON.
+
+The dataset keeps the line number of each record (``record``) so loaded rows
+come back in dump order, and ``_source.json`` records the size and mtime of
+the dump it was built from and the dataset format; ``load_clinmave_variants``
+re-ingests automatically when either changes. ``datasetId`` is stored through
+``dataset_key``, which writes integral numbers without a decimal part, so ids
+read back as floats (``123.0``, e.g. from a pairs CSV with gaps) match.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import shutil
+from pathlib import Path
+
+import pandas as pd
+
+
+RAW_JSONL = Path("Results/Revision/ClinMAVE_api_cross_platform/clinmave_dms_cbge_gene_variants.jsonl")
+DATASET = Path("Results/Revision/ClinMAVE_api_cross_platform/clinmave_variants_dataset")
+MANIFEST = "_source.json"
+FORMAT = 2
+CHUNK_RECORDS = 200_000
+PLATFORMS = {"Deep Mutational Scanning": "DMS", "CRISPR-Based Genome Editing": "CBGE"}
+LABELS = {"Functionally normal": 0, "Loss-of-function": 1}
+STRING_FIELDS = {
+    "Identifier": "identifier",
+    "datasetId": "datasetId",
+    "consequenceClass": "consequenceClass",
+    "molecularConsequence": "molecularConsequence",
+    "maveTechnique": "maveTechnique",
+    "phenotype": "phenotype",
+    "pmid": "pmid",
+}
+
+
+def schemas():
+    import pyarrow as pa
+
+    partition = pa.schema([("Gene", pa.string()), ("platform", pa.string())])
+    fields = [("record", pa.int64()), ("label", pa.int8())] + [(name, pa.string()) for name in STRING_FIELDS]
+    return pa.schema([*partition, *fields]), partition
+
+
+def as_text(value: object) -> str | None:
+    if value is None:
+        return None
+    return value if isinstance(value, str) else json.dumps(value) if isinstance(value, (list, dict)) else str(value)
+
+
+def dataset_key(value: object) -> str | None:
+    """Canonical text of a datasetId: integral numbers as ``123``, other values as text."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        number = float(value)
+    else:
+        value = str(value).strip()
+        try:
+            number = float(value)
+        except ValueError:
+            return value
+    return str(int(number)) if number.is_integer() else str(value)
+
+
+def record_batches(raw: Path, schema, counts: dict[str, int]):
+    import pyarrow as pa
+
+    columns: dict[str, list] = {name: [] for name in schema.names}
+
+    def flush():
+        batch = pa.RecordBatch.from_pydict(columns, schema=schema)
+        for values in columns.values():
+            values.clear()
+        return batch
+
+    with raw.open() as handle:
+        for line_no, line in enumerate(handle):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            gene = record.get("geneName")
+            if not gene:
+                counts["no_gene"] += 1
+                continue
+            columns["Gene"].append(str(gene))
+            columns["platform"].append(PLATFORMS.get(record.get("maveTechnique"), "other"))
+            columns["record"].append(line_no)
+            columns["label"].append(LABELS.get(record.get("consequenceClass")))
+            for name, key in STRING_FIELDS.items():
+                text = dataset_key if name == "datasetId" else as_text
+                columns[name].append(text(record.get(key)))
+            counts["records"] += 1
+            if len(columns["record"]) >= CHUNK_RECORDS:
+                yield flush()
+    if columns["record"]:
+        yield flush()
+
+
+def source_stamp(raw: Path) -> dict[str, object]:
+    stat = raw.stat()
+    return {"raw": str(raw), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def is_current(dataset: Path, raw: Path) -> bool:
+    manifest = dataset / MANIFEST
+    if not manifest.exists():
+        return False
+    stamp = json.loads(manifest.read_text())
+    current = source_stamp(raw)
+    return (
+        stamp.get("format") == FORMAT
+        and stamp.get("size") == current["size"]
+        and stamp.get("mtime_ns") == current["mtime_ns"]
+    )
+
+
+def ingest(raw: Path = RAW_JSONL, dataset: Path = DATASET) -> dict[str, int]:
+    import pyarrow.dataset as ds
+
+    schema, partition = schemas()
+    counts = {"records": 0, "no_gene": 0}
+    tmp = dataset.with_name(dataset.name + ".tmp")
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    ds.write_dataset(
+        record_batches(raw, schema, counts),
+        tmp,
+        schema=schema,
+        format="parquet",
+        partitioning=ds.partitioning(partition, flavor="hive"),
+        max_partitions=1_000_000,
+        existing_data_behavior="error",
+    )
+    (tmp / MANIFEST).write_text(json.dumps({**source_stamp(raw), "format": FORMAT, **counts}, indent=2))
+    if dataset.exists():
+        shutil.rmtree(dataset)
+    tmp.rename(dataset)
+    return counts
+
+
+def load_clinmave_variants(
+    dataset: Path = DATASET,
+    raw: Path | None = RAW_JSONL,
+    genes: list[str] | None = None,
+    dataset_ids: list[object] | None = None,
+    platforms: list[str] | None = None,
+    missense_only: bool = False,
+    labelled_only: bool = False,
+    columns: list[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Read ClinMAVE variants with the given filters pushed down to the dataset.
+
+    Args:
+        dataset: Partitioned dataset written by ``ingest``.
+        raw: JSONL dump; when given, the dataset is (re)built if missing or stale.
+        genes: Keep only these genes (partition pruning).
+        dataset_ids: Keep only these datasetIds (compared through ``dataset_key``).
+        platforms: Keep only these platforms ("DMS", "CBGE", "other").
+        missense_only: Keep only ``molecularConsequence == "Missense"``.
+        labelled_only: Keep only records with a binary ``label``.
+        columns: Columns to return; defaults to all.
+
+    Returns:
+        Matching records in dump order.
+    """
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    if raw is not None and (not dataset.exists() or not is_current(dataset, raw)):
+        counts = ingest(raw, dataset)
+        print(f"Ingested {counts['records']} ClinMAVE records into {dataset}")
+    _, partition = schemas()
+    data = ds.dataset(dataset, format="parquet", partitioning=ds.partitioning(partition, flavor="hive"))
+
+    conditions = []
+    if genes is not None:
+        conditions.append(pc.field("Gene").isin([str(gene) for gene in genes]))
+    if platforms is not None:
+        conditions.append(pc.field("platform").isin(list(platforms)))
+    if dataset_ids is not None:
+        conditions.append(pc.field("datasetId").isin([dataset_key(value) for value in dataset_ids]))
+    if missense_only:
+        conditions.append(pc.field("molecularConsequence") == "Missense")
+    if labelled_only:
+        conditions.append(pc.field("label").is_valid())
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    wanted = None if columns is None else list(dict.fromkeys(["record", *columns]))
+    df = data.to_table(columns=wanted, filter=expression).to_pandas()
+    df = df.sort_values("record", kind="stable").reset_index(drop=True)
+    if labelled_only:
+        df["label"] = df["label"].astype(int)
+    if columns is not None and "record" not in columns:
+        df = df.drop(columns="record")
+    return df
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--raw", type=Path, default=RAW_JSONL)
+    parser.add_argument("--dataset", type=Path, default=DATASET)
+    parser.add_argument("--force", action="store_true", help="Re-ingest even if the dataset is current.")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if not args.force and args.dataset.exists() and is_current(args.dataset, args.raw):
+        print(f"{args.dataset} is current with {args.raw}")
+        return
+    counts = ingest(args.raw, args.dataset)
+    print(f"Ingested {counts['records']} records ({counts['no_gene']} without a gene) into {args.dataset}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,19 @@
 
 from __future__ import annotations
 
-import json
+import argparse
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 from scipy.stats import wilcoxon
 from sklearn.metrics import roc_auc_score
-from sklearn.model_selection import StratifiedKFold
+
+from cm_ingest import DATASET as CM_DATASET, dataset_key, load_clinmave_variants
+from eval_runner import add_worker_args, run_cells
+from fast_auc import best_candidate, group_candidate_aucs
+from permutation_test import add_permutation_args, permutation_test, swap_pairs
+from split_registry import add_repeat_args, corrected_ttest, repeated_fold_ids
 
 
 RAW_JSONL = Path("Results/Revision/ClinMAVE_api_cross_platform/clinmave_dms_cbge_gene_variants.jsonl")
@@ -21,45 +26,26 @@ OUTDIR = Path("Results/Revision/ClinMAVE_api_cross_platform/dataset_pair_modalit
 WEIGHTS = np.linspace(0.0, 1.0, 201)
 
 
-def platform(value: str) -> str | None:
-    if value == "Deep Mutational Scanning":
-        return "DMS"
-    if value == "CRISPR-Based Genome Editing":
-        return "CBGE"
-    return None
-
-
-def label(value: str) -> int | None:
-    if value == "Functionally normal":
-        return 0
-    if value == "Loss-of-function":
-        return 1
-    return None
-
-
-def load_records() -> pd.DataFrame:
-    rows = []
-    with RAW_JSONL.open() as handle:
-        for line in handle:
-            record = json.loads(line)
-            y = label(record.get("consequenceClass"))
-            assay = platform(record.get("maveTechnique"))
-            if y is None or assay is None:
-                continue
-            if record.get("molecularConsequence") != "Missense":
-                continue
-            rows.append(
-                {
-                    "Gene": record.get("geneName"),
-                    "Identifier": record.get("identifier"),
-                    "datasetId": record.get("datasetId"),
-                    "platform": assay,
-                    "label": y,
-                    "phenotype": record.get("phenotype"),
-                    "pmid": record.get("pmid"),
-                }
-            )
-    return pd.DataFrame(rows).drop_duplicates(["Gene", "Identifier", "datasetId", "platform", "label"])
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="CaLM weight shifts between matched DMS and CBGE datasets.")
+    parser.add_argument("--seed", type=int, default=16)
+    add_repeat_args(parser)
+    add_permutation_args(parser)
+    add_worker_args(parser)
+    return parser.parse_args()
+
+
+def load_records(genes: list[str] | None = None) -> pd.DataFrame:
+    records = load_clinmave_variants(
+        CM_DATASET,
+        raw=RAW_JSONL,
+        genes=genes,
+        platforms=["DMS", "CBGE"],
+        missense_only=True,
+        labelled_only=True,
+        columns=["Gene", "Identifier", "datasetId", "platform", "label", "phenotype", "pmid"],
+    )
+    return records.drop_duplicates(["Gene", "Identifier", "datasetId", "platform", "label"])
 
 
 def load_scores() -> pd.DataFrame:
@@ -85,12 +71,12 @@ def pair_table(records: pd.DataFrame, pair: pd.Series, scores: pd.DataFrame) ->
     dms = records[
         (records["Gene"] == gene)
         & (records["platform"] == "DMS")
-        & (records["datasetId"] == pair["DMS_dataset"])
+        & (records["datasetId"] == dataset_key(pair["DMS_dataset"]))
     ]
     cbge = records[
         (records["Gene"] == gene)
         & (records["platform"] == "CBGE")
-        & (records["datasetId"] == pair["CBGE_dataset"])
+        & (records["datasetId"] == dataset_key(pair["CBGE_dataset"]))
     ]
 
     def strict_labels(df: pd.DataFrame, col: str) -> pd.DataFrame:
@@ -107,74 +93,173 @@ def pair_table(records: pd.DataFrame, pair: pd.Series, scores: pd.DataFrame) ->
     return wide.merge(scores, on="Identifier", how="inner")
 
 
-def best_weight(train: pd.DataFrame, label_col: str) -> float:
-    y = train[label_col].to_numpy(int)
+def best_weight(y: np.ndarray, prot: np.ndarray, calm: np.ndarray) -> float:
     if len(np.unique(y)) < 2:
         return np.nan
-    prot = train["esm2_650m_llr"].to_numpy(float)
-    calm = train["calm_llr"].to_numpy(float)
-    best_w, best_auc = np.nan, -np.inf
-    for w in WEIGHTS:
-        combo = w * calm + (1.0 - w) * prot
-        auc = roc_auc_score(y, -combo)
-        if auc > best_auc:
-            best_w = float(w)
-            best_auc = auc
-    return best_w
-
-
-def evaluate_pair(table: pd.DataFrame, random_state: int = 16) -> pd.DataFrame:
+    best, _ = best_candidate(y, [-calm, -prot], np.column_stack([WEIGHTS, 1.0 - WEIGHTS]))
+    return float(WEIGHTS[best])
+
+
+def pair_folds(table: pd.DataFrame, random_state: int = 16, repeats: int = 1) -> np.ndarray | None:
+    """(repeats, n) fold ids stratified on the DMS/CBGE label combination; None if a pair cannot be split."""
     if table.empty:
-        return pd.DataFrame()
+        return None
     split_y = table["DMS_label"].astype(str) + "_" + table["CBGE_label"].astype(str)
     min_stratum = split_y.value_counts().min()
     if pd.isna(min_stratum):
-        return pd.DataFrame()
+        return None
     n_splits = min(10, int(min_stratum))
     if n_splits < 2:
-        return pd.DataFrame()
-    cv = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+        return None
+    return repeated_fold_ids(split_y.to_numpy(), None, n_splits, random_state, repeats)
+
+
+def weight_shifts(
+    arrays: dict[str, np.ndarray],
+    rng: np.random.Generator | None = None,
+    active: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Mean CBGE - DMS ``calm_weight`` over the paired repeat x folds of every pair.
+
+    Refits both platforms' weights on every training fold of every repeat
+    (rows of a 2-D ``fold_ids``), as in ``evaluate_pair_fold``, with the training
+    sets of all repeats, pairs, folds and platforms scored as groups of one
+    ``group_candidate_aucs`` call. With
+    ``rng``, the DMS and CBGE labels of each variant are first swapped with
+    probability 1/2 (no platform difference), keeping the folds. Pairs with
+    fewer than two paired folds, or not in ``active``, get NaN.
+    """
+    dms, cbge = arrays["DMS_label"], arrays["CBGE_label"]
+    if rng is not None:
+        dms, cbge = swap_pairs(dms, cbge, rng)
+    pair_codes, folds = arrays["pair_codes"], np.atleast_2d(arrays["fold_ids"]).astype(np.intp) - 1
+    n_repeats, n_pairs, n_folds = len(folds), int(pair_codes.max()) + 1, int(folds.max()) + 1
+    pair_n_folds = np.zeros(n_pairs, dtype=np.intp)
+    np.maximum.at(pair_n_folds, pair_codes, folds[0] + 1)
+
+    rows = np.arange(folds.shape[1]) if active is None else np.flatnonzero(active[pair_codes])
+    repeats = np.repeat(np.arange(n_repeats), len(rows) * n_folds)
+    rows = np.tile(np.repeat(rows, n_folds), n_repeats)
+    held_out = np.tile(np.arange(n_folds), len(rows) // n_folds)
+    keep = (held_out != folds[repeats, rows]) & (held_out < pair_n_folds[pair_codes[rows]])
+    rows, repeats, held_out = rows[keep], repeats[keep], held_out[keep]
+    cells = (repeats * n_pairs + pair_codes[rows]) * n_folds + held_out
+    aucs = group_candidate_aucs(
+        np.concatenate([dms[rows], cbge[rows]]),
+        np.tile(np.column_stack([-arrays["calm"][rows], -arrays["prot"][rows]]), (2, 1)),
+        np.column_stack([WEIGHTS, 1.0 - WEIGHTS]),
+        np.concatenate([2 * cells, 2 * cells + 1]),
+        n_groups=2 * n_repeats * n_pairs * n_folds,
+    )
+    fitted = ~np.isnan(aucs).all(axis=0)
+    weights = np.where(fitted, WEIGHTS[np.argmax(np.where(np.isnan(aucs), -np.inf, aucs), axis=0)], np.nan)
+    weights = weights.reshape(n_repeats, n_pairs, n_folds, 2)
+    diffs = (weights[..., 1] - weights[..., 0]).transpose(1, 0, 2).reshape(n_pairs, n_repeats * n_folds)
+    paired = np.isfinite(diffs).sum(axis=1)
+    with np.errstate(invalid="ignore"):
+        shifts = np.where(np.isfinite(diffs), diffs, 0.0).sum(axis=1) / paired
+    if active is not None:
+        paired[~active] = 0
+    return np.where(paired >= 2, shifts, np.nan)
+
+
+def pair_arrays(
+    tables: list[pd.DataFrame], random_state: int = 16, repeats: int = 1
+) -> tuple[dict[str, np.ndarray], list[int]]:
+    """
+    Rows of every pair that can be split, concatenated pair by pair.
+
+    Returns the arrays read by ``evaluate_pair_fold`` and ``weight_shifts``
+    (``pair_codes``, ``pair_offsets``, (repeats, n) ``fold_ids``, both label
+    columns and the two scores) and the indices of the pairs they hold.
+    """
+    kept, folds = [], []
+    for idx, table in enumerate(tables):
+        pair_fold_ids = pair_folds(table, random_state, repeats)
+        if pair_fold_ids is not None:
+            kept.append(idx)
+            folds.append(pair_fold_ids)
+    columns = ["DMS_label", "CBGE_label", "esm2_650m_llr", "calm_llr"]
+    rows = pd.concat([tables[idx][columns] for idx in kept] or [pd.DataFrame(columns=columns)], ignore_index=True)
+    sizes = [len(tables[idx]) for idx in kept]
+    arrays = {
+        "pair_codes": np.repeat(np.arange(len(kept)), sizes),
+        "pair_offsets": np.concatenate([[0], np.cumsum(sizes)]).astype(np.intp),
+        "fold_ids": np.hstack(folds) if folds else np.zeros((repeats, 0), dtype=np.intp),
+        "DMS_label": rows["DMS_label"].to_numpy(int),
+        "CBGE_label": rows["CBGE_label"].to_numpy(int),
+        "prot": rows["esm2_650m_llr"].to_numpy(float),
+        "calm": rows["calm_llr"].to_numpy(float),
+    }
+    return arrays, kept
+
+
+def evaluate_pair_fold(arrays: dict[str, np.ndarray], cell: tuple[int, int, int]) -> list[dict[str, object]]:
+    """Both platforms' weight fit and test AUROCs for one (pair, repeat, fold) of ``pair_arrays``."""
+    pair, repeat, fold = cell
+    start, stop = arrays["pair_offsets"][pair], arrays["pair_offsets"][pair + 1]
+    held_out = arrays["fold_ids"][repeat - 1, start:stop] == fold
+    train_idx = start + np.flatnonzero(~held_out)
+    test_idx = start + np.flatnonzero(held_out)
+    prot, calm = arrays["prot"][test_idx], arrays["calm"][test_idx]
     rows = []
-    for fold, (train_idx, test_idx) in enumerate(cv.split(table, split_y), start=1):
-        train = table.iloc[train_idx]
-        test = table.iloc[test_idx]
-        for platform, label_col in [("DMS", "DMS_label"), ("CBGE", "CBGE_label")]:
-            y_test = test[label_col].to_numpy(int)
-            w = best_weight(train, label_col)
-            evaluable = len(np.unique(y_test)) == 2 and np.isfinite(w)
-            if evaluable:
-                prot = test["esm2_650m_llr"].to_numpy(float)
-                calm = test["calm_llr"].to_numpy(float)
-                combo = w * calm + (1.0 - w) * prot
-                auroc_prot = roc_auc_score(y_test, -prot)
-                auroc_calm = roc_auc_score(y_test, -calm)
-                auroc_combo = roc_auc_score(y_test, -combo)
-            else:
-                auroc_prot = auroc_calm = auroc_combo = np.nan
-            rows.append(
-                {
-                    "fold": fold,
-                    "platform": platform,
-                    "calm_weight": w,
-                    "auroc_esm2_650m": auroc_prot,
-                    "auroc_calm": auroc_calm,
-                    "auroc_combo": auroc_combo,
-                    "n_test": len(test),
-                    "n_test_cases": int(y_test.sum()),
-                    "n_test_controls": int((1 - y_test).sum()),
-                }
-            )
-    return pd.DataFrame(rows)
+    for platform, label_col in [("DMS", "DMS_label"), ("CBGE", "CBGE_label")]:
+        y_test = arrays[label_col][test_idx]
+        w = best_weight(arrays[label_col][train_idx], arrays["prot"][train_idx], arrays["calm"][train_idx])
+        evaluable = len(np.unique(y_test)) == 2 and np.isfinite(w)
+        if evaluable:
+            combo = w * calm + (1.0 - w) * prot
+            auroc_prot = roc_auc_score(y_test, -prot)
+            auroc_calm = roc_auc_score(y_test, -calm)
+            auroc_combo = roc_auc_score(y_test, -combo)
+        else:
+            auroc_prot = auroc_calm = auroc_combo = np.nan
+        rows.append(
+            {
+                "repeat": repeat,
+                "fold": fold,
+                "platform": platform,
+                "calm_weight": w,
+                "auroc_esm2_650m": auroc_prot,
+                "auroc_calm": auroc_calm,
+                "auroc_combo": auroc_combo,
+                "n_test": len(test_idx),
+                "n_test_cases": int(y_test.sum()),
+                "n_test_controls": int((1 - y_test).sum()),
+            }
+        )
+    return rows
+
+
+def evaluate_pairs(arrays: dict[str, np.ndarray], workers: int = 1) -> list[pd.DataFrame]:
+    """Fold metrics of every pair in ``pair_arrays``, with the (pair, repeat, fold) cells on ``workers`` processes."""
+    n_pairs = len(arrays["pair_offsets"]) - 1
+    pair_n_folds = [
+        int(arrays["fold_ids"][0, arrays["pair_offsets"][pair] : arrays["pair_offsets"][pair + 1]].max())
+        for pair in range(n_pairs)
+    ]
+    cells = [
+        (pair, repeat, fold)
+        for pair in range(n_pairs)
+        for repeat in range(1, len(arrays["fold_ids"]) + 1)
+        for fold in range(1, pair_n_folds[pair] + 1)
+    ]
+    results = run_cells(evaluate_pair_fold, cells, arrays, workers) if cells else []
+    rows: list[list[dict[str, object]]] = [[] for _ in range(n_pairs)]
+    for (pair, _, _), cell_rows in zip(cells, results):
+        rows[pair].extend(cell_rows)
+    return [pd.DataFrame(pair_rows) for pair_rows in rows]
 
 
 def main() -> None:
+    args = parse_args()
     OUTDIR.mkdir(parents=True, exist_ok=True)
-    records = load_records()
     pairs = pd.read_csv(PAIRS)
+    records = load_records(pairs["Gene"].astype(str).unique().tolist())
     scores = load_scores()
 
     matched_rows = []
-    fold_rows = []
     for _, pair in pairs.iterrows():
         table = pair_table(records, pair, scores)
         pair_id = f"{pair['Gene']}|{pair['DMS_dataset']}|{pair['CBGE_dataset']}"
@@ -183,13 +268,12 @@ def main() -> None:
         table["DMS_dataset"] = pair["DMS_dataset"]
         table["CBGE_dataset"] = pair["CBGE_dataset"]
         matched_rows.append(table)
-        folds = evaluate_pair(table)
-        if folds.empty:
-            continue
-        folds["pair_id"] = pair_id
-        folds["Gene"] = pair["Gene"]
-        folds["DMS_dataset"] = pair["DMS_dataset"]
-        folds["CBGE_dataset"] = pair["CBGE_dataset"]
+
+    arrays, kept = pair_arrays(matched_rows, args.seed, args.repeats)
+    fold_rows = []
+    for idx, folds in zip(kept, evaluate_pairs(arrays, args.workers)):
+        for col in ["pair_id", "Gene", "DMS_dataset", "CBGE_dataset"]:
+            folds[col] = matched_rows[idx][col].iloc[0]
         fold_rows.append(folds)
 
     matched = pd.concat(matched_rows, ignore_index=True) if matched_rows else pd.DataFrame()
@@ -211,6 +295,7 @@ def main() -> None:
                     "n_controls": int((1 - mt[label_col]).sum()),
                     "label_concordance": float((mt["DMS_label"] == mt["CBGE_label"]).mean()),
                     "n_folds": sub["fold"].nunique(),
+                    "n_repeats": sub["repeat"].nunique(),
                     "mean_calm_weight": sub["calm_weight"].mean(),
                     "sd_calm_weight": sub["calm_weight"].std(ddof=1),
                     "mean_auroc_esm2_650m": sub["auroc_esm2_650m"].mean(),
@@ -222,14 +307,34 @@ def main() -> None:
     summary = pd.DataFrame(summary_rows)
     tests = []
     for pair_id, sub in folds.groupby("pair_id") if not folds.empty else []:
-        wide = sub.pivot(index="fold", columns="platform", values="calm_weight").dropna()
+        wide = sub.pivot(index=["repeat", "fold"], columns="platform", values="calm_weight").dropna()
         row = {"pair_id": pair_id, "paired_folds": len(wide)}
         if {"DMS", "CBGE"}.issubset(wide.columns) and len(wide) >= 2:
             diff = wide["CBGE"] - wide["DMS"]
             row["delta_CBGE_minus_DMS"] = float(diff.mean())
-            row["p_wilcoxon"] = 1.0 if np.allclose(diff, 0) else wilcoxon(wide["CBGE"], wide["DMS"]).pvalue
+            # Wilcoxon treats the folds as independent, so it uses the first repeat only.
+            first = wide[wide.index.get_level_values("repeat") == 1]
+            if len(first) < 2:
+                row["p_wilcoxon"] = np.nan
+            elif np.allclose(first["CBGE"], first["DMS"]):
+                row["p_wilcoxon"] = 1.0
+            else:
+                row["p_wilcoxon"] = wilcoxon(first["CBGE"], first["DMS"]).pvalue
+            row["p_corrected_t"] = corrected_ttest(diff, int(sub["fold"].max()))[1]
         tests.append(row)
     tests = pd.DataFrame(tests)
+    if kept and not tests.empty and args.max_permutations > 0:
+        perm_tests = permutation_test(
+            weight_shifts,
+            arrays,
+            alternative="two-sided",
+            exceedances=args.exceedances,
+            max_permutations=args.max_permutations,
+            seed=args.permutation_seed,
+            workers=args.workers,
+        )
+        perm_tests["pair_id"] = [matched_rows[idx]["pair_id"].iloc[0] for idx in kept]
+        tests = tests.merge(perm_tests[["pair_id", "p_permutation", "n_permutations"]], on="pair_id", how="left")
     if not summary.empty and not tests.empty:
         summary = summary.merge(tests, on="pair_id", how="left")
 
@@ -259,8 +364,9 @@ def main() -> None:
         "mean_calm_weight_CBGE",
         "delta_CBGE_minus_DMS",
         "p_wilcoxon",
+        "p_permutation",
     ]
-    print(compact[show_cols].to_string(index=False))
+    print(compact[[col for col in show_cols if col in compact.columns]].to_string(index=False))
     print(f"\nWrote outputs to {OUTDIR}")
 
 
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Per-gene CaLM codon-probability sources.
+
+Codon probabilities are returned as (L, 64) float64 arrays in
+``config.codon_list`` column order. Stored matrices (the npz AA store written
+by ``cv_aa_agg.py`` or the ``*_CaLM_grammaticality.csv`` files written by
+``score_calm_codon_logits.py``) are preferred; CaLM is imported and loaded
+only when a gene is missing from every store.
+
+Matrices saved to the npz store record the ``seq_hash``/``model_hash`` stamp
+they were computed under; when a stamp is requested, a stored matrix that
+lacks it or records a different one is treated as missing and recomputed.
+The grammaticality CSVs carry no stamp, so they are only used for unstamped
+requests or when ``trust_unstamped`` is set (``cv_aa_agg.py --stored-only``). The store keeps the float64
+matrix the model path returns, so a gene scores identically whether it was
+just computed or read back.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+
+from config import codon_list
+from seq_store import open_sequences
+from snv_engine import AA_PROJECTION, load_calm_probs
+
+
+STAMP_FIELDS = ("seq_hash", "model_hash")
+
+
+def save_aa_store(store_dir: Path, gene: str, codon_probs: np.ndarray, stamp: dict[str, object] | None = None) -> None:
+    store_dir.mkdir(parents=True, exist_ok=True)
+    stamp = stamp or {}
+    np.savez_compressed(
+        store_dir / f"{gene}.npz",
+        codon_probs=codon_probs.astype(np.float64),
+        aa_probs=codon_probs.astype(np.float64) @ AA_PROJECTION,
+        **{field: np.array(str(stamp[field])) for field in STAMP_FIELDS if stamp.get(field) is not None},
+    )
+
+
+def requested_stamp(stamp: dict[str, object] | None) -> dict[str, str]:
+    return {field: str(stamp[field]) for field in STAMP_FIELDS if stamp and stamp.get(field) is not None}
+
+
+def stamp_matches(data, stamp: dict[str, object] | None) -> bool:
+    """True if the npz records every requested hash with the requested value."""
+    return all(field in data.files and str(data[field]) == value for field, value in requested_stamp(stamp).items())
+
+
+class StoredCodonProbs:
+    def __init__(
+        self,
+        store_dir: Path | None = None,
+        grammaticality_dir: Path | None = None,
+        trust_unstamped: bool = False,
+    ):
+        self.store_dir = store_dir
+        self.grammaticality_dir = grammaticality_dir
+        self.trust_unstamped = trust_unstamped
+
+    def get(self, gene: str, stamp: dict[str, object] | None = None) -> np.ndarray | None:
+        if self.store_dir is not None:
+            path = self.store_dir / f"{gene}.npz"
+            if path.exists():
+                with np.load(path) as data:
+                    if stamp_matches(data, stamp):
+                        return data["codon_probs"].astype(np.float64)
+        if self.grammaticality_dir is not None and (self.trust_unstamped or not requested_stamp(stamp)):
+            path = self.grammaticality_dir / f"{gene}_CaLM_grammaticality.csv"
+            if path.exists():
+                return load_calm_probs(path)
+        return None
+
+
+class ModelCodonProbs:
+    """Run CaLM on the gene's CDS; the model is loaded on first use."""
+
+    def __init__(self, weights: Path, gene_dir: Path):
+        self.weights = weights
+        self.sequences = open_sequences(gene_dir)
+        self.calm = None
+
+    def load(self) -> None:
+        import torch
+        import torch.nn.functional as F
+        from calm import CaLM
+        from calm.sequence import CodonSequence
+
+        class CaLMProb(CaLM):
+            def codon_probabilities(self, sequence: str) -> np.ndarray:
+                tokens = self.tokenize(CodonSequence(sequence))
+                with torch.no_grad():
+                    logits = self.model(tokens)["logits"]
+                    probs = F.softmax(logits, dim=-1)
+                return probs.detach().cpu().numpy()[0, 1:-1, :]
+
+        self.calm = CaLMProb(weights_file=str(self.weights))
+        self.calm.model.eval()
+
+    def get(self, gene: str) -> np.ndarray:
+        if self.calm is None:
+            self.load()
+        probs = self.calm.codon_probabilities(self.sequences.get(gene).replace("T", "U"))
+        tok_to_idx = self.calm.alphabet.tok_to_idx
+        return probs[:, [tok_to_idx[codon] for codon in codon_list]].astype(np.float64)
+
+
+class CodonProbSource:
+    """Stored matrix if present, otherwise the model; model outputs are written back to the store."""
+
+    def __init__(self, stored: StoredCodonProbs, model: ModelCodonProbs | None = None):
+        self.stored = stored
+        self.model = model
+        self.counts = {"stored": 0, "model": 0}
+
+    def get(self, gene: str, stamp: dict[str, object] | None = None) -> np.ndarray:
+        probs = self.stored.get(gene, stamp)
+        if probs is not None:
+            self.counts["stored"] += 1
+            return probs
+        if self.model is None:
+            raise FileNotFoundError(f"No stored CaLM probabilities for {gene}")
+        probs = self.model.get(gene)
+        if self.stored.store_dir is not None:
+            save_aa_store(self.stored.store_dir, gene, probs, stamp)
+        self.counts["model"] += 1
+        return probs
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Mutational-context covariates from a precomputed codon-pair table.
+
+There are only 64 x 9 single-nucleotide codon pairs, so every context
+feature (transition flag, codon GC, CpG, local degeneracy, mutated codon
+position) is computed once into a dense table indexed by integer codon codes
+(``config.codon_list`` order). Variant tables get their features with a
+single vectorized take instead of a per-variant Python call.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from config import codon_list, codon_to_amino_acid
+from snv_engine import BASES, CODON_INDEX, NEIGHBOURS, NEIGHBOUR_BASE, NEIGHBOUR_POSITION
+
+
+TABLE_COLUMNS = [
+    "valid_snv_codon",
+    "ref_is_stop",
+    "mutated_codon_position",
+    "ref_base_idx",
+    "mut_base_idx",
+    "is_transition",
+    "ref_codon_gc",
+    "mut_codon_gc",
+    "ref_cpg",
+    "mut_cpg",
+    "local_degeneracy",
+]
+TRANSITIONS = {("A", "G"), ("G", "A"), ("C", "U"), ("U", "C")}
+DNA_BASES = np.array([base.replace("U", "T") for base in BASES] + ["NA"], dtype=object)
+INVALID_PAIR = 64 * 64
+
+
+def build_feature_table() -> np.ndarray:
+    """
+    Tabulate context features for every (ref, mut) codon pair.
+
+    Returns:
+        (64 * 64 + 1, len(TABLE_COLUMNS)) float array indexed by ``64 * ref + mut``.
+        Pairs that are not single-nucleotide neighbours, and the trailing
+        sentinel row ``INVALID_PAIR``, have ``valid_snv_codon == 0`` and NaN features.
+    """
+    table = np.full((INVALID_PAIR + 1, len(TABLE_COLUMNS)), np.nan)
+    table[:, 0] = 0.0
+    table[:, 3:5] = len(BASES)
+    for ref_idx, ref in enumerate(codon_list):
+        ref_aa = codon_to_amino_acid[ref]
+        for col in range(9):
+            mut_idx = int(NEIGHBOURS[ref_idx, col])
+            pos = int(NEIGHBOUR_POSITION[ref_idx, col])
+            mut = codon_list[mut_idx]
+            syn_count = sum(
+                codon_to_amino_acid[ref[:pos] + base + ref[pos + 1 :]] == ref_aa for base in BASES
+            )
+            table[64 * ref_idx + mut_idx] = [
+                1.0,
+                float(ref_aa == "*"),
+                float(pos + 1),
+                float(BASES.index(ref[pos])),
+                float(NEIGHBOUR_BASE[ref_idx, col]),
+                float((ref[pos], mut[pos]) in TRANSITIONS),
+                sum(base in {"G", "C"} for base in ref) / 3,
+                sum(base in {"G", "C"} for base in mut) / 3,
+                float("CG" in ref),
+                float("CG" in mut),
+                float(syn_count),
+            ]
+    return table
+
+
+FEATURE_TABLE = build_feature_table()
+
+
+def codon_codes(values: pd.Series) -> np.ndarray:
+    """Integer codon codes for DNA or RNA codon strings; anything else maps to -1."""
+    return (
+        values.astype(str).str.upper().str.replace("T", "U").map(CODON_INDEX).fillna(-1).to_numpy(dtype=np.intp)
+    )
+
+
+def pair_codes(ref: pd.Series, mut: pd.Series) -> np.ndarray:
+    ref_code = codon_codes(ref)
+    mut_code = codon_codes(mut)
+    return np.where((ref_code >= 0) & (mut_code >= 0), 64 * ref_code + mut_code, INVALID_PAIR)
+
+
+def context_features(ref: pd.Series, mut: pd.Series) -> pd.DataFrame:
+    """Look up the context features of each (ref, mut) codon pair with one take."""
+    values = FEATURE_TABLE.take(pair_codes(ref, mut), axis=0)
+    out = pd.DataFrame(values, columns=TABLE_COLUMNS, index=ref.index)
+    out["is_transversion"] = 1 - out["is_transition"]
+    out["delta_codon_gc"] = out["mut_codon_gc"] - out["ref_codon_gc"]
+    out["delta_cpg"] = out["mut_cpg"] - out["ref_cpg"]
+    out["ref_base"] = DNA_BASES[out["ref_base_idx"].to_numpy(dtype=int)]
+    out["mut_base"] = DNA_BASES[out["mut_base_idx"].to_numpy(dtype=int)]
+    return out.drop(columns=["ref_base_idx", "mut_base_idx"])
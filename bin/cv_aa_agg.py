@@ -8,22 +8,33 @@ can split an amino-acid probability mass across synonymous codons.
 from __future__ import annotations
 
 import argparse
-import csv
+import warnings
 from collections import Counter
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-import torch
-import torch.nn.functional as F
 import matplotlib.pyplot as plt
 import statsmodels.api as sm
-from calm import CaLM
-from calm.sequence import CodonSequence
 from scipy.stats import fisher_exact
 from sklearn.metrics import roc_auc_score
 from statsmodels.stats.multitest import multipletests
 
+from codon_probs import CodonProbSource, ModelCodonProbs, StoredCodonProbs
+from score_table import load_score_table
+from seq_store import open_sequences
+from shards import (
+    add_shard_args,
+    claim_shard,
+    content_hash,
+    describe_plan,
+    file_hash,
+    frame_hash,
+    open_store,
+    plan_rescoring,
+)
+from snv_engine import AA_ORDER, AA_PROJECTION, CODON_INDEX, EPS
+
 
 DEFAULT_INPUT = Path(
     "Results/Revision/len1022_aa_aggregation/"
@@ -61,126 +72,115 @@ CODON_TO_AA = {codon: aa for aa, codons in AA_TO_CODONS.items() for codon in cod
 AA_DEGENERACY = {aa: len(codons) for aa, codons in AA_TO_CODONS.items()}
 PATHOGENIC_LABELS = {"pathogenic", "likely_pathogenic"}
 BENIGN_LABELS = {"benign", "likely_benign"}
+AA_INDEX = {aa: idx for idx, aa in enumerate(AA_ORDER)}
+DEGENERACY = AA_PROJECTION.sum(axis=0)
 
 
-class CaLMProb(CaLM):
-    def codon_probabilities(self, sequence: str) -> np.ndarray:
-        seq = CodonSequence(sequence)
-        tokens = self.tokenize(seq)
-        with torch.no_grad():
-            logits = self.model(tokens)["logits"]
-            probs = F.softmax(logits, dim=-1)
-        return probs.detach().cpu().numpy()[0, 1:-1, :]
+def standardize_codon(codon: str) -> str:
+    return str(codon).upper().replace("T", "U")
 
 
-def read_fasta(path: Path) -> str:
-    seq_parts: list[str] = []
-    with path.open() as handle:
-        for line in handle:
-            line = line.strip()
-            if not line or line.startswith(">"):
-                continue
-            seq_parts.append(line.upper().replace("T", "U"))
-    return "".join(seq_parts)
+def codon_index(values: pd.Series) -> np.ndarray:
+    return values.map(standardize_codon).map(CODON_INDEX).fillna(-1).to_numpy(dtype=int)
 
 
-def standardize_codon(codon: str) -> str:
-    return str(codon).upper().replace("T", "U")
+def aa_index(values: pd.Series) -> np.ndarray:
+    return values.astype(str).map(AA_INDEX).fillna(-1).to_numpy(dtype=int)
 
 
-def score_gene(calm: CaLMProb, gene: str, group: pd.DataFrame, gene_dir: Path) -> list[dict[str, object]]:
-    sequence = read_fasta(gene_dir / f"{gene}.fasta")
-    probs = calm.codon_probabilities(sequence)
-    tok_to_idx = calm.alphabet.tok_to_idx
-    aa_indices = {
-        aa: [tok_to_idx[codon] for codon in codons]
-        for aa, codons in AA_TO_CODONS.items()
-    }
-    aa_probs = {
-        aa: probs[:, idxs].sum(axis=1)
-        for aa, idxs in aa_indices.items()
-    }
+def aggregate_variants(group: pd.DataFrame, codon_probs: np.ndarray) -> pd.DataFrame:
+    """Codon, AA-aggregated and degeneracy terms for all variants of one gene as column arrays."""
+    site = group["Site_gene"].to_numpy(dtype=int) - 1
+    ref_codon = codon_index(group["Ref_gene"])
+    mut_codon = codon_index(group["Mut_gene"])
+    ref_aa = aa_index(group["Ref_prot"])
+    mut_aa = aa_index(group["Mut_prot"])
+    valid = (
+        (site >= 0)
+        & (site < codon_probs.shape[0])
+        & (ref_codon >= 0)
+        & (mut_codon >= 0)
+        & (ref_aa >= 0)
+        & (mut_aa >= 0)
+    )
+    site, ref_codon, mut_codon = site[valid], ref_codon[valid], mut_codon[valid]
+    ref_aa, mut_aa = ref_aa[valid], mut_aa[valid]
+
+    log_codon = np.log(np.maximum(codon_probs, EPS))
+    log_aa = np.log(np.maximum(codon_probs @ AA_PROJECTION, EPS))
+    codon_llr = log_codon[site, mut_codon] - log_codon[site, ref_codon]
+    aa_agg_llr = log_aa[site, mut_aa] - log_aa[site, ref_aa]
+
+    out = group.loc[valid].copy()
+    out["calm_codon_llr_recomputed"] = codon_llr
+    out["calm_aa_agg_llr"] = aa_agg_llr
+    out["calm_codon_minus_aa_agg_llr"] = codon_llr - aa_agg_llr
+    out["ref_aa_degeneracy"] = DEGENERACY[ref_aa]
+    out["mut_aa_degeneracy"] = DEGENERACY[mut_aa]
+    out["log_ref_over_mut_degeneracy"] = np.log(DEGENERACY[ref_aa] / DEGENERACY[mut_aa])
+    return out
 
-    rows: list[dict[str, object]] = []
-    eps = np.finfo(np.float64).tiny
-    for _, row in group.iterrows():
-        site = int(row["Site_gene"]) - 1
-        ref_codon = standardize_codon(row["Ref_gene"])
-        mut_codon = standardize_codon(row["Mut_gene"])
-        ref_aa = str(row["Ref_prot"])
-        mut_aa = str(row["Mut_prot"])
-
-        if site < 0 or site >= probs.shape[0]:
-            continue
-        if ref_codon not in tok_to_idx or mut_codon not in tok_to_idx:
-            continue
-        if ref_aa not in AA_TO_CODONS or mut_aa not in AA_TO_CODONS:
-            continue
-
-        codon_llr = np.log(max(float(probs[site, tok_to_idx[mut_codon]]), eps)) - np.log(
-            max(float(probs[site, tok_to_idx[ref_codon]]), eps)
-        )
-        aa_agg_llr = np.log(max(float(aa_probs[mut_aa][site]), eps)) - np.log(
-            max(float(aa_probs[ref_aa][site]), eps)
-        )
 
-        out = row.to_dict()
-        out.update(
-            {
-                "calm_codon_llr_recomputed": codon_llr,
-                "calm_aa_agg_llr": aa_agg_llr,
-                "calm_codon_minus_aa_agg_llr": codon_llr - aa_agg_llr,
-                "ref_aa_degeneracy": AA_DEGENERACY[ref_aa],
-                "mut_aa_degeneracy": AA_DEGENERACY[mut_aa],
-                "log_ref_over_mut_degeneracy": np.log(AA_DEGENERACY[ref_aa] / AA_DEGENERACY[mut_aa]),
-            }
-        )
-        rows.append(out)
-    return rows
+def gene_stamps(grouped: dict[str, pd.DataFrame], gene_dir: Path, model_hash: str | None) -> dict[str, dict[str, object]]:
+    """CDS, CaLM checkpoint and input-row hashes for each gene."""
+    sequences = open_sequences(gene_dir)
+    return {
+        gene: {
+            "seq_hash": content_hash(sequences.get(gene)) if gene in sequences else None,
+            "model_hash": model_hash,
+            "input_hash": frame_hash(group),
+        }
+        for gene, group in grouped.items()
+    }
 
 
-def append_rows(path: Path, rows: list[dict[str, object]]) -> None:
-    if not rows:
-        return
-    write_header = not path.exists() or path.stat().st_size == 0
-    with path.open("a", newline="") as handle:
-        writer = csv.DictWriter(handle, fieldnames=list(rows[0].keys()))
-        if write_header:
-            writer.writeheader()
-        writer.writerows(rows)
-
-
-def compute_scores(args: argparse.Namespace, output: Path) -> pd.DataFrame:
-    df = pd.read_csv(args.input)
-    if output.exists() and not args.force:
-        existing = pd.read_csv(output)
-        done = set(existing["Gene_gene"].dropna().unique())
-    else:
-        if output.exists():
-            output.unlink()
-        existing = None
-        done = set()
+def compute_scores(args: argparse.Namespace, output: Path) -> pd.DataFrame | None:
+    """Score the remaining genes; returns the compacted table, or None for a ``--shard`` slice."""
+    df = load_score_table(args.input)
+    store = open_store(output, "Gene_gene", args.shard_dir, force=args.force, shard=args.shard)
 
     grouped = {gene: group for gene, group in df.groupby("Gene_gene", sort=True)}
-    remaining = [gene for gene in grouped if gene not in done]
+    model_hash = file_hash(args.weights) if args.weights.exists() else None
+    if model_hash is None:
+        warnings.warn(
+            f"CaLM weights {args.weights} not found; stored probabilities and shards cannot be "
+            "checked against the checkpoint",
+            RuntimeWarning,
+        )
+    costs = {gene: float(group["Site_gene"].max()) for gene, group in grouped.items()}
+    slice_genes = claim_shard(store, list(grouped), args.shard, args.shard_strategy, costs, model_hash)
+    grouped = {gene: grouped[gene] for gene in slice_genes}
+    stamps = gene_stamps(grouped, args.gene_dir, model_hash)
+    plan = plan_rescoring(store, stamps)
+    print(f"Shards in {store.root}: {describe_plan(plan)}")
+    remaining = sorted(plan["rescored"] + plan["new"])
     if args.sort_by_length:
         remaining = sorted(remaining, key=lambda gene: int(grouped[gene]["Site_gene"].max()))
     if args.max_remaining_genes is not None:
         remaining = remaining[: args.max_remaining_genes]
     if remaining:
-        calm = CaLMProb(weights_file=str(args.weights))
-        calm.model.eval()
+        source = CodonProbSource(
+            StoredCodonProbs(args.aa_store, args.probs_dir, trust_unstamped=args.stored_only),
+            None if args.stored_only else ModelCodonProbs(args.weights, args.gene_dir),
+        )
         for idx, gene in enumerate(remaining, start=1):
             group = grouped[gene]
             try:
-                rows = score_gene(calm, gene, group, args.gene_dir)
-                append_rows(output, rows)
+                rows = aggregate_variants(group, source.get(gene, stamps[gene]))
+                store.write(gene, rows, **stamps[gene])
             except Exception as exc:
+                store.remove(gene)
                 print(f"FAILED {gene}: {exc}")
                 continue
             if idx % args.report_every == 0 or idx == len(remaining):
-                print(f"Scored {idx}/{len(remaining)} remaining genes; latest={gene}")
-
+                print(
+                    f"Scored {idx}/{len(remaining)} remaining genes; latest={gene}; "
+                    f"stored={source.counts['stored']}, model={source.counts['model']}"
+                )
+
+    if args.shard is not None:
+        return None
+    store.compact(output)
     return pd.read_csv(output)
 
 
@@ -478,6 +478,35 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--gene-dir", type=Path, default=DEFAULT_GENE_DIR)
     parser.add_argument("--out-dir", type=Path, default=DEFAULT_OUT_DIR)
     parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument(
+        "--shard-dir",
+        type=Path,
+        default=None,
+        help="Per-gene score shards (default: <output stem>_shards next to --output).",
+    )
+    parser.add_argument(
+        "--aa-store",
+        type=Path,
+        default=None,
+        help="Directory of per-gene codon/AA probability matrices (default: <out-dir>/calm_aa_store).",
+    )
+    parser.add_argument(
+        "--probs-dir",
+        type=Path,
+        default=Path("Results/Gene"),
+        help=(
+            "Directory of *_CaLM_grammaticality.csv files from score_calm_codon_logits.py. They carry no "
+            "checkpoint/sequence stamp, so they are only read with --stored-only."
+        ),
+    )
+    parser.add_argument(
+        "--stored-only",
+        action="store_true",
+        help=(
+            "Never load CaLM; genes without stored probabilities are reported as failed. Unstamped "
+            "--probs-dir matrices are trusted as current."
+        ),
+    )
     parser.add_argument("--fig-prefix", default="calm_aa_aggregation")
     parser.add_argument("--sort-by-length", action="store_true")
     parser.add_argument("--force", action="store_true")
@@ -491,8 +520,9 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--score-only",
         action="store_true",
-        help="Only append variant scores; skip summaries and figures.",
+        help="Only write variant scores; skip summaries and figures.",
     )
+    add_shard_args(parser)
     return parser.parse_args()
 
 
@@ -501,7 +531,13 @@ def main() -> None:
     args.out_dir.mkdir(parents=True, exist_ok=True)
     if args.output is None:
         args.output = args.out_dir / "len1022_calm_aa_aggregation_variant_scores.csv"
+    if args.aa_store is None:
+        args.aa_store = args.out_dir / "calm_aa_store"
     scored = compute_scores(args, args.output)
+    if scored is None:
+        print(f"Scored slice {args.shard[0]}/{args.shard[1]}")
+        print(f"Combine all slices with: python bin/shards.py merge {args.output} <slice shard dirs>")
+        return
     if args.score_only:
         print(
             f"Score-only mode complete: {len(scored)} variants across "
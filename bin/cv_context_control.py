@@ -1,5 +1,18 @@
 #!/usr/bin/env python3
-"""Fixed ESM-2 650M baseline with mutational-context and CaLM increments."""
+"""Fixed ESM-2 650M baseline with mutational-context and CaLM increments.
+
+The (fold, model) cells run on ``--workers`` processes (``eval_runner.py``).
+Model inputs are shared as one array per column, with categorical features
+as sorted integer codes, which one-hot encode to the same design matrix as
+the strings. Paired tests add gene-clustered DeLong tests on the pooled
+held-out predictions (``delong.py``).
+
+``--repeats R`` evaluates R independently seeded gene-grouped splits, as in
+``cv_model_control.py``: a ``repeat`` column in the fold results, repeat
+spread and corrected standard errors in the summary, the corrected repeated
+k-fold t-test in the paired tests, and paired t, Wilcoxon and DeLong tests
+on the first repeat.
+"""
 
 from __future__ import annotations
 
@@ -12,80 +25,17 @@ from scipy.stats import ttest_rel, wilcoxon
 from sklearn.compose import ColumnTransformer
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import roc_auc_score
-from sklearn.model_selection import StratifiedGroupKFold
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 
+from context_features import context_features
+from delong import delong_tests
+from eval_runner import add_worker_args, run_cells
+from score_table import load_score_table
+from split_registry import add_registry_args, add_repeat_args, corrected_ttest, corrected_variance, repeated_fold_ids
+
 
 PATHOGENIC_LABELS = {"pathogenic", "likely_pathogenic"}
-BASES = ("A", "C", "G", "T")
-TRANSITIONS = {("A", "G"), ("G", "A"), ("C", "T"), ("T", "C")}
-CODON_TABLE = {
-    "TTT": "F",
-    "TTC": "F",
-    "TTA": "L",
-    "TTG": "L",
-    "TCT": "S",
-    "TCC": "S",
-    "TCA": "S",
-    "TCG": "S",
-    "TAT": "Y",
-    "TAC": "Y",
-    "TAA": "*",
-    "TAG": "*",
-    "TGT": "C",
-    "TGC": "C",
-    "TGA": "*",
-    "TGG": "W",
-    "CTT": "L",
-    "CTC": "L",
-    "CTA": "L",
-    "CTG": "L",
-    "CCT": "P",
-    "CCC": "P",
-    "CCA": "P",
-    "CCG": "P",
-    "CAT": "H",
-    "CAC": "H",
-    "CAA": "Q",
-    "CAG": "Q",
-    "CGT": "R",
-    "CGC": "R",
-    "CGA": "R",
-    "CGG": "R",
-    "ATT": "I",
-    "ATC": "I",
-    "ATA": "I",
-    "ATG": "M",
-    "ACT": "T",
-    "ACC": "T",
-    "ACA": "T",
-    "ACG": "T",
-    "AAT": "N",
-    "AAC": "N",
-    "AAA": "K",
-    "AAG": "K",
-    "AGT": "S",
-    "AGC": "S",
-    "AGA": "R",
-    "AGG": "R",
-    "GTT": "V",
-    "GTC": "V",
-    "GTA": "V",
-    "GTG": "V",
-    "GCT": "A",
-    "GCC": "A",
-    "GCA": "A",
-    "GCG": "A",
-    "GAT": "D",
-    "GAC": "D",
-    "GAA": "E",
-    "GAG": "E",
-    "GGT": "G",
-    "GGC": "G",
-    "GGA": "G",
-    "GGG": "G",
-}
 
 
 def parse_args() -> argparse.Namespace:
@@ -94,84 +44,48 @@ def parse_args() -> argparse.Namespace:
         "--scores",
         default=(
             "Results/Revision/len1022_model_control/"
-            "len1022_model_control_score_table_all_variants.csv"
+            "len1022_model_control_score_table_all_variants.parquet"
         ),
     )
     parser.add_argument("--out-dir", default="Results/Revision/fig3_fixed_esm2_context_calm")
     parser.add_argument("--n-splits", type=int, default=10)
     parser.add_argument("--seed", type=int, default=16)
+    add_repeat_args(parser)
+    add_worker_args(parser)
+    add_registry_args(parser)
     return parser.parse_args()
 
 
-def mutation_features(ref: str, mut: str) -> dict[str, object]:
-    ref = str(ref).upper().replace("U", "T")
-    mut = str(mut).upper().replace("U", "T")
-    out: dict[str, object] = {
-        "valid_snv_codon": 0,
-        "ref_codon": ref,
-        "mut_codon": mut,
-        "ref_base": "NA",
-        "mut_base": "NA",
-        "substitution": "NA",
-        "mutated_codon_position": "NA",
-        "is_transition": np.nan,
-        "is_transversion": np.nan,
-        "ref_codon_gc": np.nan,
-        "mut_codon_gc": np.nan,
-        "delta_codon_gc": np.nan,
-        "ref_cpg": np.nan,
-        "mut_cpg": np.nan,
-        "delta_cpg": np.nan,
-        "local_degeneracy": "NA",
-    }
-    if len(ref) != 3 or len(mut) != 3 or any(base not in BASES for base in ref + mut):
-        return out
-    diffs = [idx for idx, (a, b) in enumerate(zip(ref, mut)) if a != b]
-    if len(diffs) != 1:
-        return out
-
-    pos = diffs[0]
-    ref_aa = CODON_TABLE.get(ref)
-    syn_count = 0
-    if ref_aa is not None:
-        for base in BASES:
-            candidate = ref[:pos] + base + ref[pos + 1 :]
-            if CODON_TABLE.get(candidate) == ref_aa:
-                syn_count += 1
-    ref_gc = sum(base in {"G", "C"} for base in ref) / 3
-    mut_gc = sum(base in {"G", "C"} for base in mut) / 3
-    is_transition = int((ref[pos], mut[pos]) in TRANSITIONS)
-    ref_cpg = int("CG" in ref)
-    mut_cpg = int("CG" in mut)
-    out.update(
-        {
-            "valid_snv_codon": 1,
-            "ref_base": ref[pos],
-            "mut_base": mut[pos],
-            "substitution": f"{ref[pos]}>{mut[pos]}",
-            "mutated_codon_position": str(pos + 1),
-            "is_transition": is_transition,
-            "is_transversion": 1 - is_transition,
-            "ref_codon_gc": ref_gc,
-            "mut_codon_gc": mut_gc,
-            "delta_codon_gc": mut_gc - ref_gc,
-            "ref_cpg": ref_cpg,
-            "mut_cpg": mut_cpg,
-            "delta_cpg": mut_cpg - ref_cpg,
-            "local_degeneracy": str(syn_count),
-        }
-    )
-    return out
-
-
 def add_context_features(df: pd.DataFrame) -> pd.DataFrame:
-    features = pd.DataFrame(
-        [mutation_features(ref, mut) for ref, mut in zip(df["Ref_gene"], df["Mut_gene"])],
-        index=df.index,
-    )
+    table = context_features(df["Ref_gene"], df["Mut_gene"])
+    valid = table["valid_snv_codon"] == 1
+    features = pd.DataFrame(index=df.index)
+    features["valid_snv_codon"] = table["valid_snv_codon"].astype(int)
+    features["ref_codon"] = df["Ref_gene"].map(str).str.upper().str.replace("U", "T")
+    features["mut_codon"] = df["Mut_gene"].map(str).str.upper().str.replace("U", "T")
+    features["ref_base"] = table["ref_base"]
+    features["mut_base"] = table["mut_base"]
+    features["substitution"] = (table["ref_base"] + ">" + table["mut_base"]).where(valid, "NA")
+    features["mutated_codon_position"] = as_category_label(table["mutated_codon_position"])
+    for col in [
+        "is_transition",
+        "is_transversion",
+        "ref_codon_gc",
+        "mut_codon_gc",
+        "delta_codon_gc",
+        "ref_cpg",
+        "mut_cpg",
+        "delta_cpg",
+    ]:
+        features[col] = table[col]
+    features["local_degeneracy"] = as_category_label(table["local_degeneracy"])
     return pd.concat([df, features], axis=1)
 
 
+def as_category_label(values: pd.Series) -> pd.Series:
+    return values.map(lambda value: "NA" if np.isnan(value) else str(int(value)))
+
+
 def make_pipeline(numeric_cols: list[str], categorical_cols: list[str]) -> Pipeline:
     preprocessor = ColumnTransformer(
         transformers=[
@@ -195,7 +109,37 @@ def make_pipeline(numeric_cols: list[str], categorical_cols: list[str]) -> Pipel
     )
 
 
-def paired_tests(fold_df: pd.DataFrame) -> pd.DataFrame:
+def evaluate_cell(arrays: dict[str, np.ndarray], cell: tuple) -> tuple[dict[str, object], np.ndarray]:
+    repeat, fold, model_name, numeric_cols, categorical_cols = cell
+    held_out = arrays["fold_ids"][repeat - 1] == fold
+    train_idx = np.flatnonzero(~held_out)
+    test_idx = np.flatnonzero(held_out)
+    train = pd.DataFrame({col: arrays[col][train_idx] for col in numeric_cols + categorical_cols})
+    test = pd.DataFrame({col: arrays[col][test_idx] for col in numeric_cols + categorical_cols})
+    y_train = arrays["y"][train_idx]
+    y_test = arrays["y"][test_idx]
+    pipeline = make_pipeline(numeric_cols, categorical_cols)
+    pipeline.fit(train, y_train)
+    pred = pipeline.predict_proba(test)[:, 1]
+    row = {
+        "repeat": repeat,
+        "fold": fold,
+        "model": model_name,
+        "test_auc": roc_auc_score(y_test, pred),
+        "n_test": len(test_idx),
+        "n_test_genes": len(np.unique(arrays["gene_codes"][test_idx])),
+        "n_test_pathogenic": int(y_test.sum()),
+    }
+    return row, pred
+
+
+def paired_tests(fold_df: pd.DataFrame, oof: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    Paired tests over the pooled repeat x fold deltas, with the corrected repeated k-fold t-test.
+
+    The uncorrected paired t and Wilcoxon tests use the first repeat's folds. With ``oof``,
+    also gene-clustered DeLong tests on the first repeat's pooled predictions.
+    """
     comparisons = [
         ("ESM-2 650M + mutational context", "ESM-2 650M"),
         ("ESM-2 650M + CaLM", "ESM-2 650M"),
@@ -212,12 +156,14 @@ def paired_tests(fold_df: pd.DataFrame) -> pd.DataFrame:
             "ESM-2 650M",
         ),
     ]
-    wide = fold_df.pivot(index="fold", columns="model", values="test_auc")
+    n_splits = int(fold_df["fold"].max())
+    wide = fold_df.pivot(index=["repeat", "fold"], columns="model", values="test_auc")
     rows = []
+    first = wide.xs(1, level="repeat")
     for a, b in comparisons:
         delta = wide[a] - wide[b]
         try:
-            wilcoxon_p = float(wilcoxon(delta).pvalue)
+            wilcoxon_p = float(wilcoxon(first[a] - first[b]).pvalue)
         except ValueError:
             wilcoxon_p = np.nan
         rows.append(
@@ -226,12 +172,19 @@ def paired_tests(fold_df: pd.DataFrame) -> pd.DataFrame:
                 "b": b,
                 "mean_delta": float(delta.mean()),
                 "sd_delta": float(delta.std(ddof=1)),
-                "paired_t_p": float(ttest_rel(wide[a], wide[b]).pvalue),
+                "paired_t_p": float(ttest_rel(first[a], first[b]).pvalue),
                 "wilcoxon_p": wilcoxon_p,
+                "corrected_t_p": corrected_ttest(delta, n_splits)[1],
                 "fold_deltas": ";".join(f"{value:.5f}" for value in delta),
             }
         )
-    return pd.DataFrame(rows)
+    tests = pd.DataFrame(rows)
+    if oof is None:
+        return tests
+    first = oof[oof["repeat"] == 1]
+    delong = delong_tests(first["label"].to_numpy(), first, comparisons, clusters=first["Gene_prot"])
+    tests = tests.merge(delong, on=["a", "b"], how="left")
+    return tests[[col for col in tests.columns if col != "fold_deltas"] + ["fold_deltas"]]
 
 
 def main() -> None:
@@ -239,7 +192,7 @@ def main() -> None:
     out_dir = Path(args.out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    df = pd.read_csv(args.scores)
+    df = load_score_table(args.scores)
     if "label" not in df.columns:
         df["label"] = df["Label_prot"].astype(str).isin(PATHOGENIC_LABELS).astype(int)
     df = add_context_features(df)
@@ -282,32 +235,44 @@ def main() -> None:
 
     y = complete["label"].to_numpy(dtype=int)
     groups = complete["Gene_prot"].astype(str).to_numpy()
-    splits = list(
-        StratifiedGroupKFold(n_splits=args.n_splits, shuffle=True, random_state=args.seed).split(
-            complete, y, groups
-        )
+    folds = repeated_fold_ids(
+        y,
+        groups,
+        args.n_splits,
+        args.seed,
+        args.repeats,
+        group_col="Gene_prot",
+        registry=args.split_registry,
     )
 
-    rows = []
-    for fold, (train_idx, test_idx) in enumerate(splits, start=1):
-        train = complete.iloc[train_idx]
-        test = complete.iloc[test_idx]
-        y_train = y[train_idx]
-        y_test = y[test_idx]
-        for model_name, numeric_cols, categorical_cols in model_specs:
-            pipeline = make_pipeline(numeric_cols, categorical_cols)
-            pipeline.fit(train[numeric_cols + categorical_cols], y_train)
-            pred = pipeline.predict_proba(test[numeric_cols + categorical_cols])[:, 1]
-            rows.append(
-                {
-                    "fold": fold,
-                    "model": model_name,
-                    "test_auc": roc_auc_score(y_test, pred),
-                    "n_test": len(test),
-                    "n_test_genes": test["Gene_prot"].nunique(),
-                    "n_test_pathogenic": int(y_test.sum()),
-                }
-            )
+    cells = [
+        (repeat, fold, model_name, numeric_cols, categorical_cols)
+        for repeat in range(1, args.repeats + 1)
+        for fold in range(1, args.n_splits + 1)
+        for model_name, numeric_cols, categorical_cols in model_specs
+    ]
+    arrays = {col: complete[col].to_numpy(dtype=float) for col in ["esm2_650m_score", "calm_score", *numeric_context]}
+    arrays.update({col: pd.factorize(complete[col], sort=True)[0] for col in categorical_context})
+    arrays.update(
+        {
+            "y": y,
+            "fold_ids": folds,
+            "gene_codes": pd.factorize(groups)[0],
+        }
+    )
+    results = run_cells(evaluate_cell, cells, arrays, args.workers)
+    rows = [row for row, _ in results]
+    held_out = np.full((len(model_specs), folds.size), np.nan)
+    model_index = {model_name: k for k, (model_name, _, _) in enumerate(model_specs)}
+    for (repeat, fold, model_name, _, _), (_, pred) in zip(cells, results):
+        held_out[model_index[model_name], (repeat - 1) * len(complete) + np.flatnonzero(folds[repeat - 1] == fold)] = pred
+    ids = complete[["Gene_prot", "label"]].reset_index(drop=True)
+    oof = pd.concat(
+        [ids.assign(repeat=repeat, fold=folds[repeat - 1]) for repeat in range(1, args.repeats + 1)],
+        ignore_index=True,
+    )
+    for model_name, k in model_index.items():
+        oof[model_name] = held_out[k]
 
     fold_df = pd.DataFrame(rows)
     summary = (
@@ -319,6 +284,14 @@ def main() -> None:
         )
         .reset_index()
     )
+    by_model = fold_df.groupby("model", sort=False)
+    summary["n_repeats"] = summary["model"].map(by_model["repeat"].nunique())
+    summary["sd_repeat_mean_auc"] = summary["model"].map(
+        fold_df.groupby(["model", "repeat"], sort=False)["test_auc"].mean().groupby(level="model").std()
+    )
+    summary["se_auc_corrected"] = summary["model"].map(
+        by_model["test_auc"].agg(lambda values: np.sqrt(corrected_variance(values, args.n_splits)))
+    )
     audit = pd.DataFrame(
         [
             {
@@ -334,12 +307,13 @@ def main() -> None:
     )
     fold_df.to_csv(out_dir / "fig3_fixed_esm2_context_calm_fold_results.csv", index=False)
     summary.to_csv(out_dir / "fig3_fixed_esm2_context_calm_summary.csv", index=False)
-    paired_tests(fold_df).to_csv(out_dir / "fig3_fixed_esm2_context_calm_paired_tests.csv", index=False)
+    tests = paired_tests(fold_df, oof)
+    tests.to_csv(out_dir / "fig3_fixed_esm2_context_calm_paired_tests.csv", index=False)
     audit.to_csv(out_dir / "fig3_fixed_esm2_context_calm_input_audit.csv", index=False)
 
     print(audit.to_string(index=False))
     print(summary.to_string(index=False, float_format=lambda value: f"{value:.4f}"))
-    print(paired_tests(fold_df).to_string(index=False, float_format=lambda value: f"{value:.4g}"))
+    print(tests.to_string(index=False, float_format=lambda value: f"{value:.4g}"))
 
 
 if __name__ == "__main__":
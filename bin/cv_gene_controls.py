@@ -8,6 +8,7 @@ persists after controlling explicit sequence features.
 
 from __future__ import annotations
 
+import argparse
 from pathlib import Path
 
 import numpy as np
@@ -15,91 +16,43 @@ import pandas as pd
 import statsmodels.api as sm
 from sklearn.metrics import roc_auc_score
 
-
-INPUT = Path("Results/Revision/len1022_model_control/len1022_model_control_score_table_complete_cases.csv")
+from context_features import context_features
+from eval_runner import add_worker_args
+from fast_auc import best_candidate, group_auc_rows, group_candidate_aucs
+from gene_features import load_gene_features
+from permutation_test import add_permutation_args, permutation_test, shuffle_within
+from score_table import load_score_table
+
+
+INPUT = Path("Results/Revision/len1022_model_control/len1022_model_control_score_table_complete_cases.parquet")
+SCORE_COLUMNS = [
+    "label",
+    "Gene_gene",
+    "variant_id",
+    "protein_length",
+    "Ref_gene",
+    "Mut_gene",
+    "esm2_150m_score",
+    "esm2_650m_score",
+    "esm1b_650m_score",
+    "calm_score",
+]
 GENE_FASTA_DIR = Path("/Users/cassie/Desktop/Gene")
+GENE_FEATURES = Path("Results/Revision/gene_features/gene_sequence_features.csv")
 OUT_DIR = Path("Results/Revision/len1022_core_clinvar")
+PAIR_WEIGHTS = np.linspace(0, 1, 101)
+
 
-BASES = ("A", "C", "G", "T")
-TRANSITIONS = {("A", "G"), ("G", "A"), ("C", "T"), ("T", "C")}
-CODON_TABLE = {
-    "TTT": "F",
-    "TTC": "F",
-    "TTA": "L",
-    "TTG": "L",
-    "TCT": "S",
-    "TCC": "S",
-    "TCA": "S",
-    "TCG": "S",
-    "TAT": "Y",
-    "TAC": "Y",
-    "TAA": "*",
-    "TAG": "*",
-    "TGT": "C",
-    "TGC": "C",
-    "TGA": "*",
-    "TGG": "W",
-    "CTT": "L",
-    "CTC": "L",
-    "CTA": "L",
-    "CTG": "L",
-    "CCT": "P",
-    "CCC": "P",
-    "CCA": "P",
-    "CCG": "P",
-    "CAT": "H",
-    "CAC": "H",
-    "CAA": "Q",
-    "CAG": "Q",
-    "CGT": "R",
-    "CGC": "R",
-    "CGA": "R",
-    "CGG": "R",
-    "ATT": "I",
-    "ATC": "I",
-    "ATA": "I",
-    "ATG": "M",
-    "ACT": "T",
-    "ACC": "T",
-    "ACA": "T",
-    "ACG": "T",
-    "AAT": "N",
-    "AAC": "N",
-    "AAA": "K",
-    "AAG": "K",
-    "AGT": "S",
-    "AGC": "S",
-    "AGA": "R",
-    "AGG": "R",
-    "GTT": "V",
-    "GTC": "V",
-    "GTA": "V",
-    "GTG": "V",
-    "GCT": "A",
-    "GCC": "A",
-    "GCA": "A",
-    "GCG": "A",
-    "GAT": "D",
-    "GAC": "D",
-    "GAA": "E",
-    "GAG": "E",
-    "GGT": "G",
-    "GGC": "G",
-    "GGA": "G",
-    "GGG": "G",
-}
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="ClinVar gene-level tables and sequence-confounder controls.")
+    add_permutation_args(parser)
+    add_worker_args(parser)
+    return parser.parse_args()
 
 
 def best_weight(y: np.ndarray, a: np.ndarray, b: np.ndarray) -> tuple[float, float]:
-    best_auc = -np.inf
-    best_w = np.nan
-    for w in np.linspace(0, 1, 101):
-        score = (1 - w) * a + w * b
-        auc = roc_auc_score(y, score)
-        if auc > best_auc:
-            best_auc = auc
-            best_w = w
-    return float(best_w), float(best_auc)
+    best, best_auc = best_candidate(y, [a, b], np.column_stack([1 - PAIR_WEIGHTS, PAIR_WEIGHTS]))
+    return float(PAIR_WEIGHTS[best]), best_auc
 
 
 def per_gene_summary(df: pd.DataFrame, min_pos: int = 5, min_neg: int = 5) -> pd.DataFrame:
@@ -160,6 +113,36 @@ def per_gene_summary(df: pd.DataFrame, min_pos: int = 5, min_neg: int = 5) -> pd
     return pd.DataFrame(rows)
 
 
+def calm_gains(
+    arrays: dict[str, np.ndarray],
+    rng: np.random.Generator | None = None,
+    active: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    In-sample ``650MCaLM_minus_650M`` of every gene, refitting the weight as ``per_gene_summary`` does.
+
+    All genes are scored in one ``group_candidate_aucs`` call. With ``rng``,
+    CaLM scores are first shuffled within each gene while labels and ESM-2
+    650M scores stay paired, so the null keeps the ESM-2 signal and the
+    p-value measures the gain beyond what the per-gene weight fit finds by
+    chance. Genes not in ``active`` get NaN.
+    """
+    codes = arrays["gene_codes"]
+    calm = arrays["calm"] if rng is None else shuffle_within(arrays["calm"], codes, rng)
+    rows = np.arange(len(codes)) if active is None else np.flatnonzero(active[codes])
+    y, s650, n_genes = arrays["label"][rows], arrays["esm2_650m"][rows], len(arrays["genes"])
+    aucs = group_candidate_aucs(
+        y,
+        [s650, calm[rows]],
+        np.column_stack([1 - PAIR_WEIGHTS, PAIR_WEIGHTS]),
+        codes[rows],
+        n_groups=n_genes,
+    )
+    fitted = ~np.isnan(aucs).all(axis=0)
+    best = np.where(fitted, np.where(np.isnan(aucs), -np.inf, aucs).max(axis=0), np.nan)
+    return best - group_auc_rows(y, s650, codes[rows], n_genes)[0]
+
+
 def fit_regression(df: pd.DataFrame, x_col: str, y_col: str, label: str, weighted: bool) -> dict[str, float | str | int]:
     reg_df = df.dropna(subset=[x_col, y_col, "n_pathogenic", "n_benign"]).copy()
     x = reg_df[x_col].to_numpy(dtype=float)
@@ -192,84 +175,25 @@ def fit_regression(df: pd.DataFrame, x_col: str, y_col: str, label: str, weighte
     }
 
 
-def read_fasta(path: Path) -> str | None:
-    if not path.exists():
-        return None
-    parts: list[str] = []
-    with path.open() as handle:
-        for line in handle:
-            line = line.strip()
-            if line and not line.startswith(">"):
-                parts.append(line.upper().replace("U", "T"))
-    return "".join(parts) or None
-
-
-def gene_composition(gene: str) -> dict[str, float]:
-    seq = read_fasta(GENE_FASTA_DIR / f"{gene}.fasta")
-    if seq is None:
-        return {"gene_gc": np.nan, "gene_cpg_density": np.nan}
-    clean = "".join(base for base in seq if base in BASES)
-    if not clean:
-        return {"gene_gc": np.nan, "gene_cpg_density": np.nan}
-    return {
-        "gene_gc": (clean.count("G") + clean.count("C")) / len(clean),
-        "gene_cpg_density": clean.count("CG") / max(len(clean) - 1, 1),
-    }
-
-
-def mutation_features(ref: str, mut: str) -> dict[str, float]:
-    ref = str(ref).upper().replace("U", "T")
-    mut = str(mut).upper().replace("U", "T")
-    out = {
-        "valid_snv_codon": 0.0,
-        "ref_codon_gc": np.nan,
-        "mut_codon_gc": np.nan,
-        "delta_codon_gc": np.nan,
-        "ref_cpg": np.nan,
-        "mut_cpg": np.nan,
-        "delta_cpg": np.nan,
-        "is_transition": np.nan,
-        "is_transversion": np.nan,
-        "mutated_codon_position": np.nan,
-        "local_degeneracy": np.nan,
-    }
-    if len(ref) != 3 or len(mut) != 3 or any(base not in BASES for base in ref + mut):
-        return out
-    diffs = [idx for idx, (a, b) in enumerate(zip(ref, mut)) if a != b]
-    if len(diffs) != 1:
-        return out
-    pos = diffs[0]
-    ref_aa = CODON_TABLE.get(ref)
-    if ref_aa is None or ref_aa == "*":
-        return out
-
-    syn_count = 0
-    for base in BASES:
-        candidate = ref[:pos] + base + ref[pos + 1 :]
-        if CODON_TABLE.get(candidate) == ref_aa:
-            syn_count += 1
-
-    ref_gc = sum(base in {"G", "C"} for base in ref)
-    mut_gc = sum(base in {"G", "C"} for base in mut)
-    ref_cpg = int("CG" in ref)
-    mut_cpg = int("CG" in mut)
-    transition = int((ref[pos], mut[pos]) in TRANSITIONS)
-    out.update(
-        {
-            "valid_snv_codon": 1.0,
-            "ref_codon_gc": ref_gc / 3,
-            "mut_codon_gc": mut_gc / 3,
-            "delta_codon_gc": (mut_gc - ref_gc) / 3,
-            "ref_cpg": float(ref_cpg),
-            "mut_cpg": float(mut_cpg),
-            "delta_cpg": float(mut_cpg - ref_cpg),
-            "is_transition": float(transition),
-            "is_transversion": float(1 - transition),
-            "mutated_codon_position": float(pos + 1),
-            "local_degeneracy": float(syn_count),
-        }
-    )
-    return out
+def mutation_features(df: pd.DataFrame) -> pd.DataFrame:
+    table = context_features(df["Ref_gene"], df["Mut_gene"])
+    valid = (table["valid_snv_codon"] == 1) & (table["ref_is_stop"] == 0)
+    features = table[
+        [
+            "ref_codon_gc",
+            "mut_codon_gc",
+            "delta_codon_gc",
+            "ref_cpg",
+            "mut_cpg",
+            "delta_cpg",
+            "is_transition",
+            "is_transversion",
+            "mutated_codon_position",
+            "local_degeneracy",
+        ]
+    ].where(valid)
+    features.insert(0, "valid_snv_codon", valid.astype(float))
+    return features
 
 
 def zscore(series: pd.Series) -> pd.Series:
@@ -339,14 +263,10 @@ def fit_glm_clustered(
 
 
 def sequence_confounder_control(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    feature_df = pd.DataFrame([mutation_features(ref, mut) for ref, mut in zip(df["Ref_gene"], df["Mut_gene"])])
-    valid = pd.concat([df.reset_index(drop=True), feature_df], axis=1)
-    gene_comp = pd.DataFrame.from_dict(
-        {gene: gene_composition(gene) for gene in sorted(valid["Gene_gene"].dropna().unique())},
-        orient="index",
-    )
-    gene_comp.index.name = "Gene_gene"
-    valid = valid.merge(gene_comp.reset_index(), on="Gene_gene", how="left")
+    feature_df = mutation_features(df)
+    valid = pd.concat([df.reset_index(drop=True), feature_df.reset_index(drop=True)], axis=1)
+    gene_comp = load_gene_features(GENE_FEATURES, GENE_FASTA_DIR)[["gene", "gene_gc", "gene_cpg_density"]]
+    valid = valid.merge(gene_comp.rename(columns={"gene": "Gene_gene"}), on="Gene_gene", how="left")
     valid = valid[valid["valid_snv_codon"] == 1].copy()
     valid = valid.dropna(subset=["calm_score", "esm2_650m_score", "gene_gc", "gene_cpg_density"])
 
@@ -469,8 +389,9 @@ def summarize_core_analyses(new_per_gene: pd.DataFrame, new_regs: pd.DataFrame,
 
 
 def main() -> None:
+    args = parse_args()
     OUT_DIR.mkdir(parents=True, exist_ok=True)
-    df = pd.read_csv(INPUT)
+    df = load_score_table(INPUT, columns=SCORE_COLUMNS)
     df = df.drop_duplicates(subset=["variant_id", "Gene_gene"]).copy()
 
     cohort_summary = pd.DataFrame(
@@ -495,6 +416,26 @@ def main() -> None:
     per_gene["inverse_variance_weight"] = (
         per_gene["n_pathogenic"] * per_gene["n_benign"] / (per_gene["n_pathogenic"] + per_gene["n_benign"])
     )
+    if args.max_permutations > 0 and not per_gene.empty:
+        panel = df[df["Gene_gene"].isin(per_gene["gene"])]
+        arrays = {
+            "genes": per_gene["gene"].to_numpy(),
+            "gene_codes": pd.Categorical(panel["Gene_gene"], categories=per_gene["gene"]).codes.astype(np.intp),
+            "label": panel["label"].to_numpy(int),
+            "esm2_650m": panel["esm2_650m_score"].to_numpy(float),
+            "calm": panel["calm_score"].to_numpy(float),
+        }
+        gains = permutation_test(
+            calm_gains,
+            arrays,
+            alternative="greater",
+            exceedances=args.exceedances,
+            max_permutations=args.max_permutations,
+            seed=args.permutation_seed,
+            workers=args.workers,
+        )
+        per_gene["650MCaLM_minus_650M_p_permutation"] = gains["p_permutation"].to_numpy()
+        per_gene["650MCaLM_minus_650M_n_permutations"] = gains["n_permutations"].to_numpy()
     per_gene.to_csv(OUT_DIR / "per_gene_ensemble_summary.csv", index=False)
 
     regs = pd.DataFrame(
@@ -3,7 +3,23 @@
 
 This compares same-modality PLM+PLM ensembles against cross-modal PLM+CaLM
 ensembles using gene-held-out folds. Ensemble weights are optimized only on
-training genes and evaluated on held-out genes.
+training genes and evaluated on held-out genes; ``--weight-search`` picks
+the optimizer (fixed grid, coarse-to-fine refinement, the exact two-model
+sweep or simplex coordinate ascent, see ``weight_search.py``). The optional
+four-model ensemble (``--four-model``) uses coordinate ascent within
+``--search-budget`` evaluations per fold. The (fold, model) cells are independent and run on
+``--workers`` processes that share the score matrix (``eval_runner.py``).
+Every variant's held-out ensemble scores are saved to
+``model_control_oof_predictions.parquet`` for ``bootstrap_ci.py``, and the
+paired tests add gene-clustered DeLong tests on them (``delong.py``).
+
+``--repeats R`` evaluates R independently seeded gene-grouped splits; all
+repeat x fold x model cells share one pool. Fold results and predictions
+gain a ``repeat`` column, summaries pool every repeat x fold estimate and
+add the spread of the repeat means and a Nadeau-Bengio corrected standard
+error, and the paired tests add the corrected repeated k-fold t-test. The
+uncorrected paired t and Wilcoxon tests and the DeLong tests use the first
+repeat, the ``--seed`` split.
 """
 
 from __future__ import annotations
@@ -15,28 +31,49 @@ import numpy as np
 import pandas as pd
 from scipy.stats import ttest_rel, wilcoxon
 from sklearn.metrics import roc_auc_score
-from sklearn.model_selection import StratifiedGroupKFold
+
+from delong import delong_tests
+from eval_runner import add_worker_args, fold_view, run_cells
+from score_table import MemoryAudit, compact_dtypes, write_score_table
+from split_registry import (
+    add_registry_args,
+    add_repeat_args,
+    corrected_ttest,
+    corrected_variance,
+    repeated_fold_ids,
+)
+from variant_keys import GeneDictionary, encode_variant_keys
+from weight_search import DEFAULT_BUDGET, STRATEGIES, search_weights
 
 
 PATHOGENIC_LABELS = {"pathogenic", "likely_pathogenic"}
-KEY_COLS = [
-    "Gene_prot",
-    "Site_prot",
-    "Ref_prot",
-    "Mut_prot",
-    "Gene_gene",
-    "Site_gene",
-    "Ref_gene",
-    "Mut_gene",
-    "Label_prot",
-    "Label_gene",
-]
 SCORE_COLUMNS = {
     "ESM-2 150M": "esm2_150m_score",
     "ESM-2 650M": "esm2_650m_score",
     "ESM-1b 650M": "esm1b_650m_score",
     "CaLM": "calm_score",
 }
+COMPARISONS = [
+    ("ESM-2 150M + ESM-2 650M", "ESM-2 650M"),
+    ("ESM-2 650M + ESM-1b 650M", "ESM-2 650M"),
+    ("ESM-2 650M + CaLM", "ESM-2 650M"),
+    ("ESM-1b 650M + CaLM", "ESM-1b 650M"),
+    ("ESM-2 650M + CaLM", "ESM-2 650M + ESM-1b 650M"),
+    (
+        "ESM-2 650M + ESM-1b 650M + CaLM",
+        "ESM-2 650M + ESM-1b 650M",
+    ),
+    (
+        "ESM-2 650M + ESM-1b 650M + CaLM",
+        "ESM-2 650M + CaLM",
+    ),
+]
+# Optional four-model ensemble, fitted only with --four-model.
+FOUR_MODEL_SPEC = (
+    "ESM-2 150M + ESM-2 650M + ESM-1b 650M + CaLM",
+    ["ESM-2 150M", "ESM-2 650M", "ESM-1b 650M", "CaLM"],
+)
+FOUR_MODEL_COMPARISON = (FOUR_MODEL_SPEC[0], "ESM-2 650M + ESM-1b 650M + CaLM")
 
 
 def parse_args() -> argparse.Namespace:
@@ -65,98 +102,167 @@ def parse_args() -> argparse.Namespace:
     )
     parser.add_argument("--n-splits", type=int, default=10)
     parser.add_argument("--seed", type=int, default=16)
+    add_repeat_args(parser)
     parser.add_argument("--pair-grid-step", type=float, default=0.01)
     parser.add_argument("--triple-grid-step", type=float, default=0.05)
+    parser.add_argument(
+        "--weight-search",
+        choices=STRATEGIES,
+        default="grid",
+        help=(
+            "grid: fixed grids above; refine: start from them and refine to --fine-step; "
+            "exact: optimal pair weights; ascent: simplex coordinate ascent."
+        ),
+    )
+    parser.add_argument("--fine-step", type=float, default=0.002)
+    parser.add_argument(
+        "--max-pairs",
+        type=int,
+        default=20_000_000,
+        help=(
+            "Largest positive x negative pair count for --weight-search exact; larger training folds fall back "
+            "to refine with a warning (the weight_search column records the search used)."
+        ),
+    )
+    parser.add_argument(
+        "--write-csv",
+        action="store_true",
+        help="Also write the score tables as CSV next to the Parquet files.",
+    )
+    parser.add_argument(
+        "--search-budget",
+        type=int,
+        default=DEFAULT_BUDGET,
+        help="Weight evaluations per fold for coordinate ascent, also used when a grid would be larger.",
+    )
+    parser.add_argument(
+        "--four-model",
+        action="store_true",
+        help="Also fit the ESM-2 150M + ESM-2 650M + ESM-1b 650M + CaLM ensemble and test it against the triple.",
+    )
+    add_worker_args(parser)
+    add_registry_args(parser)
     return parser.parse_args()
 
 
-def pair_weights(step: float) -> list[tuple[float, float]]:
-    values = np.arange(0.0, 1.0 + step / 2.0, step)
-    return [(float(1.0 - w), float(w)) for w in values]
-
-
-def triple_weights(step: float) -> list[tuple[float, float, float]]:
-    values = np.arange(0.0, 1.0 + step / 2.0, step)
-    weights = []
-    for w1 in values:
-        for w2 in values:
-            w3 = 1.0 - w1 - w2
-            if w3 >= -1e-9:
-                weights.append((float(w1), float(w2), float(max(0.0, w3))))
-    return weights
-
-
-def best_weights(
-    y_train: np.ndarray,
-    train_scores: list[np.ndarray],
-    candidates: list[tuple[float, ...]],
-) -> tuple[float, ...]:
-    best_auc = -np.inf
-    best_candidate = candidates[0]
-    for weights in candidates:
-        train_mix = sum(w * score for w, score in zip(weights, train_scores))
-        auc = roc_auc_score(y_train, train_mix)
-        if auc > best_auc:
-            best_auc = auc
-            best_candidate = weights
-    return best_candidate
-
-
 def mix_scores(weights: tuple[float, ...], scores: list[np.ndarray]) -> np.ndarray:
     return sum(w * score for w, score in zip(weights, scores))
 
 
-def load_scores(args: argparse.Namespace) -> pd.DataFrame:
-    base = pd.read_csv(args.base)
-    esm2 = pd.read_csv(args.esm2_650m)[KEY_COLS + ["esm2_650m_llr", "esm2_650m_score"]]
-    esm1b = pd.read_csv(args.esm1b_650m)[KEY_COLS + ["esm1b_650m_llr", "esm1b_650m_score"]]
+def evaluate_cell(arrays: dict[str, np.ndarray], cell: tuple) -> tuple[dict[str, object], np.ndarray]:
+    """Fit the ensemble weights of one model spec on the training genes of one fold; returns the row and test scores."""
+    repeat, fold, model_name, components, search_options = cell
+    view = fold_view(arrays, fold, repeat)
+    y_test = view["y_test"]
+    columns = [list(SCORE_COLUMNS).index(component) for component in components]
+    search = search_weights(
+        view["y_train"],
+        [view["train_scores"][:, col] for col in columns],
+        **search_options,
+    )
+    weights = search["weights"]
+    test_score = mix_scores(weights, [view["test_scores"][:, col] for col in columns])
+    weight_by_component = dict(zip(components, weights))
+    row = {
+        "repeat": repeat,
+        "fold": fold,
+        "model": model_name,
+        "components": " + ".join(components),
+        "test_auc": roc_auc_score(y_test, test_score),
+        "train_auc": search["train_auc"],
+        "weight_search": search["strategy"],
+        "n_evaluations": search["n_evaluations"],
+        "w_esm2_150m": weight_by_component.get("ESM-2 150M", 0.0),
+        "w_esm2_650m": weight_by_component.get("ESM-2 650M", 0.0),
+        "w_esm1b_650m": weight_by_component.get("ESM-1b 650M", 0.0),
+        "w_calm": weight_by_component.get("CaLM", 0.0),
+        "n_test": len(y_test),
+        "n_test_genes": view["n_test_genes"],
+        "n_test_pathogenic": int(y_test.sum()),
+    }
+    return row, test_score
+
+
+VARIANT_KEY_COLS = ["Gene_prot", "Site_prot", "Ref_prot", "Mut_prot", "Ref_gene", "Mut_gene"]
+# Columns of the old string join that the packed key leaves out; checked after each merge.
+JOIN_CHECK_COLS = ["Gene_gene", "Site_gene", "Label_prot", "Label_gene"]
+
+
+def variant_keys(genes: GeneDictionary, df: pd.DataFrame) -> pd.arrays.IntegerArray:
+    return encode_variant_keys(genes, *(df[col] for col in VARIANT_KEY_COLS))
+
+
+def check_joined_columns(df: pd.DataFrame, name: str, matched: pd.Series) -> None:
+    """Raise if a joined score table disagrees with the base table outside the variant key."""
+    for col in JOIN_CHECK_COLS:
+        left, right = df.loc[matched, col], df.loc[matched, f"{col}_{name}"]
+        if pd.api.types.is_numeric_dtype(left) and pd.api.types.is_numeric_dtype(right):
+            same = left.to_numpy(dtype=np.float64) == right.to_numpy(dtype=np.float64)
+        else:
+            same = left.astype(str).to_numpy() == right.astype(str).to_numpy()
+        same |= (left.isna() & right.isna()).to_numpy()
+        if not same.all():
+            example = df.loc[matched].loc[~same, [*VARIANT_KEY_COLS, col, f"{col}_{name}"]].head()
+            raise ValueError(
+                f"{name} scores disagree with the base table on {col} for {int((~same).sum())} "
+                f"variants:\n{example.to_string(index=False)}"
+            )
+
 
-    df = base.copy()
-    df["label"] = df["Label_prot"].astype(str).isin(PATHOGENIC_LABELS).astype(int)
-    df["esm2_150m_llr"] = df["LLR_prot"].astype(float)
+def load_scores(args: argparse.Namespace, audit: MemoryAudit) -> pd.DataFrame:
+    genes = GeneDictionary()
+    df = pd.read_csv(args.base)
+    audit.record("base loaded (default dtypes)", df)
+    df = compact_dtypes(df, score_dtype=np.float64)
+    df["label"] = df["Label_prot"].astype(str).isin(PATHOGENIC_LABELS).astype(np.int8)
+    df["esm2_150m_llr"] = df["LLR_prot"]
     df["esm2_150m_score"] = -df["esm2_150m_llr"]
-    df["calm_llr"] = df["LLR_gene"].astype(float)
+    df["calm_llr"] = df["LLR_gene"]
     df["calm_score"] = -df["calm_llr"]
-    df["variant_id"] = (
-        df["Gene_prot"].astype(str)
-        + ":"
-        + df["Site_prot"].astype(str)
-        + ":"
-        + df["Ref_prot"].astype(str)
-        + ">"
-        + df["Mut_prot"].astype(str)
-        + ":"
-        + df["Ref_gene"].astype(str)
-        + ">"
-        + df["Mut_gene"].astype(str)
-    )
-    df = df.merge(esm2, on=KEY_COLS, how="left", validate="one_to_one")
-    df = df.merge(esm1b, on=KEY_COLS, how="left", validate="one_to_one")
+    df["variant_id"] = variant_keys(genes, df)
+    keyed = df["variant_id"].notna()
+    if df.loc[keyed, "variant_id"].duplicated().any():
+        raise ValueError("Base table has duplicate variants")
+    if not keyed.all():
+        print(f"{int((~keyed).sum())} base variants have unrecognised residues or codons and get no 650M scores")
+    audit.record("base compacted", df)
+
+    for name, path in [("esm2_650m", args.esm2_650m), ("esm1b_650m", args.esm1b_650m)]:
+        usecols = [*VARIANT_KEY_COLS, *JOIN_CHECK_COLS, f"{name}_llr", f"{name}_score"]
+        scores = compact_dtypes(pd.read_csv(path, usecols=usecols), score_dtype=np.float64)
+        scores["variant_id"] = variant_keys(genes, scores)
+        keep = ["variant_id", *JOIN_CHECK_COLS, f"{name}_llr", f"{name}_score"]
+        scores = scores.loc[scores["variant_id"].notna(), keep]
+        scores = scores.rename(columns={col: f"{col}_{name}" for col in JOIN_CHECK_COLS})
+        audit.record(f"{name} scores loaded", scores)
+        # Unkeyed base rows are left unmatched, so only the score side needs to be unique.
+        df = df.merge(scores, on="variant_id", how="left", validate="many_to_one", indicator=True)
+        check_joined_columns(df, name, df["_merge"] == "both")
+        df = df.drop(columns=["_merge", *(f"{col}_{name}" for col in JOIN_CHECK_COLS)])
+        audit.record(f"merged {name}", df)
     return df
 
 
-def paired_tests(fold_df: pd.DataFrame) -> pd.DataFrame:
-    comparisons = [
-        ("ESM-2 150M + ESM-2 650M", "ESM-2 650M"),
-        ("ESM-2 650M + ESM-1b 650M", "ESM-2 650M"),
-        ("ESM-2 650M + CaLM", "ESM-2 650M"),
-        ("ESM-1b 650M + CaLM", "ESM-1b 650M"),
-        ("ESM-2 650M + CaLM", "ESM-2 650M + ESM-1b 650M"),
-        (
-            "ESM-2 650M + ESM-1b 650M + CaLM",
-            "ESM-2 650M + ESM-1b 650M",
-        ),
-        (
-            "ESM-2 650M + ESM-1b 650M + CaLM",
-            "ESM-2 650M + CaLM",
-        ),
-    ]
-    wide = fold_df.pivot(index="fold", columns="model", values="test_auc")
+def paired_tests(fold_df: pd.DataFrame, oof: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    Fold-level paired t and Wilcoxon tests of the planned comparisons.
+
+    Repeat x fold deltas are pooled for ``mean_delta`` and ``corrected_t_p``,
+    the corrected repeated k-fold t-test, which allows for the overlapping
+    training sets. ``paired_t_p`` and ``wilcoxon_p`` treat folds as
+    independent, so they use the first repeat's folds only. With the out-of-fold predictions, also the
+    gene-clustered DeLong test of each comparison on the pooled held-out
+    scores of the first repeat (``delong_*`` columns).
+    """
+    n_splits = int(fold_df["fold"].max())
+    wide = fold_df.pivot(index=["repeat", "fold"], columns="model", values="test_auc")
+    comparisons = COMPARISONS + ([FOUR_MODEL_COMPARISON] if FOUR_MODEL_SPEC[0] in wide.columns else [])
     rows = []
+    first = wide.xs(1, level="repeat")
     for a, b in comparisons:
         delta = wide[a] - wide[b]
         try:
-            wilcoxon_p = float(wilcoxon(delta).pvalue)
+            wilcoxon_p = float(wilcoxon(first[a] - first[b]).pvalue)
         except ValueError:
             wilcoxon_p = np.nan
         rows.append(
@@ -165,12 +271,20 @@ def paired_tests(fold_df: pd.DataFrame) -> pd.DataFrame:
                 "b": b,
                 "mean_delta": float(delta.mean()),
                 "sd_delta": float(delta.std(ddof=1)),
-                "paired_t_p": float(ttest_rel(wide[a], wide[b]).pvalue),
+                "paired_t_p": float(ttest_rel(first[a], first[b]).pvalue),
                 "wilcoxon_p": wilcoxon_p,
+                "corrected_t_p": corrected_ttest(delta, n_splits)[1],
                 "fold_deltas": ";".join(f"{value:.5f}" for value in delta),
             }
         )
-    return pd.DataFrame(rows)
+    tests = pd.DataFrame(rows)
+    if oof is None:
+        return tests
+    models = list(dict.fromkeys(name for pair in comparisons for name in pair))
+    pooled = oof[oof["repeat"] == 1].dropna(subset=models)
+    delong = delong_tests(pooled["label"].to_numpy(), pooled, comparisons, clusters=pooled["Gene_prot"])
+    tests = tests.merge(delong, on=["a", "b"], how="left")
+    return tests[[col for col in tests.columns if col != "fold_deltas"] + ["fold_deltas"]]
 
 
 def main() -> None:
@@ -178,22 +292,32 @@ def main() -> None:
     out_dir = Path(args.out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    df_all = load_scores(args)
+    memory = MemoryAudit()
+    df_all = load_scores(args, memory)
     score_cols = list(SCORE_COLUMNS.values())
     df = df_all.dropna(subset=["label", "Gene_prot", *score_cols]).copy()
-    df_all.to_csv(out_dir / "len1022_model_control_score_table_all_variants.csv", index=False)
-    df.to_csv(out_dir / "len1022_model_control_score_table_complete_cases.csv", index=False)
+    memory.record("complete cases", df)
+    for name, table in [("all_variants", df_all), ("complete_cases", df)]:
+        stem = out_dir / f"len1022_model_control_score_table_{name}"
+        write_score_table(table, stem.with_suffix(".parquet"))
+        if args.write_csv:
+            table.to_csv(stem.with_suffix(".csv"), index=False)
+    # The canonical tables keep full precision; only the analysis copy is float32.
+    df = compact_dtypes(df)
+    memory.record("complete cases compacted", df)
 
     y = df["label"].to_numpy(dtype=int)
     groups = df["Gene_prot"].astype(str).to_numpy()
-    splits = list(
-        StratifiedGroupKFold(
-            n_splits=args.n_splits, shuffle=True, random_state=args.seed
-        ).split(df, y, groups=groups)
+    folds = repeated_fold_ids(
+        y,
+        groups,
+        args.n_splits,
+        args.seed,
+        args.repeats,
+        group_col="Gene_prot",
+        registry=args.split_registry,
     )
 
-    pair_candidates = pair_weights(args.pair_grid_step)
-    triple_candidates = triple_weights(args.triple_grid_step)
     model_specs = [
         ("ESM-2 150M", ["ESM-2 150M"]),
         ("ESM-2 650M", ["ESM-2 650M"]),
@@ -210,43 +334,49 @@ def main() -> None:
             ["ESM-2 650M", "ESM-1b 650M", "CaLM"],
         ),
     ]
+    if args.four_model:
+        model_specs.append(FOUR_MODEL_SPEC)
 
-    rows = []
-    for fold, (train_idx, test_idx) in enumerate(splits, start=1):
-        y_train = y[train_idx]
-        y_test = y[test_idx]
-        for model_name, components in model_specs:
-            if len(components) == 1:
-                weights = (1.0,)
-            else:
-                candidates = pair_candidates if len(components) == 2 else triple_candidates
-                train_scores = [
-                    df.iloc[train_idx][SCORE_COLUMNS[component]].to_numpy()
-                    for component in components
-                ]
-                weights = best_weights(y_train, train_scores, candidates)
-
-            test_scores = [
-                df.iloc[test_idx][SCORE_COLUMNS[component]].to_numpy()
-                for component in components
-            ]
-            test_score = mix_scores(weights, test_scores)
-            weight_by_component = dict(zip(components, weights))
-            rows.append(
-                {
-                    "fold": fold,
-                    "model": model_name,
-                    "components": " + ".join(components),
-                    "test_auc": roc_auc_score(y_test, test_score),
-                    "w_esm2_150m": weight_by_component.get("ESM-2 150M", 0.0),
-                    "w_esm2_650m": weight_by_component.get("ESM-2 650M", 0.0),
-                    "w_esm1b_650m": weight_by_component.get("ESM-1b 650M", 0.0),
-                    "w_calm": weight_by_component.get("CaLM", 0.0),
-                    "n_test": len(test_idx),
-                    "n_test_genes": len(np.unique(groups[test_idx])),
-                    "n_test_pathogenic": int(y_test.sum()),
-                }
-            )
+    cells = [
+        (
+            repeat,
+            fold,
+            model_name,
+            components,
+            {
+                "strategy": args.weight_search,
+                "step": args.pair_grid_step if len(components) == 2 else args.triple_grid_step,
+                "fine_step": args.fine_step,
+                "max_pairs": args.max_pairs,
+                "budget": args.search_budget,
+                # One search seed per (repeat, fold); repeat 1 keeps the single-split seeds.
+                "seed": args.seed + (repeat - 1) * args.n_splits + fold,
+            },
+        )
+        for repeat in range(1, args.repeats + 1)
+        for fold in range(1, args.n_splits + 1)
+        for model_name, components in model_specs
+    ]
+    arrays = {
+        "scores": df[score_cols].to_numpy(dtype=np.float64),
+        "y": y,
+        "fold_ids": folds,
+        "gene_codes": pd.factorize(groups)[0],
+    }
+    results = run_cells(evaluate_cell, cells, arrays, args.workers)
+    rows = [row for row, _ in results]
+    held_out = np.full((len(model_specs), folds.size), np.nan)
+    model_index = {model_name: k for k, (model_name, _) in enumerate(model_specs)}
+    for (repeat, fold, model_name, _, _), (_, test_score) in zip(cells, results):
+        held_out[model_index[model_name], (repeat - 1) * len(df) + np.flatnonzero(folds[repeat - 1] == fold)] = test_score
+    del results
+    ids = df[["Gene_prot", "label"]].reset_index(drop=True)
+    oof = pd.concat(
+        [ids.assign(repeat=repeat, fold=folds[repeat - 1]) for repeat in range(1, args.repeats + 1)],
+        ignore_index=True,
+    )
+    for model_name, k in model_index.items():
+        oof[model_name] = held_out[k]
 
     fold_df = pd.DataFrame(rows)
     summary = (
@@ -254,6 +384,8 @@ def main() -> None:
         .agg(
             mean_auc=("test_auc", "mean"),
             sd_auc=("test_auc", "std"),
+            mean_train_auc=("train_auc", "mean"),
+            mean_evaluations=("n_evaluations", "mean"),
             mean_w_esm2_150m=("w_esm2_150m", "mean"),
             mean_w_esm2_650m=("w_esm2_650m", "mean"),
             mean_w_esm1b_650m=("w_esm1b_650m", "mean"),
@@ -262,6 +394,17 @@ def main() -> None:
         )
         .reset_index()
     )
+    by_model = fold_df.groupby("model", sort=False)
+    summary["n_repeats"] = summary["model"].map(by_model["repeat"].nunique())
+    summary["weight_search"] = summary["model"].map(
+        by_model["weight_search"].agg(lambda used: "/".join(used.unique()))
+    )
+    summary["sd_repeat_mean_auc"] = summary["model"].map(
+        fold_df.groupby(["model", "repeat"], sort=False)["test_auc"].mean().groupby(level="model").std()
+    )
+    summary["se_auc_corrected"] = summary["model"].map(
+        by_model["test_auc"].agg(lambda values: np.sqrt(corrected_variance(values, args.n_splits)))
+    )
     audit = pd.DataFrame(
         [
             {
@@ -280,13 +423,17 @@ def main() -> None:
     )
 
     fold_df.to_csv(out_dir / "model_control_gene_heldout_fold_results.csv", index=False)
+    write_score_table(oof, out_dir / "model_control_oof_predictions.parquet")
     summary.to_csv(out_dir / "model_control_gene_heldout_summary.csv", index=False)
-    paired_tests(fold_df).to_csv(out_dir / "model_control_paired_tests.csv", index=False)
+    tests = paired_tests(fold_df, oof)
+    tests.to_csv(out_dir / "model_control_paired_tests.csv", index=False)
     audit.to_csv(out_dir / "model_control_input_audit.csv", index=False)
+    memory.table().to_csv(out_dir / "model_control_memory_audit.csv", index=False)
 
     print(audit.to_string(index=False))
+    print(memory.table().to_string(index=False, float_format=lambda value: f"{value:.1f}"))
     print(summary.to_string(index=False, float_format=lambda value: f"{value:.4f}"))
-    print(paired_tests(fold_df).to_string(index=False, float_format=lambda value: f"{value:.4g}"))
+    print(tests.to_string(index=False, float_format=lambda value: f"{value:.4g}"))
 
 
 if __name__ == "__main__":
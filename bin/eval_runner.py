@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Process-parallel evaluation of independent (fold, model spec) cells.
+
+The cross-validation controls evaluate every model spec on every fold, and
+each cell only reads the shared score arrays. ``run_cells`` dispatches the
+cells to a process pool: the named arrays are copied once into shared memory
+and every worker maps them read-only in its initializer, so only the small
+cell descriptions and result rows are pickled. Results come back in cell
+order whatever the worker count, and each cell is computed by the same code
+as in a serial run, so the output does not depend on ``workers``.
+
+Cell functions must be module-level (picklable) and take ``(arrays, cell)``,
+where ``arrays`` maps the names passed to ``run_cells`` to numpy arrays.
+Workers limit BLAS/OpenMP to one thread so a full pool does not oversubscribe
+the machine.
+
+Cells are listed fold by fold, and ``fold_view`` gives a cell its fold's
+train/test indices, labels and score blocks (column-contiguous slices of the
+``scores`` matrix), built once per fold and reused by every model spec of
+that fold. Only the current fold's blocks are kept, so a process holds about
+one extra copy of the score columns. For repeated cross-validation
+``fold_ids`` is a (repeats, n) matrix and cells are listed repeat by repeat,
+then fold by fold; the cohort arrays are still shared once, whatever the
+number of repeats.
+"""
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Iterable
+
+import numpy as np
+
+
+_ARRAYS: dict[str, np.ndarray] = {}
+_SEGMENTS: list[shared_memory.SharedMemory] = []
+_FOLD_VIEW: dict[tuple[int, int], dict[str, object]] = {}
+
+
+def default_workers() -> int:
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+
+
+def add_worker_args(parser) -> None:
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes for the fold x model evaluation (0 = all available cores); results do not depend on it.",
+    )
+
+
+def share_arrays(arrays: dict[str, np.ndarray]) -> tuple[list[shared_memory.SharedMemory], dict[str, tuple]]:
+    """Copy arrays into new shared-memory segments; returns the segments and attach specs."""
+    segments, specs = [], {}
+    try:
+        for name, values in arrays.items():
+            values = np.ascontiguousarray(values)
+            segment = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            segments.append(segment)
+            np.ndarray(values.shape, dtype=values.dtype, buffer=segment.buf)[...] = values
+            specs[name] = (segment.name, values.shape, values.dtype.str)
+    except BaseException:
+        release(segments)
+        raise
+    return segments, specs
+
+
+def release(segments: list[shared_memory.SharedMemory]) -> None:
+    for segment in segments:
+        segment.close()
+        segment.unlink()
+
+
+def attach_arrays(specs: dict[str, tuple]) -> None:
+    from threadpoolctl import threadpool_limits
+
+    threadpool_limits(1)
+    _FOLD_VIEW.clear()
+    for name, (segment_name, shape, dtype) in specs.items():
+        segment = shared_memory.SharedMemory(name=segment_name)
+        _SEGMENTS.append(segment)
+        values = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+        values.flags.writeable = False
+        _ARRAYS[name] = values
+
+
+def fold_view(arrays: dict[str, np.ndarray], fold: int, repeat: int = 1) -> dict[str, object]:
+    """
+    Row slices of one fold, shared by all cells of that fold.
+
+    Args:
+        arrays: Shared arrays with ``fold_ids`` (n,) or (repeats, n), ``y``
+            and ``scores`` (n, k), and optionally ``gene_codes``.
+        fold: 1-based fold id; its rows are the test set.
+        repeat: 1-based row of a (repeats, n) ``fold_ids``.
+
+    Returns:
+        ``train_idx``, ``test_idx``, ``y_train``, ``y_test``,
+        ``train_scores`` / ``test_scores`` (Fortran-ordered, so each column
+        is contiguous) and ``n_test_genes`` when ``gene_codes`` is given.
+    """
+    view = _FOLD_VIEW.get((repeat, fold))
+    if view is None:
+        folds = arrays["fold_ids"]
+        held_out = (folds if folds.ndim == 1 else folds[repeat - 1]) == fold
+        train_idx = np.flatnonzero(~held_out)
+        test_idx = np.flatnonzero(held_out)
+        view = {
+            "train_idx": train_idx,
+            "test_idx": test_idx,
+            "y_train": arrays["y"][train_idx],
+            "y_test": arrays["y"][test_idx],
+            "train_scores": np.asfortranarray(arrays["scores"][train_idx]),
+            "test_scores": np.asfortranarray(arrays["scores"][test_idx]),
+        }
+        if "gene_codes" in arrays:
+            view["n_test_genes"] = len(np.unique(arrays["gene_codes"][test_idx]))
+        _FOLD_VIEW.clear()
+        _FOLD_VIEW[(repeat, fold)] = view
+    return view
+
+
+def run_cell(payload: tuple[Callable, object]):
+    cell_fn, cell = payload
+    return cell_fn(_ARRAYS, cell)
+
+
+def run_cells(
+    cell_fn: Callable[[dict[str, np.ndarray], object], object],
+    cells: Iterable[object],
+    arrays: dict[str, np.ndarray],
+    workers: int = 1,
+) -> list[object]:
+    """
+    Evaluate ``cell_fn(arrays, cell)`` for every cell.
+
+    Args:
+        cell_fn: Module-level function of the shared arrays and one cell.
+        cells: Picklable cell descriptions.
+        arrays: Named arrays every cell reads.
+        workers: Worker processes; 1 runs in-process, 0 uses every available core.
+
+    Returns:
+        The cell results, in the order of ``cells``.
+    """
+    cells = list(cells)
+    workers = min(workers or default_workers(), len(cells))
+    if workers <= 1:
+        _FOLD_VIEW.clear()
+        try:
+            return [cell_fn(arrays, cell) for cell in cells]
+        finally:
+            _FOLD_VIEW.clear()
+
+    segments, specs = share_arrays(arrays)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=attach_arrays, initargs=(specs,)) as pool:
+            chunksize = max(1, len(cells) // (4 * workers))
+            return list(pool.map(run_cell, [(cell_fn, cell) for cell in cells], chunksize=chunksize))
+    finally:
+        release(segments)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Rank-based AUROC for many candidate scores at once.
+
+AUROC equals the Mann-Whitney statistic: with midranks for tied scores,
+``(sum of positive ranks - n_pos (n_pos + 1) / 2) / (n_pos n_neg)``, which is
+what ``sklearn.metrics.roc_auc_score`` computes for binary labels. Here the
+ranks of a whole (m, n) matrix of candidate scores are computed with one
+argsort per candidate and label-count arithmetic, without per-call input
+validation, so an ensemble weight search over hundreds of candidates is one
+call. Candidates are processed in blocks to bound memory. Inputs must be
+free of NaN.
+"""
+
+from __future__ import annotations
+
+from typing import Sequence
+
+import numpy as np
+
+
+BLOCK_ELEMENTS = 1 << 22
+
+
+def run_midranks(starts: np.ndarray) -> np.ndarray:
+    """1-based midranks of sorted rows whose tie runs begin where ``starts`` (m, n) is True."""
+    n = starts.shape[1]
+    position = np.arange(n)[None, :]
+    ends = np.ones(starts.shape, dtype=bool)
+    ends[:, :-1] = starts[:, 1:]
+    first = np.maximum.accumulate(np.where(starts, position, 0), axis=1)
+    last = np.minimum.accumulate(np.where(ends, position, n - 1)[:, ::-1], axis=1)[:, ::-1]
+    return (first + last) / 2.0 + 1.0
+
+
+def sorted_midranks(scores: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Sort order of every row of ``scores`` (m, n) and the 1-based midranks in that order."""
+    order = np.argsort(scores, axis=1)
+    ranked = np.take_along_axis(scores, order, axis=1)
+    starts = np.ones(ranked.shape, dtype=bool)
+    starts[:, 1:] = ranked[:, 1:] != ranked[:, :-1]
+    return order, run_midranks(starts)
+
+
+def midranks(scores: np.ndarray) -> np.ndarray:
+    """1-based midranks of every row of ``scores`` (m, n), in the original column order."""
+    scores = np.atleast_2d(np.asarray(scores, dtype=np.float64))
+    order, ranks = sorted_midranks(scores)
+    out = np.empty_like(ranks)
+    np.put_along_axis(out, order, ranks, axis=1)
+    return out
+
+
+def auc_rows(y: np.ndarray, scores: np.ndarray) -> np.ndarray:
+    """AUROC of every row of ``scores`` (m, n) against binary ``y`` (n,); NaN if ``y`` has one class."""
+    y = np.asarray(y).astype(bool)
+    scores = np.atleast_2d(np.asarray(scores, dtype=np.float64))
+    n = len(y)
+    n_pos = int(y.sum())
+    n_neg = n - n_pos
+    if n_pos == 0 or n_neg == 0:
+        return np.full(scores.shape[0], np.nan)
+
+    order, ranks = sorted_midranks(scores)
+    rank_sum = np.where(y[order], ranks, 0.0).sum(axis=1)
+    return (rank_sum - n_pos * (n_pos + 1) / 2.0) / (n_pos * n_neg)
+
+
+def group_auc_rows(y: np.ndarray, scores: np.ndarray, codes: np.ndarray, n_groups: int | None = None) -> np.ndarray:
+    """
+    AUROC of every row of ``scores`` (m, n) within every group.
+
+    Each row is sorted by score and then, stably, by group code, so the
+    within-group midranks of all groups come from one pass over the row.
+
+    Args:
+        y: Binary labels (n,).
+        scores: (m, n) candidate scores.
+        codes: Group code of every column, 0..n_groups - 1.
+        n_groups: Number of groups; defaults to ``codes.max() + 1``.
+
+    Returns:
+        (m, n_groups) AUROCs; NaN for groups with one class.
+    """
+    y = np.asarray(y).astype(bool)
+    codes = np.asarray(codes, dtype=np.intp)
+    scores = np.atleast_2d(np.asarray(scores, dtype=np.float64))
+    m = scores.shape[0]
+    if n_groups is None:
+        n_groups = int(codes.max()) + 1 if len(codes) else 0
+    n_pos = np.bincount(codes, y, n_groups)
+    n_neg = np.bincount(codes, minlength=n_groups) - n_pos
+
+    order = np.argsort(scores, axis=1)
+    small_codes = codes.astype(np.min_scalar_type(max(n_groups - 1, 0)))  # radix sort for <= 16-bit codes
+    order = np.take_along_axis(order, np.argsort(small_codes[order], axis=1, kind="stable"), axis=1)
+    ranked = np.take_along_axis(scores, order, axis=1)
+    sorted_codes = np.sort(codes)
+    starts = np.ones(ranked.shape, dtype=bool)
+    starts[:, 1:] = (ranked[:, 1:] != ranked[:, :-1]) | (sorted_codes[1:] != sorted_codes[:-1])[None, :]
+    ranks = run_midranks(starts) - np.searchsorted(sorted_codes, sorted_codes)[None, :]
+
+    cell = (np.arange(m)[:, None] * n_groups + sorted_codes[None, :]).ravel()
+    rank_sum = np.bincount(cell, np.where(y[order], ranks, 0.0).ravel(), m * n_groups).reshape(m, n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = (rank_sum - n_pos * (n_pos + 1) / 2.0) / (n_pos * n_neg)
+    out[:, (n_pos == 0) | (n_neg == 0)] = np.nan
+    return out
+
+
+def auc(y: np.ndarray, score: np.ndarray) -> float:
+    return float(auc_rows(y, score)[0])
+
+
+def stack_components(components: Sequence[np.ndarray] | np.ndarray) -> np.ndarray:
+    if isinstance(components, np.ndarray) and components.ndim == 2:
+        return components.astype(np.float64, copy=False)
+    return np.column_stack([np.asarray(component, dtype=np.float64) for component in components])
+
+
+def mix(components: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Weighted sums ``weights @ components.T`` as an (m, n) matrix, one row per candidate.
+
+    Terms are added one component at a time, in order, so each row equals
+    ``sum(w * score for w, score in zip(weights, components))`` exactly.
+    """
+    weights = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+    out = np.zeros((weights.shape[0], components.shape[0]))
+    for j in range(components.shape[1]):
+        out += weights[:, j, None] * components[None, :, j]
+    return out
+
+
+def candidate_aucs(
+    y: np.ndarray,
+    components: Sequence[np.ndarray] | np.ndarray,
+    weights: np.ndarray,
+    block_elements: int = BLOCK_ELEMENTS,
+) -> np.ndarray:
+    """
+    AUROC of every weighted combination of the component scores.
+
+    Args:
+        y: Binary labels (n,).
+        components: k score vectors of length n, or an (n, k) matrix.
+        weights: (m, k) candidate weight rows.
+        block_elements: Upper bound on n * candidates scored per block.
+
+    Returns:
+        (m,) AUROC per candidate.
+    """
+    components = stack_components(components)
+    weights = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+    block = max(1, block_elements // max(len(components), 1))
+    return np.concatenate(
+        [auc_rows(y, mix(components, weights[start : start + block])) for start in range(0, len(weights), block)]
+    )
+
+
+def group_candidate_aucs(
+    y: np.ndarray,
+    components: Sequence[np.ndarray] | np.ndarray,
+    weights: np.ndarray,
+    codes: np.ndarray,
+    n_groups: int | None = None,
+    block_elements: int = BLOCK_ELEMENTS,
+) -> np.ndarray:
+    """Within-group AUROC of every weighted combination, (m, n_groups); see ``candidate_aucs``."""
+    components = stack_components(components)
+    weights = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+    block = max(1, block_elements // max(len(components), 1))
+    return np.concatenate(
+        [
+            group_auc_rows(y, mix(components, weights[start : start + block]), codes, n_groups)
+            for start in range(0, len(weights), block)
+        ]
+    )
+
+
+def best_candidate(
+    y: np.ndarray,
+    components: Sequence[np.ndarray] | np.ndarray,
+    weights: np.ndarray,
+) -> tuple[int, float]:
+    """Index and AUROC of the best candidate; the first one wins ties, as in a strict ``>`` scan."""
+    aucs = candidate_aucs(y, components, weights)
+    if np.isnan(aucs).all():
+        return 0, float("nan")
+    best = int(np.nanargmax(aucs))
+    return best, float(aucs[best])
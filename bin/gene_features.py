@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Gene-level CDS composition table built in one pass over all sequences.
+
+Each row holds length, GC, GC3, CpG density, the codon-usage vector and the
+effective number of codons (ENC, Wright 1990) of one gene's CDS together with
+the SHA-1 of the sequence and the size/mtime of its FASTA. Rebuilding reuses
+rows whose file is unchanged (or whose sequence hash still matches), so the
+table stays valid when FASTAs are corrected. Scripts needing gene-level
+covariates join this table instead of re-parsing FASTA files.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import warnings
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from config import codon_list, codon_to_amino_acid
+from seq_store import SUFFIXES, open_sequences
+
+
+DEFAULT_GENE_DIR = Path("/Users/cassie/Desktop/Gene")
+DEFAULT_OUTPUT = Path("Results/Revision/gene_features/gene_sequence_features.csv")
+BASES = ("A", "C", "G", "T")
+CODON_COLUMNS = [f"codon_{codon}" for codon in codon_list]
+META_COLUMNS = ["gene", "fasta_size", "fasta_mtime_ns", "seq_sha1"]
+DNA_CODON_INDEX = {codon.replace("U", "T"): idx for idx, codon in enumerate(codon_list)}
+
+SYNONYMOUS_FAMILIES: dict[str, list[int]] = defaultdict(list)
+for _idx, _codon in enumerate(codon_list):
+    if codon_to_amino_acid[_codon] != "*":
+        SYNONYMOUS_FAMILIES[codon_to_amino_acid[_codon]].append(_idx)
+
+
+def sequence_sha1(sequence: str) -> str:
+    return hashlib.sha1(sequence.encode()).hexdigest()
+
+
+def effective_number_of_codons(counts: np.ndarray) -> float:
+    """Wright's ENC from 64 codon counts in ``codon_list`` order."""
+    homozygosity: dict[int, list[float]] = defaultdict(list)
+    for idxs in SYNONYMOUS_FAMILIES.values():
+        k = len(idxs)
+        n = counts[idxs].sum()
+        if k == 1 or n < 2:
+            continue
+        p = counts[idxs] / n
+        homozygosity[k].append((n * np.sum(p**2) - 1) / (n - 1))
+    f = {k: float(np.mean(v)) for k, v in homozygosity.items()}
+    if 3 not in f and 2 in f and 4 in f:
+        f[3] = (f[2] + f[4]) / 2
+    if any(k not in f or f[k] <= 0 for k in (2, 3, 4, 6)):
+        return np.nan
+    return float(min(61.0, 2 + 9 / f[2] + 1 / f[3] + 5 / f[4] + 3 / f[6]))
+
+
+def sequence_features(sequence: str) -> dict[str, object]:
+    clean = "".join(base for base in sequence if base in BASES)
+    counts = np.zeros(64)
+    gc3 = n_codons = 0
+    for i in range(0, len(sequence) - 2, 3):
+        idx = DNA_CODON_INDEX.get(sequence[i : i + 3])
+        if idx is None:
+            continue
+        counts[idx] += 1
+        n_codons += 1
+        gc3 += sequence[i + 2] in {"G", "C"}
+    out: dict[str, object] = {
+        "cds_length": len(sequence),
+        "n_codons": n_codons,
+        "gene_gc": (clean.count("G") + clean.count("C")) / len(clean) if clean else np.nan,
+        "gene_gc3": gc3 / n_codons if n_codons else np.nan,
+        "gene_cpg_density": clean.count("CG") / max(len(clean) - 1, 1) if clean else np.nan,
+        "enc": effective_number_of_codons(counts),
+    }
+    out.update(dict(zip(CODON_COLUMNS, counts.astype(int))))
+    return out
+
+
+def build_gene_features(gene_dir: Path, cached: pd.DataFrame | None = None) -> tuple[pd.DataFrame, dict[str, int]]:
+    sequences = open_sequences(gene_dir, SUFFIXES["cds"])
+    previous = {} if cached is None else {str(row["gene"]): row for _, row in cached.iterrows()}
+    rows = []
+    counts = {"reused": 0, "rehashed": 0, "computed": 0}
+    for gene in sequences.genes():
+        stat = sequences.file(gene).stat()
+        old = previous.get(gene)
+        if old is not None and int(old["fasta_size"]) == stat.st_size and int(old["fasta_mtime_ns"]) == stat.st_mtime_ns:
+            rows.append(old.to_dict())
+            counts["reused"] += 1
+            continue
+        sequence = sequences.get(gene).replace("U", "T")
+        digest = sequence_sha1(sequence)
+        if old is not None and old["seq_sha1"] == digest:
+            row = old.to_dict()
+            counts["rehashed"] += 1
+        else:
+            row = {"gene": gene, "seq_sha1": digest, **sequence_features(sequence)}
+            counts["computed"] += 1
+        row.update({"fasta_size": stat.st_size, "fasta_mtime_ns": stat.st_mtime_ns})
+        rows.append(row)
+    table = pd.DataFrame(rows)
+    if not table.empty:
+        table = table[META_COLUMNS + [col for col in table.columns if col not in META_COLUMNS]]
+    return table, counts
+
+
+def load_gene_features(path: Path, gene_dir: Path) -> pd.DataFrame:
+    """
+    Read the persisted table, revalidated against ``gene_dir``.
+
+    Rows are checked like a rebuild (FASTA size/mtime, then sequence SHA-1),
+    so corrected, added or removed FASTAs are picked up; the table is
+    rewritten only when a row changed. Builds it on first use. Without
+    ``gene_dir`` the persisted table is returned unvalidated, with a warning.
+    """
+    cached = pd.read_csv(path) if path.exists() else None
+    if not Path(gene_dir).is_dir():
+        if cached is None:
+            raise FileNotFoundError(f"No gene feature table at {path} and no FASTA directory {gene_dir}")
+        warnings.warn(f"{gene_dir} not found; using {path} without checking it against the FASTAs")
+        return cached
+    table, counts = build_gene_features(gene_dir, cached)
+    if cached is None or counts["reused"] != len(table) or len(cached) != len(table):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        table.to_csv(path, index=False)
+    return table
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gene-dir", type=Path, default=DEFAULT_GENE_DIR)
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    parser.add_argument("--force", action="store_true", help="Recompute every gene instead of reusing cached rows.")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    cached = pd.read_csv(args.output) if args.output.exists() and not args.force else None
+    table, counts = build_gene_features(args.gene_dir, cached)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    table.to_csv(args.output, index=False)
+    print(f"{len(table)} genes: {counts['reused']} reused, {counts['rehashed']} unchanged after rehash, {counts['computed']} computed")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""2-bit packed CDS store with precomputed codon and amino-acid index arrays.
+
+Every CDS is stored as 2-bit base codes in ``config.codon_list`` base order
+(A=0, U/T=1, C=2, G=3), four bases per byte, each gene starting on a byte
+boundary. Alongside the packed bases the store keeps, per gene, the codon
+index array (0-63, -1 for codons with an ambiguous base) and the translated
+amino-acid index array (``snv_engine.AA_ORDER``, -1 for invalid codons), all
+concatenated into flat arrays with offsets. The whole human CDS set fits in a
+few tens of MB, so the store is loaded into RAM once and the ref codon at a
+site, or the mutant codon after an SNV, is an integer array lookup.
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from seq_store import SUFFIXES, open_sequences
+from snv_engine import AA_ORDER, BASES, CODON_AA, INVALID_BASE, codons_from_bases, encode_bases
+
+
+SHIFTS = np.array([6, 4, 2, 0], dtype=np.uint8)
+DNA_BASES = np.array([base.replace("U", "T") for base in BASES] + ["N"], dtype="<U1")
+
+
+def pack_bases(codes: np.ndarray) -> np.ndarray:
+    """Pack base codes four to a byte; invalid bases are packed as A and tracked separately."""
+    padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+    padded[: len(codes)] = np.where(codes < INVALID_BASE, codes, 0)
+    quads = padded.reshape(-1, 4)
+    return (quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | quads[:, 3]
+
+
+def unpack_bases(packed: np.ndarray, n: int) -> np.ndarray:
+    return ((packed[:, None] >> SHIFTS) & 3).ravel()[:n]
+
+
+def translate(codons: np.ndarray) -> np.ndarray:
+    return np.where(codons >= 0, CODON_AA[np.maximum(codons, 0)], -1).astype(np.int8)
+
+
+class PackedCDS:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with np.load(self.path) as data:
+            self.names = data["genes"].astype(str)
+            self.lengths = data["lengths"]
+            self.byte_offsets = data["byte_offsets"]
+            self.codon_offsets = data["codon_offsets"]
+            self.packed = data["packed"]
+            self.all_codons = data["codons"]
+            self.all_amino_acids = data["amino_acids"]
+            self.invalid = data["invalid"]
+        self.index = {gene: i for i, gene in enumerate(self.names)}
+
+    def __contains__(self, gene: str) -> bool:
+        return gene in self.index
+
+    def genes(self) -> list[str]:
+        return self.names.tolist()
+
+    def length(self, gene: str) -> int:
+        return int(self.lengths[self.index[gene]])
+
+    def bases(self, gene: str) -> np.ndarray:
+        """Base codes of the CDS; ambiguous bases come back as ``INVALID_BASE``."""
+        i = self.index[gene]
+        codes = unpack_bases(self.packed[self.byte_offsets[i] : self.byte_offsets[i + 1]], int(self.lengths[i]))
+        start = 4 * int(self.byte_offsets[i])
+        hits = self.invalid[(self.invalid >= start) & (self.invalid < start + len(codes))] - start
+        codes[hits] = INVALID_BASE
+        return codes
+
+    def codons(self, gene: str) -> np.ndarray:
+        i = self.index[gene]
+        return self.all_codons[self.codon_offsets[i] : self.codon_offsets[i + 1]]
+
+    def amino_acids(self, gene: str) -> np.ndarray:
+        i = self.index[gene]
+        return self.all_amino_acids[self.codon_offsets[i] : self.codon_offsets[i + 1]]
+
+    def get(self, gene: str) -> str:
+        return "".join(DNA_BASES[self.bases(gene)])
+
+    def get_many(self, genes: list[str]) -> dict[str, str]:
+        return {gene: self.get(gene) for gene in genes if gene in self}
+
+    def protein(self, gene: str) -> str:
+        aa = np.array(list(AA_ORDER) + ["X"])
+        return "".join(aa[self.amino_acids(gene)])
+
+    def ref_codons(self, gene: str, sites: np.ndarray) -> np.ndarray:
+        """Codon index at 1-based amino-acid sites; out-of-range sites map to -1."""
+        codons = self.codons(gene)
+        sites = np.asarray(sites, dtype=np.int64) - 1
+        ok = (sites >= 0) & (sites < len(codons))
+        return np.where(ok, codons[np.where(ok, sites, 0)], -1).astype(np.int16)
+
+    def mutant_codons(self, gene: str, nc_sites: np.ndarray, alt_bases: np.ndarray) -> np.ndarray:
+        """
+        Codon index after substituting ``alt_bases`` at 1-based CDS positions.
+
+        Args:
+            gene: Gene in the store.
+            nc_sites: 1-based nucleotide positions within the CDS.
+            alt_bases: Alternative base codes (``BASES`` order).
+
+        Returns:
+            int16 codon indices; -1 when the site, ref codon or base is invalid.
+        """
+        nc = np.asarray(nc_sites, dtype=np.int64) - 1
+        alt = np.asarray(alt_bases, dtype=np.int16)
+        ref = self.ref_codons(gene, nc // 3 + 1)
+        place = 4 ** (2 - nc % 3)
+        old = (ref // place) % 4
+        mut = ref + (alt - old) * place
+        return np.where((ref >= 0) & (nc >= 0) & (alt >= 0) & (alt < INVALID_BASE), mut, -1).astype(np.int16)
+
+
+def build_packed_cds(sequences, output: Path) -> int:
+    genes = sequences.genes()
+    lengths = np.zeros(len(genes), dtype=np.int64)
+    byte_offsets = np.zeros(len(genes) + 1, dtype=np.int64)
+    codon_offsets = np.zeros(len(genes) + 1, dtype=np.int64)
+    packed, codons, invalid = [], [], []
+    for i, gene in enumerate(genes):
+        codes = encode_bases(sequences.get(gene))
+        lengths[i] = len(codes)
+        invalid.append(np.flatnonzero(codes == INVALID_BASE) + 4 * byte_offsets[i])
+        packed.append(pack_bases(codes))
+        codons.append(codons_from_bases(codes).astype(np.int8))
+        byte_offsets[i + 1] = byte_offsets[i] + len(packed[-1])
+        codon_offsets[i + 1] = codon_offsets[i] + len(codons[-1])
+    all_codons = np.concatenate(codons) if codons else np.zeros(0, dtype=np.int8)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(
+        output,
+        genes=np.array(genes, dtype=str),
+        lengths=lengths,
+        byte_offsets=byte_offsets,
+        codon_offsets=codon_offsets,
+        packed=np.concatenate(packed) if packed else np.zeros(0, dtype=np.uint8),
+        codons=all_codons,
+        amino_acids=translate(all_codons),
+        invalid=np.concatenate(invalid) if invalid else np.zeros(0, dtype=np.int64),
+    )
+    return len(genes)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--gene-dir",
+        type=Path,
+        default=Path("data/Gene"),
+        help="Directory of {gene}.fasta files or a packed cds.fa store.",
+    )
+    parser.add_argument("--output", type=Path, default=Path("data/SeqStore/cds_2bit.npz"))
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    n = build_packed_cds(open_sequences(args.gene_dir, SUFFIXES["cds"]), args.output)
+    size = args.output.stat().st_size / 2**20
+    print(f"Packed {n} CDS into {args.output} ({size:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
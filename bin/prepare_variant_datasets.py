@@ -1,80 +1,166 @@
+import numpy as np
 import pandas as pd
 
-
-def load_clinvar_data(file_path):
-    """Load ClinVar Figure from a compressed TSV file."""
-    return pd.read_csv(file_path, sep='\t')
+# Columns kept from variant_summary.txt(.gz); the rest of the release is never parsed.
+USECOLS = [
+    '#AlleleID', 'Type', 'Name', 'GeneID', 'GeneSymbol', 'ClinicalSignificance', 'ClinSigSimple',
+    'LastEvaluated', 'RS# (dbSNP)', 'PhenotypeList', 'OriginSimple', 'Assembly', 'Chromosome',
+    'Start', 'Stop', 'ReferenceAlleleVCF', 'AlternateAlleleVCF', 'ReviewStatus',
+    'NumberSubmitters', 'VariationID',
+]
+DTYPES = {
+    '#AlleleID': 'Int64', 'GeneID': 'Int64', 'ClinSigSimple': 'Int8', 'RS# (dbSNP)': 'Int64',
+    'Start': 'Int64', 'Stop': 'Int64', 'NumberSubmitters': 'Int32', 'VariationID': 'Int64',
+    'GeneSymbol': 'category', 'LastEvaluated': 'category',
+    'Type': 'category', 'ClinicalSignificance': 'category', 'ReviewStatus': 'category',
+    'OriginSimple': 'category', 'Assembly': 'category', 'Chromosome': 'category',
+}
+CHUNK_SIZE = 200_000
+
+GERMLINE_CLASSIFICATIONS = ['Benign', 'Likely benign', 'Likely pathogenic', 'Pathogenic']
+VARIATION_TYPE = 'single nucleotide variant'
+REVIEW_STATUS_PATTERN = (
+    'criteria provided, multiple submitters, no conflicts|criteria provided, single submitter'
+    '|reviewed by expert panel|practice guideline'
+)
+HGVS_PATTERN = r'NM_\d+\.\d+\([A-Za-z0-9]+\):c\.\d+[A-Z]?>[A-Z]?\s\(p\.[A-Za-z0-9]+\)'
+TRANSCRIPT_GENE_PATTERN = r'(NM_\d+\.\d+)\(([A-Za-z0-9]+)\)'
+
+
+def load_clinvar_data(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Stream ClinVar variant_summary in chunks.
+
+    Only ``USECOLS`` are parsed, with the compact dtypes in ``DTYPES`` and the
+    remaining columns as strings (so a chunk where a text column is empty does
+    not come back as float); gzip compression is inferred from the file name.
+
+    Args:
+    - file_path (str): Path to variant_summary.txt or variant_summary.txt.gz.
+    - chunk_size (int): Rows per chunk.
+
+    Returns:
+    - Iterator of pd.DataFrame chunks.
+    """
+    header = pd.read_csv(file_path, sep='\t', nrows=0).columns
+    usecols = [col for col in USECOLS if col in header]
+    dtypes = {col: DTYPES.get(col, str) for col in usecols}
+    return pd.read_csv(file_path, sep='\t', usecols=usecols, dtype=dtypes, chunksize=chunk_size)
+
+
+def contains(series, pattern):
+    """Case-insensitive regex match; on categoricals the pattern is tested once per category."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        hits = series.cat.categories.astype(str).str.contains(pattern, case=False, na=False)
+        return pd.Series(np.append(hits, False)[series.cat.codes.to_numpy()], index=series.index)
+    return series.str.contains(pattern, case=False, na=False)
 
 
 def filter_clinvar_data(df):
     """Filter ClinVar Figure based on specific criteria."""
+    return df[
+        (df['ClinicalSignificance'].isin(GERMLINE_CLASSIFICATIONS)) &  # Filter classification
+        (contains(df['Type'], VARIATION_TYPE)) &  # Single nucleotide variation
+        (contains(df['ReviewStatus'], REVIEW_STATUS_PATTERN))
+    ]
 
-    germline_classifications = ['Benign', 'Likely benign', 'Likely pathogenic', 'Pathogenic']
-    variation_type = 'single nucleotide variant'
-
-    filtered_df = df[
-        (df['ClinicalSignificance'].isin(germline_classifications)) &  # Filter classification
-        (df['Type'].str.contains(variation_type, case=False, na=False)) &  # Single nucleotide variation
-        (
-                (df['ReviewStatus'].str.contains('criteria provided, multiple submitters, no conflicts',
-                                                 case=False, na=False)) |
-                (df['ReviewStatus'].str.contains('criteria provided, single submitter',
-                                                 case=False, na=False)) |
-                (df['ReviewStatus'].str.contains('reviewed by expert panel',
-                                                 case=False, na=False)) |
-                (df['ReviewStatus'].str.contains('practice guideline',
-                                                 case=False, na=False))
-        )
-        ]
-
-    return filtered_df
-
-
-# Extract transcript and gene info
-def extract_transcript_gene(filtered_df, output_filtered_file):
-    """Extract transcript and gene symbol from the Name column."""
-    # Define the regular expression pattern for the type of annotation you're looking for
-    pattern = r'NM_\d+\.\d+\([A-Za-z0-9]+\):c\.\d+[A-Z]?>[A-Z]?\s\(p\.[A-Za-z0-9]+\)'
-
-    # Filter the dataframe based on the regex pattern in the "Name" column
-    filtered_df = filtered_df[filtered_df['Name'].str.contains(pattern, regex=True, na=False)]
-    save_filtered_data(filtered_df, output_filtered_file)
-    print(f"Filtered Figure has been saved to {output_filtered_file}")
 
-    # Define the regex pattern to extract transcript and gene symbol
-    transcript_gene_pattern = r'(NM_\d+\.\d+)\(([A-Za-z0-9]+)\)'
+def filter_hgvs_names(df):
+    """Keep rows whose Name is a RefSeq coding SNV with a protein change."""
+    return df[df['Name'].str.contains(HGVS_PATTERN, regex=True, na=False)]
 
-    # Extract transcript and gene symbol
-    df_transcript_info = filtered_df['Name'].str.extract(transcript_gene_pattern, expand=True)
 
-    # Rename columns for clarity
+def extract_transcript_gene(filtered_df):
+    """Extract transcript and gene symbol from the Name column."""
+    df_transcript_info = filtered_df['Name'].str.extract(TRANSCRIPT_GENE_PATTERN, expand=True)
     df_transcript_info.columns = ['Transcript', 'Gene']
-
-    # Merge with original dataframe
-    df_combined = pd.concat([filtered_df, df_transcript_info], axis=1)
-
-    # Remove duplicates based on the Transcript and Gene columns
-    df_deduplicated = df_combined.drop_duplicates(subset=['Transcript', 'Gene'])
-
-    return df_deduplicated
-
-
-# Save filtered Figure to a new CSV file
-def save_filtered_data(filtered_df, output_file):
-    """Save the filtered Figure to a new CSV file."""
-    filtered_df.to_csv(output_file, index=False)
+    return pd.concat([filtered_df, df_transcript_info], axis=1)
+
+
+def parquet_schema(columns):
+    """Arrow schema of the filtered rows: the integer ``DTYPES`` as nullable ints, everything else as strings."""
+    import pyarrow as pa
+
+    return pa.schema([
+        (col, pa.string() if DTYPES.get(col, 'category') == 'category' else pa.type_for_alias(DTYPES[col].lower()))
+        for col in columns
+    ])
+
+
+class FilteredDataWriter:
+    """Append filtered chunks to a Parquet file (or CSV if the name ends in .csv)."""
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.writer = None
+        self.n_rows = 0
+
+    def write(self, df):
+        if self.output_file.endswith('.csv'):
+            df.to_csv(self.output_file, mode='w' if self.n_rows == 0 else 'a', header=self.n_rows == 0, index=False)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            # Categories differ between chunks, so write plain strings; the schema is fixed
+            # from the column list, not inferred from whichever chunk comes first.
+            plain = df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.output_file, parquet_schema(df.columns))
+            self.writer.write_table(pa.Table.from_pandas(plain, schema=self.writer.schema, preserve_index=False))
+        self.n_rows += len(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def prepare_clinvar(file_path, output_filtered_file, chunk_size=CHUNK_SIZE):
+    """
+    Filter the release chunk by chunk and collect one row per transcript/gene.
+
+    Filtered rows are written to ``output_filtered_file`` as they are produced,
+    so peak memory is one chunk plus the deduplicated transcript table.
+
+    Args:
+    - file_path (str): Path to variant_summary.txt(.gz).
+    - output_filtered_file (str): Parquet (or .csv) file for the filtered rows.
+    - chunk_size (int): Rows per chunk.
+
+    Returns:
+    - pd.DataFrame: First filtered row for each (Transcript, Gene) pair.
+    """
+    writer = FilteredDataWriter(output_filtered_file)
+    seen = set()
+    first_rows = []
+    n_read = 0
+    try:
+        for chunk in load_clinvar_data(file_path, chunk_size):
+            n_read += len(chunk)
+            filtered = filter_hgvs_names(filter_clinvar_data(chunk))
+            if filtered.empty:
+                continue
+            writer.write(filtered)
+            combined = extract_transcript_gene(filtered).drop_duplicates(subset=['Transcript', 'Gene'])
+            keys = list(zip(combined['Transcript'], combined['Gene']))
+            new = [key not in seen for key in keys]
+            seen.update(keys)
+            first_rows.append(combined[new])
+    finally:
+        writer.close()
+    print(f"Read {n_read} rows; kept {writer.n_rows} filtered rows in {output_filtered_file}")
+    if not first_rows:
+        return pd.DataFrame(columns=['Transcript', 'Gene'])
+    return pd.concat(first_rows, ignore_index=True)
 
 
 if __name__ == "__main__":
     file_path = "./Figure/variant_summary.txt"
-    output_filtered_file = 'filtered_clinvar_data.csv'
+    output_filtered_file = 'filtered_clinvar_data.parquet'
     output_grouped_sorted_file = "clinvar_gene_info.csv"
 
-    clinvar_df = load_clinvar_data(file_path)
-
-    filtered_clinvar_df = filter_clinvar_data(clinvar_df)
-
-    df_deduplicated = extract_transcript_gene(filtered_clinvar_df, output_filtered_file)
+    df_deduplicated = prepare_clinvar(file_path, output_filtered_file)
+    print(f"Filtered Figure has been saved to {output_filtered_file}")
 
     df_grouped_sorted = df_deduplicated.sort_values(by=['Gene'], ascending=True)[['Gene', 'Transcript']]
 
@@ -1,4 +1,4 @@
-from bin.score_calm_codon_logits import read_fasta_nuc
+from bin.seq_store import read_records
 from bin.config import codon_list
 import pandas as pd
 import numpy as np
@@ -137,7 +137,7 @@ def calculate_llr(row: pd.Series,
 
     # Read wild-type cDNA sequence from a FASTA file
     seq_path = f"./data/Gene/{gene}.fasta"
-    sequence = read_fasta_nuc(seq_path)[0][1]
+    sequence = read_records(seq_path)[0][1]
 
     # Get reference codon
     ref_codon = split_into_codons(sequence)[aasite - 1].replace('T', 'U')
@@ -1,4 +1,5 @@
-from typing import List, Tuple, Union
+import argparse
+from typing import Union
 from calm.sequence import CodonSequence
 import torch.nn.functional as F
 from calm import CaLM
@@ -7,6 +8,9 @@ import pandas as pd
 import csv
 import torch
 
+from seq_store import read_records
+from shards import add_shard_args, partition_genes
+
 
 class CaLMPluS(CaLM):
 
@@ -42,45 +46,31 @@ class CaLMPluS(CaLM):
             return logits.detach().cpu().numpy()
 
 
-def read_fasta_nuc(file_path: str) -> List[Tuple[str, str]]:
-    """
-    Reads nucleotide sequences from a FASTA file and returns a list of tuples containing IDs and sequences.
-
-    Args:
-        file_path (str): Path to the FASTA file.
-
-    Returns:
-        List[Tuple[str, str]]: A list of tuples where each tuple contains an ID and its corresponding nucleotide sequence.
-    """
-    sequences: List[Tuple[str, str]] = []
-    current_id: str = ""
-    current_sequence: List[str] = []
-
-    with open(file_path, 'r') as fasta_file:
-        for line in fasta_file:
-            line = line.strip()
-            if line.startswith(">"):
-                if current_id:
-                    sequences.append((current_id, "".join(current_sequence)))
-                current_id = line[1:]
-                current_sequence = []
-            else:
-                current_sequence.append(line)
-
-        if current_id:
-            sequences.append((current_id, "".join(current_sequence)))
-
-    return sequences
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Write per-codon CaLM probabilities for every gene; --shard slices write disjoint gene files."
+    )
+    add_shard_args(parser)
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    calm = CaLMPluS()
+    args = parse_args()
     gene_list = pd.read_csv("../bin/gene_info.txt", sep="\t", header=None)[0].tolist()
+    if args.shard is not None:
+        index, count = args.shard
+        lengths = None
+        if args.shard_strategy == "length":
+            lengths = {gene: len(read_records(f"../data/Gene/{gene}.fasta")[0][1]) for gene in gene_list}
+        assigned = set(partition_genes(gene_list, count, args.shard_strategy, lengths)[index])
+        gene_list = [gene for gene in gene_list if gene in assigned]
+        print(f"Slice {index}/{count}: {len(gene_list)} genes")
+    calm = CaLMPluS()
 
     for gene in gene_list:
 
         seq_path = f"../data/Gene/{gene}.fasta"
-        sequence = read_fasta_nuc(seq_path)[0][1]
+        sequence = read_records(seq_path)[0][1]
         # remove the start token and end token
         logits = calm.get_logits(sequence)[:, 1:-1, ]
 
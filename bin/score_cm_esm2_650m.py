@@ -5,7 +5,6 @@
 from __future__ import annotations
 
 import argparse
-import csv
 from pathlib import Path
 
 import numpy as np
@@ -14,21 +13,18 @@ import torch
 import torch.nn.functional as F
 from esm import pretrained
 
+from seq_store import SUFFIXES, open_sequences
+from shards import add_shard_args, claim_shard, content_hash, describe_plan, open_store, plan_rescoring
+from variant_keys import GENE_IDS, GeneDictionary, encode_variant_keys
+
 
 AA_COLS = list("ACDEFGHIKLMNPQRSTVWY")
+MODEL_NAME = "esm2_t33_650M_UR50D"
 DEFAULT_INPUT_GLOB = "Results/ClinMAVE/*/missense/*_LLR_results.csv"
 DEFAULT_PROTEIN_DIR = Path("/Users/cassie/Desktop/Protein")
 DEFAULT_OUT_DIR = Path("Results/Revision/ClinMAVE_ESM2_650M")
 
 
-def read_fasta(path: Path) -> str:
-    return "".join(
-        line.strip().upper()
-        for line in path.read_text().splitlines()
-        if line.strip() and not line.startswith(">")
-    )
-
-
 def load_inputs(pattern: str) -> pd.DataFrame:
     paths = sorted(Path(".").glob(pattern))
     if not paths:
@@ -50,36 +46,29 @@ def load_inputs(pattern: str) -> pd.DataFrame:
     return out
 
 
-def variant_key(row: pd.Series) -> str:
-    return "|".join(
-        [
-            str(row["Gene"]),
-            str(int(row["Site"])),
-            str(row["Ref"]),
-            str(row["Mut"]),
-        ]
-    )
+def variant_key(df: pd.DataFrame, genes: GeneDictionary) -> pd.arrays.IntegerArray:
+    return encode_variant_keys(genes, df["Gene"], df["Site"], df["Ref"], df["Mut"])
 
 
-def make_variant_table(df: pd.DataFrame, protein_dir: Path, max_len: int) -> pd.DataFrame:
-    variants = (
-        df.dropna(subset=["Gene", "Site", "Ref", "Mut"])
-        .drop_duplicates(subset=["Gene", "Site", "Ref", "Mut"])
-        .copy()
-    )
+def make_variant_table(df: pd.DataFrame, sequences, max_len: int, genes: GeneDictionary) -> pd.DataFrame:
+    variants = df.dropna(subset=["Gene", "Site", "Ref", "Mut"]).copy()
+    variants["variant_key"] = variant_key(variants, genes)
+    keyed = variants["variant_key"].notna()
+    # Unrecognised residues have no key; deduplicate them on the raw columns instead.
+    variants = pd.concat(
+        [
+            variants[keyed].drop_duplicates(subset=["variant_key"]),
+            variants[~keyed].drop_duplicates(subset=["Gene", "Site", "Ref", "Mut"]),
+        ]
+    ).sort_index()
     rows = []
-    seq_cache: dict[str, str | None] = {}
+    seq_cache = sequences.get_many(variants["Gene"].astype(str).unique().tolist())
     for _, row in variants.iterrows():
-        gene = str(row["Gene"])
-        if gene not in seq_cache:
-            fasta = protein_dir / f"{gene}_protein.fasta"
-            seq_cache[gene] = read_fasta(fasta) if fasta.exists() else None
-        seq = seq_cache[gene]
+        seq = seq_cache.get(str(row["Gene"]))
         site = int(row["Site"])
         rows.append(
             {
                 **row.to_dict(),
-                "variant_key": variant_key(row),
                 "protein_length": len(seq) if seq is not None else np.nan,
                 "has_fasta": seq is not None,
                 "length_compatible": seq is not None and len(seq) <= max_len,
@@ -91,34 +80,16 @@ def make_variant_table(df: pd.DataFrame, protein_dir: Path, max_len: int) -> pd.
     return out
 
 
-def append_rows(path: Path, rows: list[dict[str, object]]) -> None:
-    if not rows:
-        return
-    path.parent.mkdir(parents=True, exist_ok=True)
-    write_header = not path.exists() or path.stat().st_size == 0
-    with path.open("a", newline="") as handle:
-        writer = csv.DictWriter(handle, fieldnames=list(rows[0].keys()))
-        if write_header:
-            writer.writeheader()
-        writer.writerows(rows)
-
-
-def load_done(path: Path) -> set[str]:
-    if not path.exists() or path.stat().st_size == 0:
-        return set()
-    return set(pd.read_csv(path, usecols=["variant_key"])["variant_key"].astype(str))
-
-
 def score_gene(
     model: torch.nn.Module,
     alphabet,
     batch_converter,
     gene: str,
     group: pd.DataFrame,
-    protein_dir: Path,
+    sequences,
     device: torch.device,
 ) -> list[dict[str, object]]:
-    sequence = read_fasta(protein_dir / f"{gene}_protein.fasta")
+    sequence = sequences.get(gene)
     _, _, tokens = batch_converter([(gene, sequence)])
     tokens = tokens.to(device)
     with torch.no_grad():
@@ -135,7 +106,7 @@ def score_gene(
         llr = float(log_probs[site - 1, aa_to_idx[mut]] - log_probs[site - 1, aa_to_idx[ref]])
         rows.append(
             {
-                "variant_key": row["variant_key"],
+                "variant_key": int(row["variant_key"]),
                 "Gene": gene,
                 "Site": site,
                 "Ref": ref,
@@ -148,6 +119,18 @@ def score_gene(
     return rows
 
 
+def gene_stamps(scorable: pd.DataFrame, sequences) -> dict[str, dict[str, object]]:
+    """Sequence, model and variant-set hashes for each gene with scorable variants."""
+    stamps = {}
+    for gene, group in scorable.groupby(scorable["Gene"].astype(str), sort=True):
+        stamps[gene] = {
+            "seq_hash": content_hash(sequences.get(gene)),
+            "model_hash": content_hash(MODEL_NAME),
+            "input_hash": content_hash(np.sort(group["variant_key"].to_numpy(dtype=np.int64))),
+        }
+    return stamps
+
+
 def choose_device(requested: str) -> torch.device:
     if requested != "auto":
         return torch.device(requested)
@@ -161,24 +144,43 @@ def choose_device(requested: str) -> torch.device:
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("--input-glob", default=DEFAULT_INPUT_GLOB)
-    parser.add_argument("--protein-dir", type=Path, default=DEFAULT_PROTEIN_DIR)
+    parser.add_argument(
+        "--protein-dir",
+        type=Path,
+        default=DEFAULT_PROTEIN_DIR,
+        help="Directory of {gene}_protein.fasta files or a packed protein.fa store.",
+    )
     parser.add_argument("--out-dir", type=Path, default=DEFAULT_OUT_DIR)
+    parser.add_argument(
+        "--gene-ids",
+        type=Path,
+        default=GENE_IDS,
+        help="Append-only gene dictionary used to pack variant_key values.",
+    )
+    parser.add_argument(
+        "--shard-dir",
+        type=Path,
+        default=None,
+        help="Per-gene score shards (default: <score table stem>_shards in --out-dir).",
+    )
     parser.add_argument("--max-len", type=int, default=1022)
     parser.add_argument("--device", default="auto")
     parser.add_argument("--max-genes", type=int, default=None)
     parser.add_argument("--report-every", type=int, default=10)
     parser.add_argument("--force", action="store_true")
+    add_shard_args(parser)
     args = parser.parse_args()
 
     args.out_dir.mkdir(parents=True, exist_ok=True)
     all_inputs = load_inputs(args.input_glob)
-    variant_table = make_variant_table(all_inputs, args.protein_dir, args.max_len)
+    sequences = open_sequences(args.protein_dir, SUFFIXES["protein"])
+    gene_ids = GeneDictionary(args.gene_ids)
+    variant_table = make_variant_table(all_inputs, sequences, args.max_len, gene_ids)
+    gene_ids.save()
     variant_table.to_csv(args.out_dir / "clinmave_missense_variant_audit.csv", index=False)
 
     score_path = args.out_dir / "clinmave_missense_esm2_650m_variant_scores.csv"
-    if args.force and score_path.exists():
-        score_path.unlink()
-    done = load_done(score_path)
+    store = open_store(score_path, "Gene", args.shard_dir, force=args.force, shard=args.shard)
     scorable = variant_table[
         variant_table["length_compatible"]
         & variant_table["site_in_range"]
@@ -186,12 +188,26 @@ def main() -> None:
         & variant_table["Ref"].isin(AA_COLS)
         & variant_table["Mut"].isin(AA_COLS)
     ].copy()
-    scorable = scorable[~scorable["variant_key"].astype(str).isin(done)]
-    genes = sorted(scorable["Gene"].astype(str).unique())
+    lengths = scorable.groupby(scorable["Gene"].astype(str))["protein_length"].first()
+    slice_genes = claim_shard(
+        store,
+        lengths.index.tolist(),
+        args.shard,
+        args.shard_strategy,
+        lengths.to_dict(),
+        content_hash(MODEL_NAME),
+        gene_ids.fingerprint(),
+    )
+    scorable = scorable[scorable["Gene"].astype(str).isin(slice_genes)]
+    stamps = gene_stamps(scorable, sequences)
+    plan = plan_rescoring(store, stamps)
+    print(f"Shards in {store.root}: {describe_plan(plan)}")
+    genes = sorted(plan["rescored"] + plan["new"])
     if args.max_genes is not None:
         genes = genes[: args.max_genes]
 
     audit = {
+        "shard": "" if args.shard is None else f"{args.shard[0]}/{args.shard[1]}",
         "input_rows": len(all_inputs),
         "unique_variants": len(variant_table),
         "scorable_unique_variants": int(
@@ -203,8 +219,9 @@ def main() -> None:
                 & variant_table["Mut"].isin(AA_COLS)
             ).sum()
         ),
-        "already_scored_variants": len(done),
-        "remaining_variants_this_run": len(scorable),
+        **{f"{category}_genes": len(plan[category]) for category in plan},
+        "already_scored_variants": store.n_rows(),
+        "remaining_variants_this_run": int(scorable["Gene"].astype(str).isin(genes).sum()),
         "remaining_genes_this_run": len(genes),
         "missing_fasta_variants": int((~variant_table["has_fasta"]).sum()),
         "length_incompatible_variants": int((variant_table["has_fasta"] & ~variant_table["length_compatible"]).sum()),
@@ -216,21 +233,29 @@ def main() -> None:
     if genes:
         device = choose_device(args.device)
         print(f"Loading ESM-2 650M on {device}...")
-        model, alphabet = pretrained.esm2_t33_650M_UR50D()
+        model, alphabet = getattr(pretrained, MODEL_NAME)()
         model.eval().to(device)
         batch_converter = alphabet.get_batch_converter()
         for idx, gene in enumerate(genes, start=1):
             group = scorable[scorable["Gene"].astype(str) == gene]
-            rows = score_gene(model, alphabet, batch_converter, gene, group, args.protein_dir, device)
-            append_rows(score_path, rows)
+            rows = score_gene(model, alphabet, batch_converter, gene, group, sequences, device)
+            store.write(gene, pd.DataFrame(rows), **stamps[gene], gene_id=gene_ids.ids[gene])
             if idx % args.report_every == 0 or idx == len(genes):
                 print(f"Scored {idx}/{len(genes)} genes; latest={gene}; variants_written={len(rows)}")
 
+    if args.shard is not None:
+        print(f"Scored slice {args.shard[0]}/{args.shard[1]} into {store.root}")
+        print(f"Combine all slices with: python bin/shards.py merge {score_path} <slice shard dirs>")
+        return
+    store.compact(score_path)
     scores = pd.read_csv(score_path) if score_path.exists() else pd.DataFrame()
     if not scores.empty:
         merged = all_inputs.copy()
-        merged["variant_key"] = merged.apply(variant_key, axis=1)
-        merged = merged.merge(scores, on="variant_key", how="left", suffixes=("", "_scored"))
+        merged["variant_key"] = variant_key(merged, gene_ids)
+        gene_ids.save()
+        merged = merged.merge(
+            scores, on="variant_key", how="left", suffixes=("", "_scored"), validate="many_to_one"
+        )
         merged.to_csv(args.out_dir / "clinmave_missense_all_with_esm2_650m.csv", index=False)
         for source, group in merged.groupby("source_file", sort=True):
             source_path = Path(source)
@@ -15,20 +15,38 @@ import pandas as pd
 import torch
 import torch.nn.functional as F
 
+from seq_store import SUFFIXES, open_sequences
+from shards import add_shard_args, claim_shard, content_hash, describe_plan, frame_hash, open_store, plan_rescoring
+from variant_keys import GENE_IDS, GeneDictionary, encode_variant_keys
 
 AA_ORDER = set("ACDEFGHIKLMNPQRSTVWY")
+MODEL_NAME = "esm2_t33_650M_UR50D"
 PATHOGENIC_LABELS = {"pathogenic", "likely_pathogenic"}
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument("--clinvar-dir", default="Results/ClinVar/missense")
-    parser.add_argument("--protein-dir", default="/Users/cassie/Desktop/Protein")
+    parser.add_argument(
+        "--protein-dir",
+        default="/Users/cassie/Desktop/Protein",
+        help="Directory of {gene}_protein.fasta files or a packed protein.fa store.",
+    )
     parser.add_argument("--cache-dir", default="Results/Revision/model_cache")
+    parser.add_argument(
+        "--gene-ids",
+        default=str(GENE_IDS),
+        help="Append-only gene dictionary used to pack variant_id keys.",
+    )
     parser.add_argument(
         "--output",
         default="Results/Revision/esm2_650m_full/clinvar_missense_esm2_650m_scores.csv",
     )
+    parser.add_argument(
+        "--shard-dir",
+        default=None,
+        help="Per-gene output shards (default: <output stem>_shards next to --output).",
+    )
     parser.add_argument(
         "--failed-output",
         default="Results/Revision/esm2_650m_full/failed_genes.csv",
@@ -63,6 +81,7 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Run shorter proteins first after applying label-count filters.",
     )
+    add_shard_args(parser)
     return parser.parse_args()
 
 
@@ -80,15 +99,7 @@ def choose_device(requested: str) -> torch.device:
     return torch.device("cpu")
 
 
-def read_fasta(path: Path) -> str:
-    return "".join(
-        line.strip().upper()
-        for line in path.read_text(errors="ignore").splitlines()
-        if not line.startswith(">")
-    )
-
-
-def load_clinvar(clinvar_dir: Path) -> pd.DataFrame:
+def load_clinvar(clinvar_dir: Path, genes: GeneDictionary) -> pd.DataFrame:
     files = [
         clinvar_dir / "missense_benign.csv",
         clinvar_dir / "missense_likely_benign.csv",
@@ -104,41 +115,13 @@ def load_clinvar(clinvar_dir: Path) -> pd.DataFrame:
     ).copy()
     df["Site_prot"] = df["Site_prot"].astype(int)
     df["label"] = df["Label_prot"].isin(PATHOGENIC_LABELS).astype(int)
-    df["variant_id"] = (
-        df["Gene_prot"].astype(str)
-        + ":"
-        + df["Site_prot"].astype(str)
-        + ":"
-        + df["Ref_prot"].astype(str)
-        + ">"
-        + df["Mut_prot"].astype(str)
-        + ":"
-        + df["Ref_gene"].astype(str)
-        + ">"
-        + df["Mut_gene"].astype(str)
+    df["variant_id"] = encode_variant_keys(
+        genes, df["Gene_prot"], df["Site_prot"], df["Ref_prot"], df["Mut_prot"], df["Ref_gene"], df["Mut_gene"]
     )
+    genes.save()
     return df
 
 
-def load_done_genes(output: Path) -> set[str]:
-    if not output.exists() or output.stat().st_size == 0:
-        return set()
-    try:
-        return set(pd.read_csv(output, usecols=["Gene_prot"])["Gene_prot"].astype(str).unique())
-    except Exception:
-        return set()
-
-
-def append_rows(output: Path, rows: list[dict[str, object]], fieldnames: list[str]) -> None:
-    output.parent.mkdir(parents=True, exist_ok=True)
-    write_header = not output.exists() or output.stat().st_size == 0
-    with output.open("a", newline="") as handle:
-        writer = csv.DictWriter(handle, fieldnames=fieldnames)
-        if write_header:
-            writer.writeheader()
-        writer.writerows(rows)
-
-
 def append_failure(failed_output: Path, gene: str, n_variants: int, seq_len: int | None, error: str) -> None:
     failed_output.parent.mkdir(parents=True, exist_ok=True)
     write_header = not failed_output.exists() or failed_output.stat().st_size == 0
@@ -160,7 +143,7 @@ def load_model(cache_dir: Path, device: torch.device):
     import esm
 
     torch.hub.set_dir(str(cache_dir / "torch_hub"))
-    model, alphabet = esm.pretrained.esm2_t33_650M_UR50D()
+    model, alphabet = getattr(esm.pretrained, MODEL_NAME)()
     model = model.eval().to(device)
     return model, alphabet, alphabet.get_batch_converter()
 
@@ -237,32 +220,56 @@ def filter_genes_by_label_counts(df: pd.DataFrame, min_pos: int, min_neg: int) -
     return set(keep.index.astype(str))
 
 
-def protein_lengths(genes: list[str], protein_dir: Path) -> dict[str, int]:
+def protein_lengths(genes: list[str], sequences) -> dict[str, int]:
     lengths = {}
     for gene in genes:
-        fasta = protein_dir / f"{gene}_protein.fasta"
-        if fasta.exists():
-            try:
-                lengths[gene] = len(read_fasta(fasta))
-            except Exception:
-                lengths[gene] = 10**9
-        else:
+        try:
+            lengths[gene] = sequences.length(gene) if gene in sequences else 10**9
+        except Exception:
             lengths[gene] = 10**9
     return lengths
 
 
+def gene_stamps(df: pd.DataFrame, genes: set[str], sequences) -> dict[str, dict[str, object]]:
+    """Sequence, model and input-variant hashes for each gene to be scored."""
+    stamps = {}
+    for gene, group in df.groupby(df["Gene_prot"].astype(str), sort=True):
+        if gene in genes:
+            stamps[gene] = {
+                "seq_hash": content_hash(sequences.get(gene)) if gene in sequences else None,
+                "model_hash": content_hash(MODEL_NAME),
+                "input_hash": frame_hash(group),
+            }
+    return stamps
+
+
 def main() -> None:
     args = parse_args()
     output = Path(args.output)
     failed_output = Path(args.failed_output)
     device = choose_device(args.device)
 
-    df = load_clinvar(Path(args.clinvar_dir))
-    done = load_done_genes(output)
+    gene_ids = GeneDictionary(Path(args.gene_ids))
+    df = load_clinvar(Path(args.clinvar_dir), gene_ids)
+    store = open_store(
+        output, "Gene_prot", None if args.shard_dir is None else Path(args.shard_dir), shard=args.shard
+    )
+    sequences = open_sequences(Path(args.protein_dir), SUFFIXES["protein"])
     eligible = filter_genes_by_label_counts(df, args.min_pos, args.min_neg)
-    genes = sorted(gene for gene in df["Gene_prot"].astype(str).unique() if gene in eligible and gene not in done)
+    cohort = sorted(gene for gene in df["Gene_prot"].astype(str).unique() if gene in eligible)
+    costs = None
+    if args.shard is not None and args.shard_strategy == "length":
+        costs = {gene: length for gene, length in protein_lengths(cohort, sequences).items() if length < 10**9}
+    eligible = set(
+        claim_shard(
+            store, cohort, args.shard, args.shard_strategy, costs, content_hash(MODEL_NAME), gene_ids.fingerprint()
+        )
+    )
+    stamps = gene_stamps(df, eligible, sequences)
+    plan = plan_rescoring(store, stamps)
+    genes = sorted(plan["rescored"] + plan["new"])
     if args.sort_by_length:
-        lengths = protein_lengths(genes, Path(args.protein_dir))
+        lengths = protein_lengths(genes, sequences)
         genes = sorted(genes, key=lambda gene: (lengths.get(gene, 10**9), gene))
     if args.max_genes > 0:
         genes = genes[: args.max_genes]
@@ -270,7 +277,7 @@ def main() -> None:
     print(
         f"Loaded {len(df)} variants across {df['Gene_prot'].nunique()} genes. "
         f"Filter min_pos={args.min_pos}, min_neg={args.min_neg}. "
-        f"{len(done)} genes already scored in output; {len(genes)} genes to run on {device}.",
+        f"Shards in {store.root}: {describe_plan(plan)}; {len(genes)} genes to run on {device}.",
         flush=True,
     )
 
@@ -302,20 +309,23 @@ def main() -> None:
     written_variants = 0
     for gene in genes:
         group = df[df["Gene_prot"].astype(str) == gene]
-        fasta = Path(args.protein_dir) / f"{gene}_protein.fasta"
         seq_len = None
         try:
-            if not fasta.exists():
-                raise FileNotFoundError(f"Missing FASTA: {fasta}")
-            sequence = read_fasta(fasta)
+            if gene not in sequences:
+                raise FileNotFoundError(f"Missing protein sequence for {gene} in {args.protein_dir}")
+            sequence = sequences.get(gene)
             seq_len = len(sequence)
             rows = score_gene(gene, group, sequence, model, alphabet, batch_converter, device)
             if rows:
-                append_rows(output, rows, fieldnames)
+                store.write(
+                    gene, pd.DataFrame(rows, columns=fieldnames), **stamps[gene], gene_id=gene_ids.ids[gene]
+                )
                 written_variants += len(rows)
             else:
+                store.remove(gene)
                 append_failure(failed_output, gene, len(group), seq_len, "No valid reference-matching variants")
         except Exception as exc:
+            store.remove(gene)
             append_failure(failed_output, gene, len(group), seq_len, repr(exc))
         finally:
             completed += 1
@@ -333,7 +343,12 @@ def main() -> None:
                 flush=True,
             )
 
-    print(f"Done. Wrote {written_variants} variants to {output}", flush=True)
+    if args.shard is not None:
+        print(f"Done. Scored {written_variants} variants this run into {store.root}", flush=True)
+        print(f"Combine all slices with: python bin/shards.py merge {output} <slice shard dirs>", flush=True)
+    else:
+        n_rows = store.compact(output)
+        print(f"Done. Scored {written_variants} variants this run; wrote {n_rows} variants to {output}", flush=True)
     print(f"Failures, if any, are in {failed_output}", flush=True)
 
 
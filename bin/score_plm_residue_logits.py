@@ -1,10 +1,13 @@
+import argparse
 import csv
 from typing import List, Tuple
 import pandas as pd
 import torch
 import torch.nn.functional as F
 import numpy as np
-from itertools import groupby
+
+from seq_store import read_records
+from shards import add_shard_args, partition_genes
 
 
 def load_esm_model(model_name: str):
@@ -14,25 +17,6 @@ def load_esm_model(model_name: str):
     return model.eval(), alphabet, batch_converter, repr_layer
 
 
-def read_fasta(file_path: str) -> List[Tuple[str, str]]:
-    """
-    Reads a FASTA file and returns a list of tuples containing protein names and sequences.
-
-    Args: file_path (str): Path to the FASTA file.
-
-    Returns: List[Tuple[str, str]]: A list of tuples where each tuple contains a protein name and its corresponding sequence.
-    """
-    with open(file_path, 'r') as fasta_file:
-        fasta_entries = groupby(fasta_file, lambda line: line.startswith(">"))
-
-        return [
-            (header[1:].strip(), ''.join(seq.strip() for seq in sequence_group).upper())
-            for is_header, header_lines in fasta_entries if is_header
-            for header in header_lines
-            for _, sequence_group in fasta_entries
-        ]
-
-
 def prepare_grammaticality_data(model_name: str,
                                 seq_path: str,
                                 output_csv_path: str):
@@ -51,7 +35,7 @@ def prepare_grammaticality_data(model_name: str,
 
     # Read protein sequence and get batch tokens
     # List of tuples (protein_name, sequence)
-    data: List[Tuple[str, str]] = read_fasta(seq_path)
+    data: List[Tuple[str, str]] = read_records(seq_path)
 
     batch_labels, batch_strs, batch_tokens = batch_converter(data)
     # Length of each sequence in the batch
@@ -77,8 +61,25 @@ def prepare_grammaticality_data(model_name: str,
             csv_writer.writerows(grammaticality)
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Write per-residue ESM-2 probabilities for every gene; --shard slices write disjoint gene files."
+    )
+    add_shard_args(parser)
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
     Gene_list = pd.read_csv("./bin/gene_info.txt", sep="\t", header=None)[0].tolist()
+    if args.shard is not None:
+        index, count = args.shard
+        lengths = None
+        if args.shard_strategy == "length":
+            lengths = {gene: len(read_records(f"./data/Protein/{gene}_protein.fasta")[0][1]) for gene in Gene_list}
+        assigned = set(partition_genes(Gene_list, count, args.shard_strategy, lengths)[index])
+        Gene_list = [gene for gene in Gene_list if gene in assigned]
+        print(f"Slice {index}/{count}: {len(Gene_list)} genes")
     model_name = "esm2_t30_150M_UR50D"
 
     for gene in Gene_list:
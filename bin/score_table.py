@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""Columnar storage for the canonical ClinVar score table.
+
+The merged score table written by ``cv_model_control.py`` is stored as
+Parquet with an explicit schema: identifiers and labels as strings, sites and
+lengths as int32, ``label`` as int8, the packed ``variant_id`` as int64 and
+every LLR/score column as float64. Rows are grouped by ``Gene_prot`` and a
+row group never splits a gene, so a gene filter skips whole row groups from
+their statistics. A hidden ``_row`` column keeps the original row order, so
+loaded tables (and the folds drawn from them) match the CSV exactly.
+
+``load_score_table`` reads only the requested columns and genes, and falls
+back to a same-stem CSV when no Parquet file exists. pyarrow is imported
+lazily so CSV-only environments keep working.
+
+``compact_dtypes`` shrinks a loaded table for analysis (categorical
+identifiers, int32 sites, float32 scores) and ``MemoryAudit`` records the
+row count and deep memory use of the tables held at each pipeline stage.
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+GENE_COLUMN = "Gene_prot"
+ROW_COLUMN = "_row"
+ROW_GROUP_ROWS = 50_000
+COLUMN_TYPES = {
+    "Gene_prot": "string",
+    "Gene_gene": "string",
+    "Label_prot": "string",
+    "Label_gene": "string",
+    "Ref_prot": "string",
+    "Mut_prot": "string",
+    "Ref_gene": "string",
+    "Mut_gene": "string",
+    "Site_prot": "int32",
+    "Site_gene": "int32",
+    "protein_length": "int32",
+    "label": "int8",
+    "variant_id": "int64",
+}
+FLOAT_SUFFIXES = ("_llr", "_score", "LLR_prot", "LLR_gene")
+CATEGORY_COLUMNS = [
+    "Gene_prot",
+    "Gene_gene",
+    "Label_prot",
+    "Label_gene",
+    "Ref_prot",
+    "Mut_prot",
+    "Ref_gene",
+    "Mut_gene",
+]
+SITE_COLUMNS = ["Site_prot", "Site_gene", "protein_length"]
+
+
+def column_type(name: str):
+    import pyarrow as pa
+
+    kind = COLUMN_TYPES.get(name)
+    if kind is None and name.endswith(FLOAT_SUFFIXES):
+        kind = "float64"
+    if kind is None:
+        return None
+    return pa.string() if kind == "string" else pa.from_numpy_dtype(np.dtype(kind))
+
+
+def to_arrow(df: pd.DataFrame):
+    import pyarrow as pa
+
+    arrays, names = [], []
+    for name in df.columns:
+        series = df[name]
+        kind = column_type(name)
+        if kind == pa.string():
+            series = series.astype(object).map(lambda value: None if pd.isna(value) else str(value))
+        arrays.append(pa.array(series, type=kind, from_pandas=True))
+        names.append(str(name))
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+def compact_dtypes(df: pd.DataFrame, score_dtype=np.float32) -> pd.DataFrame:
+    """
+    Shrink a variant table in place of its default dtypes.
+
+    Genes, labels, amino acids and codons become categoricals, complete
+    site/length columns int32 and LLR/score columns ``score_dtype``. Columns
+    are replaced one at a time, so no second full copy of the table is made.
+    """
+    for col in df.columns:
+        series = df[col]
+        if col in CATEGORY_COLUMNS and not isinstance(series.dtype, pd.CategoricalDtype):
+            df[col] = series.astype("category")
+        elif col in SITE_COLUMNS and series.notna().all():
+            df[col] = series.astype(np.int32)
+        elif col.endswith(FLOAT_SUFFIXES) and pd.api.types.is_numeric_dtype(series):
+            df[col] = series.astype(score_dtype)
+    return df
+
+
+class MemoryAudit:
+    """Per-stage row count and deep memory use of the tables held at that stage."""
+
+    def __init__(self):
+        self.rows: list[dict[str, object]] = []
+
+    def record(self, stage: str, *frames: pd.DataFrame) -> None:
+        self.rows.append(
+            {
+                "stage": stage,
+                "n_rows": int(sum(len(frame) for frame in frames)),
+                "n_columns": int(sum(frame.shape[1] for frame in frames)),
+                "memory_mb": float(sum(frame.memory_usage(deep=True).sum() for frame in frames)) / 2**20,
+            }
+        )
+
+    def table(self) -> pd.DataFrame:
+        return pd.DataFrame(self.rows, columns=["stage", "n_rows", "n_columns", "memory_mb"])
+
+
+def gene_row_groups(genes: pd.Series, target_rows: int = ROW_GROUP_ROWS) -> list[np.ndarray]:
+    """Split gene-sorted row positions into row groups of about ``target_rows`` whole genes."""
+    order = np.argsort(genes.astype(str).to_numpy(), kind="stable")
+    sorted_genes = genes.astype(str).to_numpy()[order]
+    boundaries = np.flatnonzero(sorted_genes[1:] != sorted_genes[:-1]) + 1
+    groups, start = [], 0
+    for end in [*boundaries, len(order)]:
+        if end - start >= target_rows or end == len(order):
+            groups.append(order[start:end])
+            start = end
+    return [group for group in groups if len(group)]
+
+
+def write_score_table(df: pd.DataFrame, path: Path, gene_col: str = GENE_COLUMN) -> None:
+    import pyarrow.parquet as pq
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = df.reset_index(drop=True)
+    table.insert(0, ROW_COLUMN, np.arange(len(table), dtype=np.int64))
+    arrow = to_arrow(table)
+    with pq.ParquetWriter(path, arrow.schema) as writer:
+        for rows in gene_row_groups(table[gene_col]):
+            writer.write_table(arrow.take(rows))
+
+
+def load_score_table(
+    path: Path,
+    columns: list[str] | None = None,
+    genes: list[str] | None = None,
+    gene_col: str = GENE_COLUMN,
+    compact: bool = False,
+) -> pd.DataFrame:
+    """
+    Read a score table, pruning columns and genes.
+
+    Args:
+        path: Parquet or CSV path; if it does not exist, the same stem with the
+            other suffix is tried.
+        columns: Columns to load; names absent from the file are ignored.
+        genes: Only rows whose ``gene_col`` is in this list.
+        gene_col: Column that ``genes`` filters on.
+        compact: Apply ``compact_dtypes`` to the loaded table.
+
+    Returns:
+        DataFrame in the original row order of the table.
+    """
+    path = Path(path)
+    if not path.exists():
+        other = path.with_suffix(".csv" if path.suffix == ".parquet" else ".parquet")
+        if not other.exists():
+            raise FileNotFoundError(f"Missing score table: {path}")
+        path = other
+
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        schema = pq.read_schema(path)
+        wanted = None if columns is None else [col for col in columns if col in schema.names]
+        if wanted is not None and ROW_COLUMN in schema.names:
+            wanted = [ROW_COLUMN, *wanted]
+        filters = None if genes is None else [(gene_col, "in", [str(gene) for gene in genes])]
+        df = pq.read_table(path, columns=wanted, filters=filters).to_pandas()
+        if ROW_COLUMN in df.columns:
+            df = df.sort_values(ROW_COLUMN, kind="stable").drop(columns=ROW_COLUMN).reset_index(drop=True)
+        return compact_dtypes(df) if compact else df
+
+    usecols = None if columns is None else (lambda col: col in set(columns) or col == gene_col)
+    df = pd.read_csv(path, usecols=usecols)
+    if genes is not None:
+        df = df[df[gene_col].astype(str).isin({str(gene) for gene in genes})].reset_index(drop=True)
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+    return compact_dtypes(df) if compact else df
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Convert a CSV score table to the Parquet layout.")
+    parser.add_argument("csv", type=Path)
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--gene-col", default=GENE_COLUMN)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    output = args.output or args.csv.with_suffix(".parquet")
+    write_score_table(pd.read_csv(args.csv), output, args.gene_col)
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Indexed multi-FASTA sequence store.
+
+Per-gene FASTAs (``{gene}.fasta`` and ``{gene}_protein.fasta``) are packed
+into one file per molecule type (``cds.fa``, ``protein.fa``) with one
+single-line record per gene, a samtools-compatible ``.fai`` offset index
+keyed by gene and a ``.keys.tsv`` sidecar mapping transcript/record IDs to
+genes. Loading a sequence is a single seek; ``get_many`` reads a batch in
+file order through one handle.
+
+``open_sequences`` accepts either a packed store, a 2-bit ``packed_cds``
+store (``.npz``) or the original directory of per-gene files, so scripts can
+switch to a store without other changes.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+from pathlib import Path
+
+
+SUFFIXES = {"cds": ".fasta", "protein": "_protein.fasta"}
+
+
+def read_records(path: Path) -> list[tuple[str, str]]:
+    """(header, sequence) of every record in a FASTA file; sequences are upper-cased and undecodable bytes skipped."""
+    records: list[tuple[str, list[str]]] = []
+    with Path(path).open(errors="ignore") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(">"):
+                records.append((line[1:], []))
+                continue
+            if not records:
+                records.append(("", []))
+            records[-1][1].append(line.upper())
+    return [(header, "".join(parts)) for header, parts in records]
+
+
+def read_first_record(path: Path) -> tuple[str, str]:
+    """
+    Return (record ID, sequence) of a per-gene FASTA file.
+
+    Raises ValueError if the file holds more than one record, rather than
+    silently using or concatenating them.
+    """
+    records = read_records(path)
+    if len(records) > 1:
+        raise ValueError(f"{path} holds {len(records)} FASTA records; a per-gene file must hold one")
+    if not records:
+        return "", ""
+    header, sequence = records[0]
+    return (header.split()[0] if header else ""), sequence
+
+
+class SequenceStore:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.index: dict[str, tuple[int, int]] = {}
+        with Path(f"{self.path}.fai").open() as handle:
+            for line in handle:
+                name, length, offset, _, _ = line.rstrip("\n").split("\t")
+                self.index[name] = (int(offset), int(length))
+        self.transcripts: dict[str, str] = {}
+        keys = Path(f"{self.path}.keys.tsv")
+        if keys.exists():
+            with keys.open() as handle:
+                for row in csv.DictReader(handle, delimiter="\t"):
+                    self.transcripts[row["transcript"]] = row["gene"]
+
+    def __contains__(self, gene: str) -> bool:
+        return gene in self.index
+
+    def genes(self) -> list[str]:
+        return list(self.index)
+
+    def length(self, gene: str) -> int:
+        return self.index[gene][1]
+
+    def get(self, gene: str) -> str:
+        offset, length = self.index[gene]
+        with self.path.open("rb") as handle:
+            handle.seek(offset)
+            return handle.read(length).decode()
+
+    def get_many(self, genes: list[str]) -> dict[str, str]:
+        wanted = sorted((self.index[gene][0], gene) for gene in set(genes) if gene in self.index)
+        out: dict[str, str] = {}
+        with self.path.open("rb") as handle:
+            for offset, gene in wanted:
+                handle.seek(offset)
+                out[gene] = handle.read(self.index[gene][1]).decode()
+        return out
+
+    def by_transcript(self, transcript: str) -> str:
+        return self.get(self.transcripts[transcript])
+
+
+class DirectorySequences:
+    """Same interface over a directory of per-gene FASTA files."""
+
+    def __init__(self, directory: Path, suffix: str):
+        self.directory = Path(directory)
+        self.suffix = suffix
+
+    def file(self, gene: str) -> Path:
+        return self.directory / f"{gene}{self.suffix}"
+
+    def __contains__(self, gene: str) -> bool:
+        return self.file(gene).exists()
+
+    def genes(self) -> list[str]:
+        names = [path.name[: -len(self.suffix)] for path in sorted(self.directory.glob(f"*{self.suffix}"))]
+        if self.suffix == SUFFIXES["cds"]:
+            names = [name for name in names if not name.endswith("_protein")]
+        return names
+
+    def length(self, gene: str) -> int:
+        return len(self.get(gene))
+
+    def get(self, gene: str) -> str:
+        return read_first_record(self.file(gene))[1]
+
+    def get_many(self, genes: list[str]) -> dict[str, str]:
+        return {gene: self.get(gene) for gene in genes if gene in self}
+
+
+def open_sequences(path: Path, suffix: str = SUFFIXES["cds"]):
+    path = Path(path)
+    if path.suffix == ".npz":
+        from packed_cds import PackedCDS
+
+        return PackedCDS(path)
+    if path.is_file():
+        return SequenceStore(path)
+    return DirectorySequences(path, suffix)
+
+
+def build_store(source_dir: Path, suffix: str, output: Path) -> int:
+    """Pack every ``{gene}{suffix}`` FASTA under ``source_dir`` into ``output``."""
+    source = DirectorySequences(source_dir, suffix)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    n = 0
+    with output.open("wb") as fasta, Path(f"{output}.fai").open("w") as fai, Path(
+        f"{output}.keys.tsv"
+    ).open("w") as keys:
+        keys.write("transcript\tgene\n")
+        for gene in source.genes():
+            record_id, sequence = read_first_record(source.file(gene))
+            header = f">{gene} {record_id}\n".encode()
+            fasta.write(header)
+            offset = fasta.tell()
+            fasta.write(sequence.encode() + b"\n")
+            fai.write(f"{gene}\t{len(sequence)}\t{offset}\t{len(sequence)}\t{len(sequence) + 1}\n")
+            if record_id:
+                keys.write(f"{record_id}\t{gene}\n")
+            n += 1
+    return n
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gene-dir", type=Path, default=Path("data/Gene"))
+    parser.add_argument("--protein-dir", type=Path, default=Path("data/Protein"))
+    parser.add_argument("--out-dir", type=Path, default=Path("data/SeqStore"))
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    for kind, source_dir in [("cds", args.gene_dir), ("protein", args.protein_dir)]:
+        if not source_dir.is_dir():
+            print(f"Skipping {kind}: {source_dir} is not a directory")
+            continue
+        output = args.out_dir / f"{kind}.fa"
+        n = build_store(source_dir, SUFFIXES[kind], output)
+        print(f"Packed {n} {kind} sequences into {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""Crash-safe per-gene output shards for the long-running scorers.
+
+Each gene's rows go to their own CSV shard, written to a temporary file and
+moved into place with ``os.replace``, so a shard is either complete or absent.
+Once a shard is in place its key is appended to ``_done.jsonl``; resuming
+reads only this manifest, never the growing output table. A torn last
+manifest line (a kill mid-append) is ignored, and the gene it names is simply
+rescored. ``compact`` concatenates the shards, in completion order, into the
+final table (again via a temporary file), and ``adopt`` splits an older
+append-mode output table into shards once so existing runs resume in place.
+
+Manifest entries also carry content hashes of a gene's inputs (``seq_hash``
+of the sequence, ``model_hash`` of the model or checkpoint, ``input_hash`` of
+the variants scored). ``plan_rescoring`` compares them with the current
+inputs, so a corrected FASTA, a new checkpoint or new variants trigger a
+rescore of just the affected genes rather than silent reuse.
+
+For multi-node runs every scorer accepts ``--shard i/N`` (0 <= i < N): genes
+are split deterministically, either by a stable hash of the gene name or by a
+greedy longest-first partition on protein length, so N machines can each
+score a slice without coordination. Each slice records its assignment and
+model hash in ``_partition.json``; ``shards.py merge`` checks that all N
+slices are present, disjoint and scored with the same model before building
+one shard directory and the final table. Rerunning a scorer without
+``--shard`` on the merged directory then reuses every gene.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+MANIFEST = "_done.jsonl"
+PARTITION = "_partition.json"
+SHARD_STRATEGIES = ("length", "hash")
+PLAN_CATEGORIES = ("reused", "adopted", "rescored", "new")
+
+
+def shard_dir_for(output: Path, shard: tuple[int, int] | None = None) -> Path:
+    """Default shard directory next to a final output table, one per ``--shard`` slice."""
+    output = Path(output)
+    suffix = "" if shard is None else f"_{shard[0]}of{shard[1]}"
+    return output.with_name(output.stem + "_shards" + suffix)
+
+
+def shard_name(key: str) -> str:
+    safe = re.sub(r"[^A-Za-z0-9._-]", "_", key)
+    if safe != key:
+        safe = f"{safe}-{hashlib.sha1(key.encode()).hexdigest()[:8]}"
+    return safe + ".csv"
+
+
+def content_hash(*parts: object) -> str:
+    """SHA-1 over the parts (bytes, arrays or their ``str``), NUL-separated."""
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            part = np.ascontiguousarray(part).tobytes()
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def file_hash(path: Path, chunk_size: int = 1 << 24) -> str:
+    digest = hashlib.sha1()
+    with Path(path).open("rb") as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def frame_hash(df: pd.DataFrame) -> str:
+    """Hash of a frame's columns and values, independent of its index."""
+    return content_hash(*df.columns, pd.util.hash_pandas_object(df, index=False).to_numpy())
+
+
+def replace_atomically(path: Path, write) -> None:
+    """Call ``write(handle)`` on a temporary file next to ``path`` and move it into place."""
+    tmp = path.with_name(f".{path.name}.tmp-{os.getpid()}")
+    try:
+        with tmp.open("w", newline="") as handle:
+            write(handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+class ShardStore:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.manifest = self.root / MANIFEST
+        self.entries: dict[str, dict[str, object]] | None = None
+
+    def done(self) -> dict[str, dict[str, object]]:
+        """Manifest entries by key, in completion order; later entries for a key win."""
+        if self.entries is None:
+            self.entries = {}
+            if self.manifest.exists():
+                with self.manifest.open() as handle:
+                    for line in handle:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if entry.get("removed"):
+                            self.entries.pop(entry["key"], None)
+                        elif (self.root / entry["shard"]).exists():
+                            self.entries[entry["key"]] = entry
+        return self.entries
+
+    def __contains__(self, key: object) -> bool:
+        return str(key) in self.done()
+
+    def __len__(self) -> int:
+        return len(self.done())
+
+    def n_rows(self) -> int:
+        return int(sum(entry["rows"] for entry in self.done().values()))
+
+    def write(self, key: str, rows: pd.DataFrame, **meta: object) -> Path:
+        """Write one key's rows as a shard, then record it in the manifest."""
+        key = str(key)
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / shard_name(key)
+        replace_atomically(path, lambda handle: rows.to_csv(handle, index=False) if len(rows.columns) else None)
+        self.append_entry({"key": key, "shard": path.name, "rows": len(rows), **meta})
+        return path
+
+    def stamp(self, key: str, **meta: object) -> None:
+        """Record new metadata (e.g. hashes) for an existing shard without rewriting it."""
+        self.append_entry({**self.done()[str(key)], **meta})
+
+    def remove(self, key: str) -> None:
+        key = str(key)
+        entry = self.done().get(key)
+        if entry is None:
+            return
+        self.append_entry({"key": key, "removed": True})
+        (self.root / entry["shard"]).unlink(missing_ok=True)
+
+    def append_entry(self, entry: dict[str, object]) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self.manifest.open("a+b") as handle:
+            handle.seek(0, os.SEEK_END)
+            if handle.tell():
+                handle.seek(-1, os.SEEK_END)
+                if handle.read(1) != b"\n":
+                    handle.write(b"\n")
+            handle.write((json.dumps(entry) + "\n").encode())
+            handle.flush()
+            os.fsync(handle.fileno())
+        if entry.get("removed"):
+            self.done().pop(entry["key"], None)
+        else:
+            self.done()[entry["key"]] = entry
+
+    def compact(self, output: Path) -> int:
+        """Concatenate the shards into ``output``; returns the number of rows written."""
+        output = Path(output)
+        shards = [self.root / entry["shard"] for entry in self.done().values() if entry["rows"]]
+        if not shards:
+            return 0
+        header = None
+
+        def write(handle) -> None:
+            nonlocal header
+            for shard in shards:
+                with shard.open(newline="") as source:
+                    first = source.readline()
+                    if header is None:
+                        header = first
+                        handle.write(header)
+                    elif first != header:
+                        raise ValueError(f"Shard {shard} has a different header from the first shard")
+                    shutil.copyfileobj(source, handle)
+
+        output.parent.mkdir(parents=True, exist_ok=True)
+        replace_atomically(output, write)
+        return self.n_rows()
+
+    def adopt(self, table: Path, key_col: str) -> int:
+        """
+        Split a legacy append-mode output table into shards.
+
+        Rows of the last key are dropped when the file does not end in a
+        newline, since that key's append may have been interrupted.
+
+        Returns:
+            Number of keys adopted.
+        """
+        table = Path(table)
+        if not table.exists() or table.stat().st_size == 0:
+            return 0
+        df = pd.read_csv(table)
+        with table.open("rb") as handle:
+            handle.seek(-1, os.SEEK_END)
+            torn = handle.read(1) != b"\n"
+        if torn and len(df):
+            df = df[df[key_col] != df[key_col].iloc[-1]]
+        n = 0
+        for key, group in df.groupby(df[key_col].astype(str), sort=False):
+            if key not in self:
+                self.write(key, group)
+                n += 1
+        return n
+
+    def clear(self) -> None:
+        if self.root.exists():
+            shutil.rmtree(self.root)
+        self.entries = None
+
+
+def plan_rescoring(store: ShardStore, stamps: dict[str, dict[str, object]]) -> dict[str, list[str]]:
+    """
+    Sort genes by what their stored shard is worth given the current input hashes.
+
+    Args:
+        store: Shard store of earlier runs.
+        stamps: Current hashes per gene, e.g. ``{"seq_hash": ..., "model_hash": ...}``.
+
+    Returns:
+        Genes per category: ``reused`` (hashes match), ``adopted`` (shard from
+        before hashes were recorded; stamped with the current hashes and
+        reused, as the old name-based resume would have), ``rescored``
+        (a hash changed) and ``new`` (no shard).
+    """
+    plan: dict[str, list[str]] = {category: [] for category in PLAN_CATEGORIES}
+    for gene, stamp in stamps.items():
+        entry = store.done().get(str(gene))
+        if entry is None:
+            plan["new"].append(gene)
+        elif not any(field in entry for field in stamp):
+            store.stamp(gene, **stamp)
+            plan["adopted"].append(gene)
+        elif all(entry.get(field) == value for field, value in stamp.items()):
+            plan["reused"].append(gene)
+        else:
+            plan["rescored"].append(gene)
+    return plan
+
+
+def describe_plan(plan: dict[str, list[str]]) -> str:
+    return ", ".join(f"{len(plan[category])} {category}" for category in PLAN_CATEGORIES)
+
+
+def parse_shard(text: str) -> tuple[int, int]:
+    """Parse ``i/N`` with 0 <= i < N."""
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected --shard i/N, got {text!r}") from None
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Shard index must satisfy 0 <= i < N, got {text!r}")
+    return index, count
+
+
+def add_shard_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        help="Score only slice i of N (0-based) for multi-node runs; combine slices with shards.py merge.",
+    )
+    parser.add_argument(
+        "--shard-strategy",
+        choices=SHARD_STRATEGIES,
+        default="length",
+        help="Split genes by protein length (balanced, longest first) or by a stable hash of the gene name.",
+    )
+
+
+def stable_bucket(gene: str, count: int) -> int:
+    return int(hashlib.sha1(str(gene).encode()).hexdigest()[:12], 16) % count
+
+
+def partition_genes(genes: list[str], count: int, strategy: str, costs: dict[str, float] | None = None) -> list[list[str]]:
+    """
+    Deterministically split genes into ``count`` slices.
+
+    ``hash`` uses a stable hash of the gene name. ``length`` assigns genes,
+    longest first, to the slice with the least total cost (ties go to the
+    lower slice), which keeps the total protein length per slice close.
+    """
+    slices: list[list[str]] = [[] for _ in range(count)]
+    if strategy == "hash":
+        for gene in sorted(genes):
+            slices[stable_bucket(gene, count)].append(gene)
+        return slices
+    costs = costs or {}
+    loads = [(0.0, index) for index in range(count)]
+    for gene in sorted(genes, key=lambda gene: (-float(costs.get(gene, 0)), gene)):
+        load, index = heapq.heappop(loads)
+        slices[index].append(gene)
+        heapq.heappush(loads, (load + float(costs.get(gene, 0)), index))
+    return [sorted(genes_in_slice) for genes_in_slice in slices]
+
+
+def claim_shard(
+    store: ShardStore,
+    genes: list[str],
+    shard: tuple[int, int] | None,
+    strategy: str,
+    costs: dict[str, float] | None = None,
+    model_hash: str | None = None,
+    gene_ids_hash: str | None = None,
+) -> list[str]:
+    """
+    Genes of this run's slice (all genes without ``--shard``), recorded in ``_partition.json``.
+
+    ``gene_ids_hash`` is the fingerprint of the gene dictionary the slice's
+    variant keys were packed with.
+    """
+    if shard is None:
+        return list(genes)
+    index, count = shard
+    assigned = partition_genes(list(genes), count, strategy, costs)[index]
+    store.root.mkdir(parents=True, exist_ok=True)
+    partition = {
+        "index": index,
+        "count": count,
+        "strategy": strategy,
+        "n_cohort_genes": len(genes),
+        "cohort_hash": content_hash(*sorted(genes)),
+        "model_hash": model_hash,
+        "gene_ids_hash": gene_ids_hash,
+        "genes": assigned,
+    }
+    replace_atomically(store.root / PARTITION, lambda handle: json.dump(partition, handle, indent=2))
+    print(f"Shard {index}/{count} ({strategy}): {len(assigned)} of {len(genes)} genes")
+    return assigned
+
+
+def merge_stores(sources: list[Path], output: Path, shard_dir: Path | None = None) -> ShardStore:
+    """
+    Validate the ``--shard`` slices in ``sources`` and merge them into one store.
+
+    All slices 0..N-1 of a single partitioning must be present, no gene may be
+    scored in two slices or outside its own slice, and every shard must carry
+    the same model hash. Slices that pack variant keys must have used the
+    same gene dictionary (``gene_ids_hash``) and no two genes may carry the
+    same ``gene_id``, otherwise keys from different slices would collide.
+    The merged shards are compacted into ``output``.
+    """
+    partitions, stores = [], []
+    for source in sources:
+        path = Path(source) / PARTITION
+        if not path.exists():
+            raise FileNotFoundError(f"{source} is not a --shard run directory (no {PARTITION})")
+        partitions.append(json.loads(path.read_text()))
+        stores.append(ShardStore(source))
+
+    layouts = {(part["count"], part["strategy"], part["cohort_hash"]) for part in partitions}
+    if len(layouts) != 1:
+        raise ValueError(f"Slices come from different partitionings: {sorted(layouts)}")
+    count = partitions[0]["count"]
+    indices = sorted(part["index"] for part in partitions)
+    if indices != list(range(count)):
+        missing = sorted(set(range(count)) - set(indices))
+        duplicated = sorted({index for index in indices if indices.count(index) > 1})
+        raise ValueError(f"Expected slices 0..{count - 1}; missing {missing}, duplicated {duplicated}")
+
+    owner: dict[str, int] = {}
+    gene_ids: dict[int, str] = {}
+    model_hashes = set()
+    for part, store in zip(partitions, stores):
+        assigned = set(part["genes"])
+        for gene, entry in store.done().items():
+            if gene in owner:
+                raise ValueError(f"Gene {gene} is scored in slices {owner[gene]} and {part['index']}")
+            if gene not in assigned:
+                raise ValueError(f"Gene {gene} in slice {part['index']} is outside that slice's assignment")
+            owner[gene] = part["index"]
+            model_hashes.add(entry.get("model_hash"))
+            if entry.get("gene_id") is not None:
+                other = gene_ids.setdefault(entry["gene_id"], gene)
+                if other != gene:
+                    raise ValueError(f"Genes {other} and {gene} share gene id {entry['gene_id']}")
+        model_hashes.add(part.get("model_hash"))
+    model_hashes.discard(None)
+    if len(model_hashes) > 1:
+        raise ValueError(f"Slices were scored with different models: {sorted(model_hashes)}")
+    dictionaries = {part.get("gene_ids_hash") for part in partitions} - {None}
+    if len(dictionaries) > 1:
+        raise ValueError(
+            f"Slices packed variant keys with different gene dictionaries: {sorted(dictionaries)}; "
+            "score every slice with the same --gene-ids file"
+        )
+
+    target = ShardStore(shard_dir or shard_dir_for(output))
+    if target.root.resolve() in {Path(source).resolve() for source in sources}:
+        raise ValueError("The merged shard directory must differ from the slice directories")
+    target.clear()
+    target.root.mkdir(parents=True)
+    for part, store in sorted(zip(partitions, stores), key=lambda pair: pair[0]["index"]):
+        for entry in store.done().values():
+            shutil.copy2(store.root / entry["shard"], target.root / entry["shard"])
+            target.append_entry(entry)
+    n_assigned = sum(len(part["genes"]) for part in partitions)
+    n_rows = target.compact(output)
+    print(
+        f"Merged {count} slices: {len(target)} of {n_assigned} assigned genes scored "
+        f"({n_assigned - len(target)} unscored), {n_rows} rows into {output}"
+    )
+    return target
+
+
+def open_store(
+    output: Path,
+    key_col: str,
+    shard_dir: Path | None = None,
+    force: bool = False,
+    shard: tuple[int, int] | None = None,
+) -> ShardStore:
+    """
+    Shard store for ``output``, adopting an existing legacy table on first use.
+
+    Args:
+        output: Final table that ``compact`` writes.
+        key_col: Column holding the shard key (the gene) in ``output``.
+        shard_dir: Shard directory; defaults to ``shard_dir_for(output, shard)``.
+        force: Discard existing shards and the output table.
+        shard: ``--shard`` slice; a slice never adopts the legacy table or
+            deletes ``output``.
+    """
+    output = Path(output)
+    store = ShardStore(shard_dir or shard_dir_for(output, shard))
+    if force:
+        store.clear()
+        if output.exists() and shard is None:
+            output.unlink()
+    elif shard is None and not len(store) and output.exists():
+        n = store.adopt(output, key_col)
+        if n:
+            print(f"Adopted {n} scored genes from {output} into {store.root}")
+    return store
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compact or merge scorer shard directories.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compact = commands.add_parser("compact", help="Concatenate a shard directory into its final table.")
+    compact.add_argument("output", type=Path)
+    compact.add_argument("--shard-dir", type=Path, default=None)
+    merge = commands.add_parser("merge", help="Validate and merge the shard directories of --shard i/N runs.")
+    merge.add_argument("output", type=Path)
+    merge.add_argument("sources", type=Path, nargs="+", help="Shard directories of all N slices.")
+    merge.add_argument("--shard-dir", type=Path, default=None, help="Merged shard directory (default: <output stem>_shards).")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.command == "merge":
+        merge_stores(args.sources, args.output, args.shard_dir)
+        return
+    store = ShardStore(args.shard_dir or shard_dir_for(args.output))
+    n = store.compact(args.output)
+    print(f"Wrote {n} rows from {len(store)} shards to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
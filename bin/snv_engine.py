@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""Score every single-nucleotide change of a CDS in one pass.
+
+The 64 x 9 table of single-nucleotide codon neighbours is built once from
+``config.codon_list``. Applying it to a gene's codon index array yields all
+3L x 3 possible SNVs, which are labelled synonymous, missense or nonsense and
+scored with CaLM codon LLRs, CaLM AA-aggregated LLRs and ESM missense LLRs as
+array operations instead of per-variant Python.
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from config import codon_list, codon_to_amino_acid
+from seq_store import open_sequences
+
+
+# codon_list is ordered base-4 over (A, U, C, G): index = 16 * b1 + 4 * b2 + b3.
+BASES = ("A", "U", "C", "G")
+CODON_INDEX = {codon: idx for idx, codon in enumerate(codon_list)}
+AA_ORDER = "ACDEFGHIKLMNPQRSTVWY*"
+STOP_AA = AA_ORDER.index("*")
+CODON_AA = np.array([AA_ORDER.index(codon_to_amino_acid[codon]) for codon in codon_list], dtype=np.int8)
+EPS = np.finfo(np.float64).tiny
+INVALID_BASE = len(BASES)
+BASE_LOOKUP = np.full(256, INVALID_BASE, dtype=np.uint8)
+for _code, _bases in enumerate(["Aa", "UuTt", "Cc", "Gg"]):
+    BASE_LOOKUP[[ord(base) for base in _bases]] = _code
+
+
+def codon_neighbours() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Build the single-nucleotide neighbour table of the 64 codons.
+
+    Returns:
+        Tuple of (64, 9) arrays: mutant codon index, mutated codon position
+        (0-2) and mutant base index into ``BASES``. Columns are ordered by
+        codon position, then by alternative base.
+    """
+    mut = np.zeros((64, 9), dtype=np.int8)
+    pos = np.zeros((64, 9), dtype=np.int8)
+    base = np.zeros((64, 9), dtype=np.int8)
+    for idx, codon in enumerate(codon_list):
+        col = 0
+        for p in range(3):
+            for b, alt in enumerate(BASES):
+                if codon[p] == alt:
+                    continue
+                mut[idx, col] = CODON_INDEX[codon[:p] + alt + codon[p + 1 :]]
+                pos[idx, col] = p
+                base[idx, col] = b
+                col += 1
+    return mut, pos, base
+
+
+NEIGHBOURS, NEIGHBOUR_POSITION, NEIGHBOUR_BASE = codon_neighbours()
+
+
+def aa_projection() -> np.ndarray:
+    """Return the fixed (64, 21) matrix summing codon probabilities into ``AA_ORDER``."""
+    projection = np.zeros((64, len(AA_ORDER)), dtype=np.float64)
+    projection[np.arange(64), CODON_AA] = 1.0
+    return projection
+
+
+AA_PROJECTION = aa_projection()
+
+
+def encode_bases(sequence: str) -> np.ndarray:
+    """Map a DNA or RNA sequence to 2-bit base codes (A=0, U/T=1, C=2, G=3); other characters map to 4."""
+    return BASE_LOOKUP[np.frombuffer(sequence.encode("ascii", "replace"), dtype=np.uint8)]
+
+
+def codons_from_bases(codes: np.ndarray) -> np.ndarray:
+    """Turn base codes into codon indices into ``codon_list``; codons with an invalid base map to -1."""
+    n = len(codes) // 3
+    triplets = codes[: 3 * n].reshape(n, 3).astype(np.int16)
+    idx = 16 * triplets[:, 0] + 4 * triplets[:, 1] + triplets[:, 2]
+    return np.where((triplets < 4).all(axis=1), idx, -1).astype(np.int16)
+
+
+def encode_codons(sequence: str) -> np.ndarray:
+    """Map a CDS to codon indices into ``codon_list``; codons with non-ACGU bases map to -1."""
+    return codons_from_bases(encode_bases(sequence))
+
+
+def site_values(matrix: np.ndarray, sites: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """Gather ``matrix[sites, cols]``, returning NaN for sites past the matrix length."""
+    out = np.full(len(sites), np.nan)
+    ok = sites < matrix.shape[0]
+    out[ok] = matrix[sites[ok], cols[ok]]
+    return out
+
+
+def score_all_snvs(
+    codon_idx: np.ndarray,
+    calm_probs: np.ndarray | None = None,
+    esm_log_probs: np.ndarray | None = None,
+) -> pd.DataFrame:
+    """
+    Enumerate and score every SNV of a coding sequence.
+
+    Args:
+        codon_idx: (L,) codon indices into ``codon_list``; negative entries are skipped.
+        calm_probs: Optional (L, 64) CaLM codon probabilities in ``codon_list`` order.
+        esm_log_probs: Optional (L, 20) ESM log-probabilities in ``AA_ORDER[:20]`` order.
+
+    Returns:
+        One row per SNV with site, codon and amino-acid annotations, the
+        consequence label and whichever LLR columns the inputs allow.
+    """
+    codon_idx = np.asarray(codon_idx)
+    sites = np.flatnonzero(codon_idx >= 0)
+    ref = codon_idx[sites].astype(np.intp)
+
+    site = np.repeat(sites, 9)
+    ref_codon = np.repeat(ref, 9)
+    mut_codon = NEIGHBOURS[ref].ravel().astype(np.intp)
+    position = NEIGHBOUR_POSITION[ref].ravel()
+    ref_aa = CODON_AA[ref_codon]
+    mut_aa = CODON_AA[mut_codon]
+
+    codon_arr = np.array(codon_list)
+    aa_arr = np.array(list(AA_ORDER))
+    base_arr = np.array(BASES)
+    consequence = np.where(
+        ref_aa == mut_aa,
+        "synonymous",
+        np.where(mut_aa == STOP_AA, "nonsense", np.where(ref_aa == STOP_AA, "stop_lost", "missense")),
+    )
+    ref_base_idx = (ref_codon // (4 ** (2 - position))) % 4
+
+    out = pd.DataFrame(
+        {
+            "Site": site + 1,
+            "nc_site": 3 * site + position + 1,
+            "codon_position": position + 1,
+            "ref_base": base_arr[ref_base_idx],
+            "mut_base": base_arr[NEIGHBOUR_BASE[ref].ravel()],
+            "Ref_codon": codon_arr[ref_codon],
+            "Mut_codon": codon_arr[mut_codon],
+            "Ref_aa": aa_arr[ref_aa],
+            "Mut_aa": aa_arr[mut_aa],
+            "consequence": consequence,
+        }
+    )
+
+    if calm_probs is not None:
+        probs = np.asarray(calm_probs, dtype=np.float64)
+        log_codon = np.log(np.maximum(probs, EPS))
+        log_aa = np.log(np.maximum(probs @ AA_PROJECTION, EPS))
+        out["calm_codon_llr"] = site_values(log_codon, site, mut_codon) - site_values(log_codon, site, ref_codon)
+        out["calm_aa_agg_llr"] = site_values(log_aa, site, mut_aa) - site_values(log_aa, site, ref_aa)
+
+    if esm_log_probs is not None:
+        log_probs = np.asarray(esm_log_probs, dtype=np.float64)
+        missense = consequence == "missense"
+        esm_llr = np.full(len(out), np.nan)
+        esm_llr[missense] = site_values(log_probs, site[missense], mut_aa[missense]) - site_values(
+            log_probs, site[missense], ref_aa[missense]
+        )
+        out["esm_llr"] = esm_llr
+
+    return out
+
+
+def load_calm_probs(path: Path) -> np.ndarray:
+    """Read a ``*_CaLM_grammaticality.csv`` matrix into ``codon_list`` column order."""
+    return pd.read_csv(path)[codon_list].to_numpy(dtype=np.float64)
+
+
+def load_esm_log_probs(path: Path) -> np.ndarray:
+    """Read a ``*_ESM2_grammaticality.csv`` matrix into log-probabilities in ``AA_ORDER[:20]`` order."""
+    probs = pd.read_csv(path)[list(AA_ORDER[:20])].to_numpy(dtype=np.float64)
+    return np.log(np.maximum(probs, EPS))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gene-list", type=Path, default=Path("bin/gene_info.txt"))
+    parser.add_argument(
+        "--gene-dir",
+        type=Path,
+        default=Path("data/Gene"),
+        help="Directory of {gene}.fasta files, a packed cds.fa store or a 2-bit cds_2bit.npz store.",
+    )
+    parser.add_argument("--calm-dir", type=Path, default=Path("Results/Gene"))
+    parser.add_argument("--esm-dir", type=Path, default=Path("Results/Protein"))
+    parser.add_argument("--out-dir", type=Path, default=Path("Results/all_snv"))
+    parser.add_argument("--report-every", type=int, default=100)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    genes = pd.read_csv(args.gene_list, sep="\t", header=None)[0].astype(str).tolist()
+    sequences = open_sequences(args.gene_dir)
+
+    n_written = 0
+    for idx, gene in enumerate(genes, start=1):
+        if gene not in sequences:
+            print(f"Missing CDS for {gene}; skipping")
+            continue
+        calm_path = args.calm_dir / f"{gene}_CaLM_grammaticality.csv"
+        esm_path = args.esm_dir / f"{gene}_ESM2_grammaticality.csv"
+        codon_idx = sequences.codons(gene) if hasattr(sequences, "codons") else encode_codons(sequences.get(gene))
+        scores = score_all_snvs(
+            codon_idx,
+            calm_probs=load_calm_probs(calm_path) if calm_path.exists() else None,
+            esm_log_probs=load_esm_log_probs(esm_path) if esm_path.exists() else None,
+        )
+        scores.insert(0, "Gene", gene)
+        scores.to_csv(args.out_dir / f"{gene}_all_snv_scores.csv", index=False)
+        n_written += len(scores)
+        if idx % args.report_every == 0 or idx == len(genes):
+            print(f"Scored {idx}/{len(genes)} genes; {n_written} SNVs written")
+
+
+if __name__ == "__main__":
+    main()
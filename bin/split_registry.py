@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""Persisted cross-validation folds shared by every analysis.
+
+Folds depend only on the stratification labels, the grouping values (for
+gene-held-out splits), the splitter kind, ``n_splits`` and the seed, so the
+registry keys them on exactly those: a content hash of the label and group
+values in row order plus the split parameters. The first analysis to ask
+computes the split with scikit-learn and stores it as one small-integer fold
+id per row (the test folds partition the rows, so this holds every
+train/test index pair); later analyses, and later runs, load it instead of
+re-splitting. Two scripts that ask for the same split of the same table
+therefore get identical folds, and a changed table gets a new entry rather
+than stale folds.
+
+Splits rebuilt from fold ids equal scikit-learn's: both list indices in
+ascending order.
+
+Repeated cross-validation (``--repeats R``) uses R splits seeded ``seed``,
+``seed + 1``, ..., each its own registry entry, so the first repeat is the
+single split. Repeat x fold estimates share training data, so their plain
+variance understates the uncertainty; ``corrected_variance`` and
+``corrected_ttest`` apply the Nadeau & Bengio (2003) correction.
+
+    python split_registry.py list
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.stats import t as t_dist
+
+from shards import content_hash
+
+
+REGISTRY_DIR = Path("Results/Revision/split_registry")
+SPLIT_KINDS = ("stratified_group", "stratified")
+
+_CACHE: dict[tuple[Path, str], np.ndarray] = {}
+
+
+def split_key(kind: str, y, groups, n_splits: int, seed: int) -> str:
+    """Registry key of a split: kind, fold count, seed and the label/group values."""
+    if kind not in SPLIT_KINDS:
+        raise ValueError(f"Unknown split kind {kind!r}; expected one of {SPLIT_KINDS}")
+    labels = pd.util.hash_pandas_object(pd.Series(np.asarray(y)).astype(str), index=False).to_numpy()
+    parts = [kind, n_splits, seed, len(labels), labels]
+    if groups is not None:
+        parts.append(pd.util.hash_pandas_object(pd.Series(np.asarray(groups)).astype(str), index=False).to_numpy())
+    return f"{kind}_{n_splits}x{seed}_{content_hash(*parts)[:16]}"
+
+
+def compute_fold_ids(kind: str, y, groups, n_splits: int, seed: int) -> np.ndarray:
+    from sklearn.model_selection import StratifiedGroupKFold, StratifiedKFold
+
+    y = np.asarray(y)
+    X = np.zeros((len(y), 1))
+    if kind == "stratified_group":
+        splits = StratifiedGroupKFold(n_splits=n_splits, shuffle=True, random_state=seed).split(X, y, groups=groups)
+    else:
+        splits = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=seed).split(X, y)
+    fold_ids = np.zeros(len(y), dtype=np.int8 if n_splits <= np.iinfo(np.int8).max else np.int32)
+    for fold, (_, test_idx) in enumerate(splits, start=1):
+        fold_ids[test_idx] = fold
+    return fold_ids
+
+
+def save_fold_ids(path: Path, fold_ids: np.ndarray, meta: dict[str, object]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp-{os.getpid()}")
+    try:
+        with tmp.open("wb") as handle:
+            np.savez_compressed(handle, fold_ids=fold_ids, meta=np.array(json.dumps(meta)))
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def load_fold_ids(path: Path, n: int, n_splits: int) -> np.ndarray | None:
+    """Stored fold ids, or None if the entry is missing or does not fit ``n`` rows and ``n_splits`` folds."""
+    try:
+        with np.load(path) as data:
+            fold_ids = data["fold_ids"]
+    except (OSError, KeyError, ValueError):
+        return None
+    if len(fold_ids) != n or fold_ids.min(initial=1) < 1 or fold_ids.max(initial=1) > n_splits:
+        return None
+    return fold_ids
+
+
+def fold_ids(
+    y,
+    groups=None,
+    n_splits: int = 10,
+    seed: int = 16,
+    kind: str | None = None,
+    group_col: str | None = None,
+    registry: Path | None = REGISTRY_DIR,
+) -> np.ndarray:
+    """
+    1-based fold id of every row, from the registry when the split was made before.
+
+    Args:
+        y: Stratification labels, in row order.
+        groups: Grouping values (e.g. genes) for a group-held-out split.
+        n_splits: Number of folds.
+        seed: ``random_state`` of the shuffled splitter.
+        kind: ``stratified_group`` or ``stratified``; defaults by ``groups``.
+        group_col: Name of the grouping column, recorded with the entry.
+        registry: Registry directory; None keeps the split in memory only.
+
+    Returns:
+        Fold ids (1..n_splits, int8 up to 127 folds), one per row.
+    """
+    kind = kind or ("stratified" if groups is None else "stratified_group")
+    key = split_key(kind, y, groups, n_splits, seed)
+    cache_key = (Path(registry) if registry is not None else Path(), key)
+    if cache_key in _CACHE:
+        return _CACHE[cache_key]
+
+    path = None if registry is None else Path(registry) / f"{key}.npz"
+    folds = None if path is None else load_fold_ids(path, len(y), n_splits)
+    if folds is None:
+        folds = compute_fold_ids(kind, y, groups, n_splits, seed)
+        if path is not None:
+            meta = {
+                "kind": kind,
+                "n_rows": len(folds),
+                "n_splits": n_splits,
+                "seed": seed,
+                "group_col": group_col,
+                "n_groups": None if groups is None else int(pd.Series(np.asarray(groups)).nunique()),
+            }
+            save_fold_ids(path, folds, meta)
+    folds.flags.writeable = False
+    _CACHE[cache_key] = folds
+    return folds
+
+
+def splits_from_fold_ids(folds: np.ndarray, n_splits: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    return [(np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)) for fold in range(1, n_splits + 1)]
+
+
+def get_splits(
+    y,
+    groups=None,
+    n_splits: int = 10,
+    seed: int = 16,
+    kind: str | None = None,
+    group_col: str | None = None,
+    registry: Path | None = REGISTRY_DIR,
+) -> list[tuple[np.ndarray, np.ndarray]]:
+    """``(train_idx, test_idx)`` pairs as returned by the scikit-learn splitter; see ``fold_ids``."""
+    return splits_from_fold_ids(fold_ids(y, groups, n_splits, seed, kind, group_col, registry), n_splits)
+
+
+def repeat_seeds(seed: int, repeats: int) -> list[int]:
+    if repeats < 1:
+        raise ValueError("repeats must be at least 1")
+    return [seed + repeat for repeat in range(repeats)]
+
+
+def repeated_fold_ids(
+    y,
+    groups=None,
+    n_splits: int = 10,
+    seed: int = 16,
+    repeats: int = 1,
+    kind: str | None = None,
+    group_col: str | None = None,
+    registry: Path | None = REGISTRY_DIR,
+) -> np.ndarray:
+    """(repeats, n) fold ids, row r from the split seeded ``repeat_seeds(seed, repeats)[r]``; see ``fold_ids``."""
+    return np.vstack(
+        [fold_ids(y, groups, n_splits, split_seed, kind, group_col, registry) for split_seed in repeat_seeds(seed, repeats)]
+    )
+
+
+def corrected_variance(values, n_splits: int) -> float:
+    """
+    Variance of the mean of repeat x fold estimates, corrected for overlapping training sets.
+
+    Nadeau & Bengio (2003): ``(1 / J + n_test / n_train) * s^2`` over the J
+    estimates, with ``n_test / n_train = 1 / (n_splits - 1)`` for k-fold splits.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) < 2:
+        return np.nan
+    return float((1.0 / len(values) + 1.0 / (n_splits - 1)) * values.var(ddof=1))
+
+
+def corrected_ttest(deltas, n_splits: int) -> tuple[float, float]:
+    """Corrected repeated k-fold t statistic and two-sided p-value of paired ``deltas`` (J - 1 df)."""
+    deltas = np.asarray(deltas, dtype=np.float64)
+    deltas = deltas[np.isfinite(deltas)]
+    variance = corrected_variance(deltas, n_splits)
+    if not variance > 0:
+        return np.nan, np.nan
+    statistic = float(deltas.mean() / np.sqrt(variance))
+    return statistic, float(2.0 * t_dist.sf(abs(statistic), len(deltas) - 1))
+
+
+def add_repeat_args(parser) -> None:
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=1,
+        help="Independently seeded repetitions of the split (seeds --seed, --seed + 1, ...); 1 is the single split.",
+    )
+
+
+def add_registry_args(parser) -> None:
+    parser.add_argument(
+        "--split-registry",
+        type=Path,
+        default=REGISTRY_DIR,
+        help="Directory of persisted fold splits shared by the analyses.",
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Inspect the fold-split registry.")
+    parser.add_argument("command", choices=["list"])
+    parser.add_argument("--registry", type=Path, default=REGISTRY_DIR)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    rows = []
+    for path in sorted(args.registry.glob("*.npz")):
+        try:
+            with np.load(path) as data:
+                meta = json.loads(str(data["meta"]))
+        except (OSError, KeyError, ValueError):
+            meta = {"kind": "unreadable"}
+        rows.append({"key": path.stem, **meta, "bytes": path.stat().st_size})
+    print(pd.DataFrame(rows).to_string(index=False) if rows else f"No splits in {args.registry}")
+
+
+if __name__ == "__main__":
+    main()
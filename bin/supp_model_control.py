@@ -6,10 +6,17 @@ Outputs:
 - fold-level delta AUROC distributions for planned contrasts
 - gene-wise versus variant-wise CV comparison
 - per-fold ensemble-weight distributions
+
+Fold results from ``cv_model_control.py --repeats R`` are pooled over every
+repeat x fold, with the corrected repeated k-fold t-test added to the
+pairwise tests (the uncorrected paired t and Wilcoxon tests use the first
+repeat); ``--repeats`` runs the variant-wise CV with as many
+stratified splits.
 """
 
 from __future__ import annotations
 
+import argparse
 import os
 from itertools import combinations
 from pathlib import Path
@@ -20,11 +27,15 @@ import numpy as np
 import pandas as pd
 from scipy.stats import ttest_rel, wilcoxon
 from sklearn.metrics import roc_auc_score
-from sklearn.model_selection import StratifiedKFold
 
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
 
+from eval_runner import add_worker_args, fold_view, run_cells
+from fast_auc import best_candidate
+from score_table import load_score_table
+from split_registry import REGISTRY_DIR, add_registry_args, add_repeat_args, corrected_ttest, repeated_fold_ids
+
 
 MODEL_DIR = Path("Results/ClinVar/model_control")
 OUT_DIR = MODEL_DIR
@@ -136,19 +147,22 @@ def triple_weights(step: float = 0.05) -> list[tuple[float, float, float]]:
 
 
 def best_weights(y_train: np.ndarray, train_scores: list[np.ndarray], candidates: list[tuple[float, ...]]) -> tuple[float, ...]:
-    best_auc = -np.inf
-    best_candidate = candidates[0]
-    for weights in candidates:
-        score = sum(w * s for w, s in zip(weights, train_scores))
-        auc = roc_auc_score(y_train, score)
-        if auc > best_auc:
-            best_auc = auc
-            best_candidate = weights
-    return best_candidate
+    best, _ = best_candidate(y_train, train_scores, np.asarray(candidates))
+    return candidates[best]
+
+
+def with_repeat(fold_df: pd.DataFrame) -> pd.DataFrame:
+    """Fold results with a ``repeat`` column; tables from single-split runs are repeat 1."""
+    return fold_df if "repeat" in fold_df.columns else fold_df.assign(repeat=1)
 
 
 def all_pairwise_tests(fold_df: pd.DataFrame) -> pd.DataFrame:
-    wide = fold_df.pivot(index="fold", columns="model", values="test_auc")
+    fold_df = with_repeat(fold_df)
+    n_splits = int(fold_df["fold"].max())
+    wide = fold_df.pivot(index=["repeat", "fold"], columns="model", values="test_auc")
+    # The uncorrected paired t and Wilcoxon tests treat folds as independent; pooled over
+    # repeats they would be far too small, so they use the first repeat only.
+    first = wide.xs(1, level="repeat")
     summary = fold_df.groupby("model")["test_auc"].agg(["mean", "std"]).rename(columns={"mean": "mean_auc", "std": "sd_auc"})
     planned_unordered = {frozenset((a, b)) for a, b, _ in PLANNED_CONTRASTS}
     rows = []
@@ -156,10 +170,10 @@ def all_pairwise_tests(fold_df: pd.DataFrame) -> pd.DataFrame:
     def add_row(a: str, b: str, planned_contrast: bool, contrast_label: str) -> None:
         delta = wide[a] - wide[b]
         try:
-            wp = float(wilcoxon(delta).pvalue)
+            wp = float(wilcoxon(first[a] - first[b]).pvalue)
         except ValueError:
             wp = np.nan
-        paired_p = float(ttest_rel(wide[a], wide[b]).pvalue)
+        paired_p = float(ttest_rel(first[a], first[b]).pvalue)
         rows.append(
             {
                 "contrast_label": contrast_label,
@@ -172,6 +186,7 @@ def all_pairwise_tests(fold_df: pd.DataFrame) -> pd.DataFrame:
                 "sem_delta": float(delta.sem()),
                 "paired_t_p": paired_p,
                 "wilcoxon_p": wp,
+                "corrected_t_p": corrected_ttest(delta, n_splits)[1],
                 "significance_paired_t": p_label(paired_p),
                 "planned_contrast": planned_contrast,
                 "fold_deltas": ";".join(f"{v:.5f}" for v in delta),
@@ -202,44 +217,61 @@ def p_label(p: float) -> str:
     return "n.s."
 
 
-def evaluate_variantwise(df: pd.DataFrame, n_splits: int = 10, seed: int = 16) -> pd.DataFrame:
+def evaluate_variantwise_cell(arrays: dict[str, np.ndarray], cell: tuple) -> dict[str, object]:
+    repeat, fold, model_name, components = cell
+    view = fold_view(arrays, fold, repeat)
+    y_test = view["y_test"]
+    columns = [list(SCORE_COLUMNS).index(c) for c in components]
+    if len(components) == 1:
+        weights = (1.0,)
+    else:
+        candidates = pair_weights(0.01) if len(components) == 2 else triple_weights(0.05)
+        train_scores = [view["train_scores"][:, col] for col in columns]
+        weights = best_weights(view["y_train"], train_scores, candidates)
+    test_scores = [view["test_scores"][:, col] for col in columns]
+    pred = sum(w * s for w, s in zip(weights, test_scores))
+    weight_by_component = dict(zip(components, weights))
+    return {
+        "repeat": repeat,
+        "fold": fold,
+        "model": model_name,
+        "test_auc": roc_auc_score(y_test, pred),
+        "w_esm2_150m": weight_by_component.get("ESM-2 150M", 0.0),
+        "w_esm2_650m": weight_by_component.get("ESM-2 650M", 0.0),
+        "w_esm1b_650m": weight_by_component.get("ESM-1b 650M", 0.0),
+        "w_calm": weight_by_component.get("CaLM", 0.0),
+        "n_test": len(y_test),
+        "n_test_genes": view["n_test_genes"],
+        "n_test_pathogenic": int(y_test.sum()),
+    }
+
+
+def evaluate_variantwise(
+    df: pd.DataFrame,
+    n_splits: int = 10,
+    seed: int = 16,
+    workers: int = 1,
+    registry: Path | None = REGISTRY_DIR,
+    repeats: int = 1,
+) -> pd.DataFrame:
     y = df["label"].to_numpy(dtype=int)
-    splits = list(StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=seed).split(df, y))
-    pair_candidates = pair_weights(0.01)
-    triple_candidates = triple_weights(0.05)
-    rows = []
-    for fold, (train_idx, test_idx) in enumerate(splits, start=1):
-        y_train = y[train_idx]
-        y_test = y[test_idx]
-        for model_name, components in MODEL_SPECS:
-            if len(components) == 1:
-                weights = (1.0,)
-            else:
-                candidates = pair_candidates if len(components) == 2 else triple_candidates
-                train_scores = [df.iloc[train_idx][SCORE_COLUMNS[c]].to_numpy(float) for c in components]
-                weights = best_weights(y_train, train_scores, candidates)
-            test_scores = [df.iloc[test_idx][SCORE_COLUMNS[c]].to_numpy(float) for c in components]
-            pred = sum(w * s for w, s in zip(weights, test_scores))
-            weight_by_component = dict(zip(components, weights))
-            rows.append(
-                {
-                    "fold": fold,
-                    "model": model_name,
-                    "test_auc": roc_auc_score(y_test, pred),
-                    "w_esm2_150m": weight_by_component.get("ESM-2 150M", 0.0),
-                    "w_esm2_650m": weight_by_component.get("ESM-2 650M", 0.0),
-                    "w_esm1b_650m": weight_by_component.get("ESM-1b 650M", 0.0),
-                    "w_calm": weight_by_component.get("CaLM", 0.0),
-                    "n_test": len(test_idx),
-                    "n_test_genes": df.iloc[test_idx]["Gene_prot"].nunique(),
-                    "n_test_pathogenic": int(y_test.sum()),
-                }
-            )
-    return pd.DataFrame(rows)
+    cells = [
+        (repeat, fold, model_name, components)
+        for repeat in range(1, repeats + 1)
+        for fold in range(1, n_splits + 1)
+        for model_name, components in MODEL_SPECS
+    ]
+    arrays = {
+        "scores": np.column_stack([df[col].to_numpy(float) for col in SCORE_COLUMNS.values()]),
+        "y": y,
+        "fold_ids": repeated_fold_ids(y, None, n_splits, seed, repeats, kind="stratified", registry=registry),
+        "gene_codes": pd.factorize(df["Gene_prot"].astype(str))[0],
+    }
+    return pd.DataFrame(run_cells(evaluate_variantwise_cell, cells, arrays, workers))
 
 
 def plot_fold_delta_distribution(gene_folds: pd.DataFrame) -> None:
-    wide = gene_folds.pivot(index="fold", columns="model", values="test_auc")
+    wide = with_repeat(gene_folds).pivot(index=["repeat", "fold"], columns="model", values="test_auc")
     rows = []
     full_labels = {
         "ESM-2 150M + ESM-2 650M vs ESM-2 650M": "ESM-2 (150M) + ESM-2 (650M) vs ESM-2 (650M)",
@@ -252,8 +284,8 @@ def plot_fold_delta_distribution(gene_folds: pd.DataFrame) -> None:
         ),
     }
     for a, b, label in PLANNED_CONTRASTS:
-        for fold, delta in (wide[a] - wide[b]).items():
-            rows.append({"contrast": label, "fold": fold, "delta": delta})
+        for (repeat, fold), delta in (wide[a] - wide[b]).items():
+            rows.append({"contrast": label, "repeat": repeat, "fold": fold, "delta": delta})
     df = pd.DataFrame(rows)
     order = [label for _, _, label in PLANNED_CONTRASTS]
     fig, ax = plt.subplots(figsize=(6.6, 3.0))
@@ -394,22 +426,32 @@ def plot_weight_distribution(gene_folds: pd.DataFrame) -> None:
     plt.close(fig)
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_repeat_args(parser)
+    add_worker_args(parser)
+    add_registry_args(parser)
+    return parser.parse_args()
+
+
 def main() -> None:
+    args = parse_args()
     OUT_DIR.mkdir(parents=True, exist_ok=True)
     FIG_DIR.mkdir(parents=True, exist_ok=True)
     setup()
 
     gene_folds = pd.read_csv(FOLD_RESULTS)
-    score_df = pd.read_csv(SCORE_TABLE)
+    score_df = load_score_table(SCORE_TABLE, columns=["label", "Gene_prot", *SCORE_COLUMNS.values()], compact=True)
 
     all_pairwise = all_pairwise_tests(gene_folds)
     all_pairwise.to_csv(OUT_DIR / "supp_table_model_control_all_pairwise_tests.csv", index=False)
 
     variant_fold_path = OUT_DIR / "model_control_variantwise_fold_results.csv"
-    if variant_fold_path.exists():
-        variant_folds = pd.read_csv(variant_fold_path)
-    else:
-        variant_folds = evaluate_variantwise(score_df)
+    variant_folds = with_repeat(pd.read_csv(variant_fold_path)) if variant_fold_path.exists() else None
+    if variant_folds is None or variant_folds["repeat"].nunique() != args.repeats:
+        variant_folds = evaluate_variantwise(
+            score_df, workers=args.workers, registry=args.split_registry, repeats=args.repeats
+        )
         variant_folds.to_csv(variant_fold_path, index=False)
 
     cv_comparison = plot_cv_comparison(gene_folds, variant_folds)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""Integer-packed variant keys.
+
+A variant (gene, site, ref aa, alt aa, ref codon, alt codon) is packed into
+one non-negative int64 so score tables join on a single integer column
+instead of several string columns. Bit layout, most significant first:
+
+    gene id (19) | site (20) | ref aa (5) | alt aa (5) | ref codon (7) | alt codon (7)
+
+Amino acids are indices into ``snv_engine.AA_ORDER`` and codons indices into
+``config.codon_list`` (DNA or RNA spelling); missing values use
+``MISSING_AA`` / ``MISSING_CODON`` and a missing site is 0. A value that is
+present but unrecognised (an unknown amino acid or codon, a non-numeric
+site) cannot be packed without colliding with every other such variant, so
+its row gets a missing key (``<NA>`` in a nullable Int64 array); callers
+keep those rows out of key-based deduplication and joins. Gene ids come
+from a ``GeneDictionary``, which is append-only so keys written to disk stay
+valid as new genes are added.
+"""
+
+from __future__ import annotations
+
+import csv
+import fcntl
+import hashlib
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from snv_engine import AA_ORDER, CODON_INDEX
+
+
+GENE_IDS = Path("Results/Revision/variant_keys/gene_ids.tsv")
+GENE_BITS, SITE_BITS, AA_BITS, CODON_BITS = 19, 20, 5, 7
+MISSING_AA = 2**AA_BITS - 1
+MISSING_CODON = 64
+CODON_SHIFT = (0, CODON_BITS)
+AA_SHIFT = (2 * CODON_BITS, 2 * CODON_BITS + AA_BITS)
+SITE_SHIFT = 2 * CODON_BITS + 2 * AA_BITS
+GENE_SHIFT = SITE_SHIFT + SITE_BITS
+AA_CODES = {aa: idx for idx, aa in enumerate(AA_ORDER)}
+CODON_NAMES = np.array(list(CODON_INDEX) + [""], dtype=object)
+AA_NAMES = np.array(list(AA_ORDER) + [""] * (MISSING_AA + 1 - len(AA_ORDER)), dtype=object)
+
+
+class GeneDictionary:
+    """
+    Append-only gene -> id table, optionally persisted as a two-column TSV.
+
+    A persisted dictionary assigns new ids under an exclusive lock on the
+    TSV, after re-reading rows other processes appended, and writes them
+    straight away, so concurrent runs sharing the file never give two genes
+    the same id. Runs on different machines with separate files can still
+    disagree; ``fingerprint`` identifies a dictionary so such outputs are
+    refused when they are combined.
+    """
+
+    def __init__(self, path: Path | None = None):
+        self.path = None if path is None else Path(path)
+        self.ids: dict[str, int] = {}
+        self.n_saved = 0
+        if self.path is not None and self.path.exists():
+            self.reload()
+
+    def reload(self) -> None:
+        """Read rows appended to the TSV since it was last read."""
+        with self.path.open() as handle:
+            for row in csv.DictReader(handle, delimiter="\t"):
+                gene, idx = row["gene"], int(row["gene_id"])
+                if self.ids.setdefault(gene, idx) != idx:
+                    raise ValueError(f"{self.path} maps {gene} to {idx}, but it was loaded as {self.ids[gene]}")
+        self.n_saved = len(self.ids)
+
+    @contextmanager
+    def locked(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def assign(self, genes: list[str]) -> None:
+        for gene in genes:
+            if gene not in self.ids:
+                if len(self.ids) >= 2**GENE_BITS:
+                    raise ValueError(f"Gene dictionary is full ({2**GENE_BITS} genes)")
+                self.ids[gene] = len(self.ids)
+
+    def encode(self, genes: pd.Series) -> np.ndarray:
+        values = genes.astype(str)
+        new = [gene for gene in values.unique() if gene not in self.ids]
+        if new and self.path is None:
+            self.assign(new)
+        elif new:
+            with self.locked():
+                self.reload()
+                self.assign(new)
+                self.append()
+        return values.map(self.ids).to_numpy(dtype=np.int64)
+
+    def decode(self, ids: np.ndarray) -> np.ndarray:
+        names = np.empty(len(self.ids), dtype=object)
+        for gene, idx in self.ids.items():
+            names[idx] = gene
+        return names[np.asarray(ids, dtype=np.int64)]
+
+    def fingerprint(self) -> str:
+        """Hash of every (id, gene) pair; equal fingerprints give equal keys."""
+        digest = hashlib.sha1()
+        for gene, idx in sorted(self.ids.items(), key=lambda item: item[1]):
+            digest.update(f"{idx}\t{gene}\n".encode())
+        return digest.hexdigest()
+
+    def append(self) -> None:
+        new = sorted((idx, gene) for gene, idx in self.ids.items() if idx >= self.n_saved)
+        if not new:
+            return
+        write_header = not self.path.exists() or self.path.stat().st_size == 0
+        with self.path.open("a", newline="") as handle:
+            writer = csv.writer(handle, delimiter="\t")
+            if write_header:
+                writer.writerow(["gene", "gene_id"])
+            writer.writerows((gene, idx) for idx, gene in new)
+        self.n_saved = len(self.ids)
+
+    def save(self) -> None:
+        """Append genes added since the last load or save."""
+        if self.path is None or len(self.ids) == self.n_saved:
+            return
+        with self.locked():
+            self.append()
+
+
+def aa_codes(values: pd.Series | None, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """Amino-acid codes and a mask of values that are present but not amino acids."""
+    if values is None:
+        return np.full(n, MISSING_AA, dtype=np.int64), np.zeros(n, dtype=bool)
+    codes = values.astype(object).map(AA_CODES)
+    return codes.fillna(MISSING_AA).to_numpy(dtype=np.int64), (codes.isna() & values.notna()).to_numpy()
+
+
+def codon_codes(values: pd.Series | None, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """Codon codes and a mask of values that are present but not codons."""
+    if values is None:
+        return np.full(n, MISSING_CODON, dtype=np.int64), np.zeros(n, dtype=bool)
+    codons = values.astype(object).map(str).str.upper().str.replace("T", "U").map(CODON_INDEX)
+    return codons.fillna(MISSING_CODON).to_numpy(dtype=np.int64), (codons.isna() & values.notna()).to_numpy()
+
+
+def encode_variant_keys(
+    genes: GeneDictionary,
+    gene: pd.Series,
+    site: pd.Series,
+    ref_aa: pd.Series | None = None,
+    alt_aa: pd.Series | None = None,
+    ref_codon: pd.Series | None = None,
+    alt_codon: pd.Series | None = None,
+) -> pd.arrays.IntegerArray:
+    """
+    Pack variant columns into int64 keys; omitted columns are encoded as missing.
+
+    Rows with an unrecognised amino acid, codon or site get ``<NA>``.
+    """
+    n = len(gene)
+    numeric_sites = pd.to_numeric(site, errors="coerce")
+    invalid = (numeric_sites.isna() & site.notna()).to_numpy(dtype=bool, copy=True)
+    sites = numeric_sites.fillna(0).to_numpy(dtype=np.int64)
+    if ((sites < 0) | (sites >= 2**SITE_BITS)).any():
+        raise ValueError(f"Sites must lie in [0, {2**SITE_BITS})")
+    keys = (genes.encode(gene) << GENE_SHIFT) | (sites << SITE_SHIFT)
+    fields = [
+        (aa_codes(ref_aa, n), AA_SHIFT[1]),
+        (aa_codes(alt_aa, n), AA_SHIFT[0]),
+        (codon_codes(ref_codon, n), CODON_SHIFT[1]),
+        (codon_codes(alt_codon, n), CODON_SHIFT[0]),
+    ]
+    for (codes, unrecognised), shift in fields:
+        keys |= codes << shift
+        invalid |= unrecognised
+    return pd.arrays.IntegerArray(keys, invalid)
+
+
+def decode_variant_keys(genes: GeneDictionary, keys: np.ndarray) -> pd.DataFrame:
+    keys = np.asarray(keys, dtype=np.int64)
+    aa_mask = 2**AA_BITS - 1
+    codon_mask = 2**CODON_BITS - 1
+    return pd.DataFrame(
+        {
+            "gene": genes.decode(keys >> GENE_SHIFT),
+            "site": (keys >> SITE_SHIFT) & (2**SITE_BITS - 1),
+            "ref_aa": AA_NAMES[(keys >> AA_SHIFT[1]) & aa_mask],
+            "alt_aa": AA_NAMES[(keys >> AA_SHIFT[0]) & aa_mask],
+            "ref_codon": CODON_NAMES[np.minimum((keys >> CODON_SHIFT[1]) & codon_mask, MISSING_CODON)],
+            "alt_codon": CODON_NAMES[np.minimum((keys >> CODON_SHIFT[0]) & codon_mask, MISSING_CODON)],
+        }
+    )
@@ -0,0 +1,68 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bin"))
+
+from prepare_variant_datasets import USECOLS, prepare_clinvar  # noqa: E402
+
+
+def write_release(path, n_rows=20, empty_rows=7):
+    """Synthetic variant_summary.txt whose PhenotypeList/RS#/LastEvaluated are empty in the first rows."""
+    rows = []
+    for i in range(n_rows):
+        gene = f"GENE{i % 3}"
+        rows.append({
+            '#AlleleID': i + 1,
+            'Type': 'single nucleotide variant',
+            'Name': f"NM_00000{i % 3}.1({gene}):c.{100 + i}A>G (p.Lys{34 + i}Glu)",
+            'GeneID': 1000 + i % 3,
+            'GeneSymbol': gene,
+            'ClinicalSignificance': 'Pathogenic' if i % 2 else 'Benign',
+            'ClinSigSimple': i % 2,
+            'LastEvaluated': '' if i < empty_rows else 'Jan 01, 2020',
+            'RS# (dbSNP)': '' if i < empty_rows else 5000 + i,
+            'PhenotypeList': '' if i < empty_rows else f"x{i}",
+            'OriginSimple': 'germline',
+            'Assembly': 'GRCh38',
+            'Chromosome': str(1 + i % 2),
+            'Start': 10_000 + i,
+            'Stop': 10_000 + i,
+            'ReferenceAlleleVCF': 'A',
+            'AlternateAlleleVCF': 'G',
+            'ReviewStatus': 'criteria provided, single submitter',
+            'NumberSubmitters': 1,
+            'VariationID': 7000 + i,
+        })
+    pd.DataFrame(rows, columns=USECOLS).to_csv(path, sep='\t', index=False)
+
+
+def test_chunked_parquet_matches_single_chunk(tmp_path):
+    release = tmp_path / "variant_summary.txt"
+    write_release(release)
+    chunked = tmp_path / "chunked.parquet"
+    whole = tmp_path / "whole.parquet"
+
+    genes_chunked = prepare_clinvar(str(release), str(chunked), chunk_size=7)
+    genes_whole = prepare_clinvar(str(release), str(whole), chunk_size=1_000)
+
+    out = pd.read_parquet(chunked)
+    assert len(out) == 20
+    assert out['PhenotypeList'].isna().sum() == 7
+    assert out.loc[7, 'PhenotypeList'] == 'x7'
+    pd.testing.assert_frame_equal(out, pd.read_parquet(whole))
+    keys = ['Transcript', 'Gene']
+    pd.testing.assert_frame_equal(genes_chunked[keys], genes_whole[keys])
+
+
+def test_chunked_csv_keeps_every_row(tmp_path):
+    release = tmp_path / "variant_summary.txt"
+    write_release(release)
+    output = tmp_path / "filtered.csv"
+
+    prepare_clinvar(str(release), str(output), chunk_size=7)
+
+    out = pd.read_csv(output)
+    assert len(out) == 20
+    assert out['PhenotypeList'].iloc[7:].tolist() == [f"x{i}" for i in range(7, 20)]